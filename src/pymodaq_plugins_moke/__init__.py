@@ -1,8 +1,14 @@
 from pathlib import Path
 from pymodaq.utils.logger import set_logger  # to be imported by other modules.
+from pymodaq.utils.daq_utils import get_instrument_plugins
 
 from .utils import Config
 config = Config()
 
 with open(str(Path(__file__).parent.joinpath('resources/VERSION')), 'r') as fvers:
     __version__ = fvers.read().strip()
+
+if get_instrument_plugins.cache_info().currsize != 0:
+    # pymodaq was first imported just above (e.g. python -m pymodaq_plugins_moke.headless): its cached discovery of
+    # the plugins ran while this package was not initialized and missed them
+    get_instrument_plugins.cache_clear()
@@ -1,15 +1,23 @@
 from pymodaq.control_modules.move_utility_classes import DAQ_Move_base, comon_parameters_fun, main
 from pymodaq.utils.daq_utils import ThreadCommand, getLineInfo  # object used to send info back to the main thread
 from easydict import EasyDict as edict  # type of dict
+from qtpy import QtCore
 import numpy as np
-from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import (DAQmx, ClockSettings, AIChannel, AOChannel)
+from time import sleep, perf_counter
 from pymodaq_plugins_moke import config
+from pymodaq_plugins_moke.hardware.current_readback import ReadbackCache
+from pymodaq_plugins_moke.hardware.settling import SettlingModel, settling_time
+from pymodaq_plugins_moke.hardware.daqmx_arbiter import get_arbiter, get_device
+from pymodaq_plugins_moke.hardware.task_cache import DAQmxTaskCache
+from pymodaq_plugins_moke.hardware.nidaq_enumeration import get_enumeration
 
 device_ao = config('micro', 'current', 'device_ao')
 channel_ao = config('micro', 'current', 'channel_ao')
 device_ai = config('micro', 'current', 'device_ai')
 channel_ai = config('micro', 'current', 'channel_ai')
 resistor = config('micro', 'current', 'resistor')
+trigger_do = config('micro', 'current', 'trigger_do')
+ao_clock = config('micro', 'current', 'ao_clock')
 
 
 class DAQ_Move_Current(DAQ_Move_base):
@@ -24,33 +32,72 @@ class DAQ_Move_Current(DAQ_Move_base):
     _controller_units = 'V'
     ao_limits = [-1, 1]
     _epsilon = 0.005
+    latency_display_period = 0.5  # s, at most one update of the displayed write latency per period
+
+    # parameters on which each DAQmx task configuration depends
+    task_params = dict(ao=['ao_channel', 'ao_min', 'ao_max'],
+                       ai=['read_ai', 'ai_channel', 'ai_min', 'ai_max'])
 
     is_multiaxes = False  # set to True if this plugin is controlled for a multiaxis controller (with a unique communication link)
     stage_names = []
+    # pymodaq imports every plugin module at startup: the lists are limited to the configured values until ini_stage
+    # enumerates the hardware (see set_enumerated_limits), the daqmx package being only imported from there too
     params = [ {'title': 'Device:', 'name': 'device', 'type': 'list',
-                      'values': DAQmx.get_NIDAQ_devices(), 'value': device_ao},
+                      'values': [device_ao], 'value': device_ao},
                  {'title': 'AO Voltage:', 'name': 'ao', 'type': 'group', 'children': [
                      {'title': 'Name:', 'name': 'ao_channel', 'type': 'list',
-                      'values': DAQmx.get_NIDAQ_channels(devices=[device_ao], source_type='Analog_Output'),
+                      'values': [f'{device_ao}/{channel_ao}'],
                       'value': f'{device_ao}/{channel_ao}'},
                      {'title': 'Min:', 'name': 'ao_min', 'type': 'list',
-                      'values': [r[0] for r in DAQmx.getAOVoltageRange(device_ao)]},
+                      'values': [-10.]},
                      {'title': 'Max:', 'name': 'ao_max', 'type': 'list',
-                      'values': [r[1] for r in DAQmx.getAOVoltageRange(device_ao)]},
-                     {'title': 'Scaling:', 'name': 'controller_scaling', 'type': 'float', 'value': 0.402}
+                      'values': [10.]},
+                     {'title': 'Scaling:', 'name': 'controller_scaling', 'type': 'float', 'value': 0.402},
+                     {'title': 'Write latency:', 'name': 'latency', 'type': 'float', 'value': 0., 'readonly': True,
+                      'suffix': 'ms', 'tip': 'Averaged duration of the AO write of a single move'},
                  ]},
                {'title': 'AI Voltage:', 'name': 'ai', 'type': 'group', 'children': [
                    {'title': 'Read from ai?', 'name': 'read_ai', 'type': 'bool', 'value': False},
                    {'title': 'Name:', 'name': 'ai_channel', 'type': 'list',
-                    'values': DAQmx.get_NIDAQ_channels(devices=[device_ai], source_type='Analog_Input'),
+                    'values': [f'{device_ai}/{channel_ai}'],
                     'value': f'{device_ai}/{channel_ai}'},
                    {'title': 'Min:', 'name': 'ai_min', 'type': 'list',
-                    'values': [r[0] for r in DAQmx.getAIVoltageRange(device_ai)]},
+                    'values': [-10.]},
                    {'title': 'Max:', 'name': 'ai_max', 'type': 'list',
-                    'values': [r[1] for r in DAQmx.getAIVoltageRange(device_ai)]},
+                    'values': [10.]},
                    {'title': 'Resistor (Ohm):', 'name': 'resistor', 'type': 'float',
                     'value': resistor},
                    {'title': 'Use Resistor?', 'name': 'use_R', 'type': 'bool', 'value': True},
+                   {'title': 'Settling window:', 'name': 'settle_window', 'type': 'int', 'value': 5, 'min': 1,
+                    'tip': 'Number of consecutive readback blocks (see the daqmx section of the config) to be within '
+                           'epsilon of the target '
+                           'for the move to be done'},
+               ]},
+               {'title': 'Settling:', 'name': 'settling', 'type': 'group', 'children': [
+                   {'title': 'Wait settling?', 'name': 'wait_settling', 'type': 'bool', 'value': True,
+                    'tip': 'Without readback, the move is done once the settling time predicted for the step has '
+                           'elapsed. With readback, the readback is polled every block period and the model is '
+                           'fitted on the measured settling times'},
+                   {'title': 'Dead time (ms):', 'name': 'dead_time', 'type': 'float', 'value': 2., 'min': 0.},
+                   {'title': 'Time constant (ms):', 'name': 'tau', 'type': 'float', 'value': 5., 'min': 0.},
+                   {'title': 'Max time (ms):', 'name': 'max_time', 'type': 'float', 'value': 1000., 'min': 0.},
+                   {'title': 'Measurements:', 'name': 'Nmeasurements', 'type': 'int', 'value': 0,
+                    'readonly': True},
+               ]},
+               {'title': 'Sequence:', 'name': 'sequence', 'type': 'group', 'children': [
+                   {'title': 'Frequency:', 'name': 'frequency', 'type': 'float', 'value': 10000., 'min': 1.,
+                    'suffix': 'Hz'},
+                   {'title': 'Hold time:', 'name': 'hold_time', 'type': 'float', 'value': 10., 'min': 0.,
+                    'suffix': 'ms', 'tip': 'Duration of each current step of a played sequence'},
+                   {'title': 'Read back current?', 'name': 'readback', 'type': 'bool', 'value': False,
+                    'tip': 'Acquire the AI channel on the AO sample clock while playing and return the measured '
+                           'current (mean and std) for each step'},
+                   {'title': 'Trigger camera?', 'name': 'trigger', 'type': 'bool', 'value': False,
+                    'tip': 'Output a rising edge in the middle of each step'},
+                   {'title': 'Trigger DO:', 'name': 'trigger_do', 'type': 'list',
+                    'limits': [trigger_do], 'value': trigger_do},
+                   {'title': 'AO clock:', 'name': 'ao_clock', 'type': 'list',
+                    'limits': [ao_clock], 'value': ao_clock},
                ]}] + comon_parameters_fun(is_multiaxes, epsilon=_epsilon)
 
     def __init__(self, parent=None, params_state=None):
@@ -67,6 +114,25 @@ class DAQ_Move_Current(DAQ_Move_base):
         """
 
         super().__init__(parent, params_state)
+        self.channels_ao = None
+        self.channels_ai = None
+        self._task_configs = dict([])
+        self._ao_buffer = None
+        self._ao_voltage = 0.
+        self._latency = None
+        self._latency_displayed_at = 0.
+        self.readback_cache = ReadbackCache()
+        self.readback_subscription = None
+        self.settling_model = SettlingModel(a=self.settings['settling', 'dead_time'] / 1000,
+                                            tau=self.settings['settling', 'tau'] / 1000,
+                                            max_time=self.settings['settling', 'max_time'] / 1000)
+        self._settle_start = None
+        self._settle_delta = None
+        self._poll_interval = self.poll_timer.interval()
+        self.poll_timer.timeout.connect(self.display_latency)
+        self.settle_timer = QtCore.QTimer()
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.timeout.connect(self.settled)
 
     def get_actuator_value(self):
         """Get the current position from the hardware with scaling conversion.
@@ -75,24 +141,56 @@ class DAQ_Move_Current(DAQ_Move_base):
         -------
         float: The position obtained after scaling conversion.
         """
-        if not self.settings['ai', 'read_ai']:
-            pos = self.target_position
-        else:
-            while not self.controller['ai'].isTaskDone():
-                self.controller['ai'].task.StopTask()
-
-            data = self.controller['ai'].readAnalog(len(self.channels_ai), self.clock_settings_ai)
-            pos = np.mean(data) / self.settings.child('ai', 'resistor').value()
-
+        # the readback cache is emptied while a plugin uses the device (no shared acquisition) and until the first
+        # block: the commanded value is returned instead of waiting for the hardware
+        voltage, _ = self.readback_cache.latest
+        if self.settings['ai', 'read_ai'] and voltage is not None:
+            if self._settle_start is not None:
+                self.check_settling()
+            return self.get_position_with_scaling(voltage / self.settings['ai', 'resistor'])
+
+        pos = self.target_position
         pos = self.get_position_with_scaling(pos)
         return pos
 
+    def check_settling(self):
+        """End the settling of a move with readback once the settle window latest readback values are all within
+        epsilon of the target, feeding the settling model with the time of the first readback block after which the
+        current stayed within epsilon"""
+        voltages = self.readback_cache.get_values(self.settings['ai', 'settle_window'])
+        positions = self.get_position_with_scaling(voltages / self.settings['ai', 'resistor'])
+        if positions.size == self.settings['ai', 'settle_window'] and \
+                np.all(np.abs(positions - self.target_position) < self.settings['epsilon']):
+            values, times = self.readback_cache.get_since(self._settle_start)
+            duration = settling_time(times, self.get_position_with_scaling(values / self.settings['ai', 'resistor']),
+                                     self.target_position, self.settings['epsilon'], self._settle_start)
+            if duration is not None:
+                self.settling_model.add_measurement(self._settle_delta, self.settings['epsilon'], duration)
+                self.update_settling_params()
+            self._settle_start = None
+
+    def user_condition_to_reach_target(self):
+        """With readback, the move is done once the whole settle window is within epsilon (see check_settling), not
+        as soon as the latest readback value is"""
+        return not self.settings['ai', 'read_ai'] or self.readback_cache.latest[0] is None or self._settle_start is None
+
     def close(self):
         """
         Terminate the communication protocol
         """
-        pass
-        ##
+        self.stop_readback()
+        self.controller['sequence_tasks'].clear()
+
+    def start_readback(self):
+        """Subscribe the AI channel to the shared acquisition of its device, feeding the readback cache"""
+        self.readback_cache.clear()
+        self.readback_subscription = get_arbiter().subscribe(self.channels_ai, self.readback_cache.push,
+                                                             self.readback_cache.suspend)
+
+    def stop_readback(self):
+        if self.readback_subscription is not None:
+            get_arbiter().unsubscribe(self.readback_subscription)
+            self.readback_subscription = None
 
     def commit_settings(self, param):
         """
@@ -102,21 +200,45 @@ class DAQ_Move_Current(DAQ_Move_base):
 
         """
         if param.name() == 'device':
-            channels = DAQmx.get_NIDAQ_channels(devices=[param.value()], source_type='Analog_Output')
+            channels = get_enumeration().get_channels(devices=[param.value()], source_type='Analog_Output')
             self.settings.child('ao', 'ao_channel').setOpts(limits=channels)
 
         if param.name() == 'ao_channel':
             self.get_dynamics()
 
-        self.update_tasks()
+        if param.name() in ['dead_time', 'tau', 'max_time']:
+            self.settling_model.a = self.settings['settling', 'dead_time'] / 1000
+            self.settling_model.tau = self.settings['settling', 'tau'] / 1000
+            self.settling_model.max_time = self.settings['settling', 'max_time'] / 1000
+
+        tasks = [task for task in self.task_params if param.name() in self.task_params[task]]
+        if len(tasks) != 0:
+            self.update_tasks(tasks)
 
     def get_dynamics(self):
         device = self.settings.child('device').value()
-        ranges = self.controller['ao'].getAIVoltageRange(device)
+        ranges = get_enumeration().get_ao_voltage_ranges(device)
 
         self.settings.child('ao', 'ao_min').setOpts(limits=[r[0] for r in ranges])
         self.settings.child('ao', 'ao_max').setOpts(limits=[r[1] for r in ranges])
 
+    def set_enumerated_limits(self):
+        """Limit the list parameters to the devices, channels and voltage ranges of the NI-DAQ enumeration"""
+        enumeration = get_enumeration()
+        self.settings.child('device').setOpts(limits=enumeration.get_devices())
+        self.settings.child('ao', 'ao_channel').setOpts(
+            limits=enumeration.get_channels(devices=[self.settings['device']], source_type='Analog_Output'))
+        self.get_dynamics()
+        device = get_device(self.settings['ai', 'ai_channel'])
+        ranges = enumeration.get_ai_voltage_ranges(device)
+        self.settings.child('ai', 'ai_channel').setOpts(
+            limits=enumeration.get_channels(devices=[device], source_type='Analog_Input'))
+        self.settings.child('ai', 'ai_min').setOpts(limits=[r[0] for r in ranges])
+        self.settings.child('ai', 'ai_max').setOpts(limits=[r[1] for r in ranges])
+        self.settings.child('sequence', 'trigger_do').setOpts(
+            limits=enumeration.get_channels(source_type='Digital_Output'))
+        self.settings.child('sequence', 'ao_clock').setOpts(limits=enumeration.get_channels(source_type='Terminals'))
+
     def ini_stage(self, controller=None):
         """Actuator communication initialization
 
@@ -134,6 +256,7 @@ class DAQ_Move_Current(DAQ_Move_base):
 
 
         try:
+            from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import DAQmx
             # initialize the stage and its controller status
             # controller is an object that may be passed to other instances of DAQ_Move_Mock in case
             # of one controller controlling multiactuators (or detector)
@@ -150,8 +273,14 @@ class DAQ_Move_Current(DAQ_Move_base):
                     self.controller = controller
             else:  # Master stage
 
-                self.controller = dict(ao=DAQmx(), ai=DAQmx())
+                # ao is the on demand task of the moves. The AO, trigger and readback tasks of the sequences are cached
+                # by configuration (the sequences of a scan mostly have the same length) instead of reconfiguring the
+                # move task for each sequence. The continuous readback is shared with the other plugins through the
+                # DAQmx arbiter
+                self.controller = dict(ao=DAQmx(), sequence_tasks=DAQmxTaskCache(DAQmx, maxsize=6))
 
+            self.set_enumerated_limits()
+            self._task_configs = dict([])
             self.update_tasks()
 
             self.status.info = "Controller to get/set the current in coil"
@@ -165,7 +294,20 @@ class DAQ_Move_Current(DAQ_Move_base):
             self.status.initialized = False
             return self.status
 
-    def update_tasks(self):
+    def update_tasks(self, tasks=None):
+        """Build the channels and configure the DAQmx tasks
+
+        The AO task is kept alive between moves: a task whose parameters did not change since its last configuration
+        is reused as is and a reconfigured AO task is set back to the present output value instead of zero.
+
+        Parameters
+        ----------
+        tasks: (list of str) keys of the controller tasks to configure ('ao' and/or 'ai'), all of them if None
+        """
+        from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import ClockSettings, AIChannel, AOChannel
+
+        if tasks is None:
+            tasks = list(self.task_params.keys())
 
         self.channels_ao = [AOChannel(name=self.settings.child('ao', 'ao_channel').value(),
                                    source='Analog_Output', analog_type='Voltage',
@@ -177,25 +319,24 @@ class DAQ_Move_Current(DAQ_Move_base):
                                    value_min=self.settings.child('ai', 'ai_min').value(),
                                    value_max=self.settings.child('ai', 'ai_max').value())]
 
-        self.stop_task_and_zero()
-
-        clock_settings = ClockSettings(frequency=1000, Nsamples=1)
-        self.controller['ao'].update_task(self.channels_ao, clock_settings)
-
-        self.clock_settings_ai = ClockSettings(frequency=1000, Nsamples=10)
-        self.controller['ai'].update_task(self.channels_ai, self.clock_settings_ai)
-
+        for task in tasks:
+            task_config = tuple([self.settings.child(task, name).value() for name in self.task_params[task]])
+            if self._task_configs.get(task, None) == task_config:
+                continue
+            if task == 'ao':
+                if self.controller['ao'].task is not None and not self.controller['ao'].isTaskDone():
+                    self.controller['ao'].stop()
+                self.controller['ao'].update_task(self.channels_ao, ClockSettings(frequency=1000, Nsamples=1))
+                self._ao_buffer = np.zeros((len(self.channels_ao),), dtype=float)
+                self.write_ao(self._ao_voltage)  # preserve the present output
+            elif task == 'ai':
+                self.stop_readback()
+                if self.settings['ai', 'read_ai']:
+                    self.start_readback()
+            self._task_configs[task] = task_config
 
     def stop_task_and_zero(self, zero=0.):
-
-        if self.controller['ao'].task is not None:
-            if not self.controller['ao'].isTaskDone():
-                self.controller['ao'].stop()
-
-        clock_settings = ClockSettings(frequency=1000, Nsamples=1)
-        self.controller['ao'].update_task(self.channels_ao, clock_settings)
-        self.write_ao(0.)
-        self.controller['ao'].stop()
+        self.write_ao(zero)
 
     def move_abs(self, position):
         """ Move the actuator to the absolute target defined by position
@@ -206,6 +347,7 @@ class DAQ_Move_Current(DAQ_Move_base):
         """
 
         position = self.check_bound(position)  #if user checked bounds, the defined bounds are applied here
+        self.start_settling(position - self.target_position)
         self.target_position = position
         position = self.set_position_with_scaling(position)  # apply scaling if the user specified one
         self.write_ao(position / self.settings.child('ao', 'controller_scaling').value())
@@ -218,15 +360,164 @@ class DAQ_Move_Current(DAQ_Move_base):
         position: (flaot) value of the relative target positioning
         """
         position = self.check_bound(self.current_position + position) - self.current_position
+        self.start_settling(position + self.current_position - self.target_position)
         self.target_position = position + self.current_position
         position = self.set_position_relative_with_scaling(position)
         self.write_ao(self.target_position / self.settings.child('ao', 'controller_scaling').value())
 
+    def play_sequence(self, positions, hold_time=None, readback=None):
+        """Play a whole sequence of currents as a hardware clocked AO waveform
+
+        Each position is held during hold_time, optionally with a trigger line, clocked on the AO sample clock,
+        rising in the middle of each step. The method returns once the sequence is played, the output staying on the
+        last position.
+
+        If readback is True, the AI channel is acquired on the same AO sample clock (hence starting with it) and the
+        measured current for each step is sent with a 'sequence_readback' ThreadCommand as a (3, Nsteps) array:
+        the target positions, the mean and the standard deviation of the current over each hold window.
+
+        Parameters
+        ----------
+        positions: (iterable of float) the positions (in actuator units, scaling is applied) to be played in order
+        hold_time: (float) duration of each step in ms, if None the value from the settings is used
+        readback: (bool) if None the value from the settings is used
+
+        Returns
+        -------
+        ndarray or None: the readback array if readback is True
+
+        Raises
+        ------
+        ValueError: if the trigger is enabled and a step is shorter than two AO samples (no rising edge)
+        """
+        from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import ClockSettings, DOChannel
+
+        positions = np.atleast_1d(np.squeeze(np.asarray(positions, dtype=float)))
+        if hold_time is None:
+            hold_time = self.settings['sequence', 'hold_time']
+        if readback is None:
+            readback = self.settings['sequence', 'readback']
+        frequency = self.settings['sequence', 'frequency']
+        Nhold = max((1, int(round(hold_time * 1e-3 * frequency))))
+        if self.settings['sequence', 'trigger'] and Nhold < 2:
+            raise ValueError(f'A hold time of {hold_time}ms is {Nhold} sample at {frequency}Hz: at least 2 samples per '
+                             f'step are needed for the trigger to rise in each step')
+
+        voltages = self.set_position_with_scaling(positions) / self.settings['ao', 'controller_scaling']
+        waveform = np.repeat(voltages, Nhold)
+        Nsamples = waveform.size
+
+        tasks = self.controller['sequence_tasks']
+        clock_settings = ClockSettings(frequency=frequency, Nsamples=Nsamples)
+        clock_settings_external = ClockSettings(source=self.settings['sequence', 'ao_clock'], frequency=frequency,
+                                                Nsamples=Nsamples)  # the tasks started with the AO one
+        sequence_readback = None
+        ao_task = None
+        trigger_task = None
+        readback_task = None
+        device = get_device(self.settings['ai', 'ai_channel'])
+        if readback:
+            get_arbiter().acquire(device)  # pause the shared acquisition
+        try:
+            if self.controller['ao'].task is not None and not self.controller['ao'].isTaskDone():
+                self.controller['ao'].stop()
+            ao_task = tasks.get(('ao',) + self._task_configs['ao'] + (frequency, Nsamples), self.channels_ao,
+                                clock_settings)
+            ao_task.writeAnalog(Nsamples, len(self.channels_ao), waveform, autostart=False)
+
+            if self.settings['sequence', 'trigger']:
+                trigger = np.tile((np.arange(Nhold) >= Nhold // 2).astype(np.uint8), positions.size)
+                trigger_task = tasks.get(('do', self.settings['sequence', 'trigger_do'],
+                                          self.settings['sequence', 'ao_clock'], frequency, Nsamples),
+                                         [DOChannel(name=self.settings['sequence', 'trigger_do'],
+                                                    source='Digital_Output')], clock_settings_external)
+                trigger_task.writeDigital(Nsamples, trigger, autostart=False)
+                trigger_task.start()  # armed, waiting for the AO sample clock
+
+            if readback:
+                readback_task = tasks.get(('ai', self.settings['ai', 'ai_channel'], self.settings['ai', 'ai_min'],
+                                           self.settings['ai', 'ai_max'], self.settings['sequence', 'ao_clock'],
+                                           frequency, Nsamples), self.channels_ai, clock_settings_external)
+                readback_task.start()  # armed, waiting for the AO sample clock
+
+            ao_task.start()
+            while not ao_task.isTaskDone():
+                sleep(min((0.1, Nsamples / frequency)))
+            # the static output is restored on the last position, or on the previous one if the sequence failed
+            self.target_position = positions[-1]
+            self._ao_voltage = voltages[-1]
+
+            if readback:
+                data = readback_task.readAnalog(len(self.channels_ai), clock_settings_external)
+                currents = self.get_position_with_scaling(
+                    np.reshape(data[:Nsamples], (positions.size, Nhold)) / self.settings['ai', 'resistor'])
+                sequence_readback = np.stack((positions, np.mean(currents, 1), np.std(currents, 1)))
+                self.emit_status(ThreadCommand('sequence_readback', [sequence_readback]))
+        finally:
+            # the sequence tasks are stopped, the move task output and the shared acquisition of the device are
+            # given back whatever happened
+            try:
+                for daqmx in (ao_task, trigger_task, readback_task):
+                    if daqmx is not None:
+                        daqmx.stop()
+                self.write_ao(self._ao_voltage)
+            finally:
+                if readback:
+                    get_arbiter().release(device)
+
+        self.emit_status(ThreadCommand('Update_Status', [f'Played a sequence of {positions.size} steps in '
+                                                         f'{Nsamples / frequency:.3f}s']))
+        return sequence_readback
+
+    def start_settling(self, delta):
+        """Start timing the settling of a step of amplitude delta (in actuator units)
+
+        Without readback, the move is ended by the settle timer once the settling time predicted for the step has
+        elapsed, the poll timer (see DAQ_Move_base.poll_moving) being delayed accordingly. With readback, the readback
+        is polled every block period so that the move is done as soon as the current has settled.
+        """
+        self._settle_start = perf_counter()
+        self._settle_delta = delta
+        self.settle_timer.stop()
+        self.poll_timer.setInterval(self._poll_interval)
+        if not self.settings['settling', 'wait_settling']:
+            return
+        if self.settings['ai', 'read_ai']:
+            block_period = config('daqmx', 'block_samples') / config('daqmx', 'frequency')
+            self.poll_timer.setInterval(max((1, int(1000 * block_period))))
+        else:
+            predicted = max((1, int(round(1000 * self.settling_model.predict(delta, self.settings['epsilon'])))))
+            self.poll_timer.setInterval(self._poll_interval + predicted)
+            self.settle_timer.start(predicted)
+
+    def settled(self):
+        """End a move without readback once its predicted settling time has elapsed"""
+        if not self.move_is_done:
+            self.poll_timer.stop()
+            self.move_done()
+
+    def update_settling_params(self):
+        self.settings.child('settling', 'dead_time').setValue(self.settling_model.a * 1000)
+        self.settings.child('settling', 'tau').setValue(self.settling_model.tau * 1000)
+        self.settings.child('settling', 'Nmeasurements').setValue(self.settling_model.count)
+
     def write_ao(self, voltage):
-        self.controller['ao'].writeAnalog(1, len(self.channels_ao),
-                                          np.array([voltage for ind in range(len(self.channels_ao))],
-                                                   dtype=float),
-                                          autostart=True)
+        """Write a single value on all the AO channels of the persistent task using the preallocated buffer"""
+        start = perf_counter()
+        self._ao_buffer.fill(voltage)
+        self.controller['ao'].writeAnalog(1, len(self.channels_ao), self._ao_buffer, autostart=True)
+        self._ao_voltage = voltage
+        latency = (perf_counter() - start) * 1000
+        self._latency = latency if self._latency is None else 0.9 * self._latency + 0.1 * latency
+
+    def display_latency(self):
+        """Show the averaged write latency, at most once per latency_display_period (called by the poll timer, so
+        that the moves only update the average)"""
+        now = perf_counter()
+        if self._latency is not None and now - self._latency_displayed_at > self.latency_display_period:
+            self._latency_displayed_at = now
+            self.settings.child('ao', 'latency').setValue(self._latency)
+
     def move_home(self):
         """
           Send the update status thread command.
@@ -2,11 +2,11 @@ from pymodaq.control_modules.move_utility_classes import DAQ_Move_base, comon_pa
 from pymodaq.utils.daq_utils import ThreadCommand, getLineInfo  # object used to send info back to the main thread
 from easydict import EasyDict as edict  # type of dict
 import numpy as np
-from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import DAQmx, ClockSettings, ChangeDetectionSettings, \
-    AOChannel, \
-    DIChannel
-
+from time import perf_counter, sleep
 from pymodaq_plugins_moke import config
+from pymodaq_plugins_moke.hardware.led_waveform import LedWaveformCompiler
+from pymodaq_plugins_moke.hardware.task_cache import DAQmxTaskCache
+from pymodaq_plugins_moke.hardware.nidaq_enumeration import get_enumeration
 
 
 device = config('micro', 'led', 'device_ao')
@@ -17,6 +17,9 @@ di_name = f"{config('micro', 'led', 'device_di')}/" \
 
 channels = ['top', 'left', 'right', 'bottom']
 led_limit = 3.5
+sync_timeout = config('micro', 'led', 'sync_timeout_s')
+sync_poll_period = 1e-3  # s, between two reads of the camera TTL line, also the accuracy of the frame boundary
+clock_terminal = f"/{config('micro', 'led', 'changedetectionevent_device')}/ChangeDetectionEvent"
 
 
 class DAQ_Move_LedDC4104(DAQ_Move_base):
@@ -33,10 +36,11 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
     is_multiaxes = True  # set to True if this plugin is controlled for a multiaxis controller (with a unique communication link)
     stage_names = ['offset', 'top', 'left', 'right', 'bottom']  # "list of strings of the multiaxes
 
+    # the lists are limited to the configured channels until ini_stage enumerates the hardware (see
+    # DAQ_Move_Current.params)
     params = [{'title': f'{channels[ind]} LED:', 'name': channels[ind], 'type': 'group', 'children': [
                      {'title': 'Name:', 'name': f'{channels[ind]}_ao', 'type': 'list',
-                      'limits': DAQmx.get_NIDAQ_channels(source_type='Analog_Output'),
-                      'value': f'{device}/{ao_channels[ind]}'},
+                      'limits': [f'{device}/{ao_channels[ind]}'], 'value': f'{device}/{ao_channels[ind]}'},
                      {'title': 'Value:', 'name': f'{channels[ind]}_val', 'type': 'float', 'value': 0, 'min': 0,
                       'max': led_limit},
                      {'title': 'Activated?:', 'name': f'{channels[ind]}_act', 'type': 'led_push', 'value': False}
@@ -46,11 +50,9 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
               {'title': 'Activate All:', 'name': 'activate_all', 'type': 'led_push', 'value': False},
               {'title': 'Digital Triggering:', 'name': 'digital', 'type': 'group', 'children': [
                   {'title': 'Change on:', 'name': 'digital_di', 'type': 'list',
-                   'limits': DAQmx.get_NIDAQ_channels(source_type='Digital_Input'),
-                   'value': di_name},
+                   'limits': [di_name], 'value': di_name},
                   {'title': 'Clock on:', 'name': 'digital_clock', 'type': 'list',
-                   'limits': DAQmx.get_NIDAQ_channels(source_type='Terminals'),
-                   'value': f"/{config('micro', 'led', 'changedetectionevent_device')}/ChangeDetectionEvent"},
+                   'limits': [clock_terminal], 'value': clock_terminal},
                   {'title': 'Activated?:', 'name': 'digital_act', 'type': 'led_push', 'value': False},
               ]}] + comon_parameters_fun(is_multiaxes, axes_names=stage_names)
 
@@ -71,9 +73,15 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
         self.led_values = dict(zip(channels, [{f'{chan}_act': False,
                                                     f'{chan}_val': 0.} for chan in channels]))
         self.led_type = 'manual'
+        self._setting_external = False
 
         self.sequence_list = [dict(top=True, bottom=False, left=False, right=False),
                               dict(top=False, bottom=True, left=False, right=False),]
+        self.sequence_blank = True
+        self.waveform_compiler = LedWaveformCompiler(channels)
+        self._sequence_task = None  # the clocked AO task of the present sequence (see update_tasks)
+        self._clock_task = None  # the change detection task clocking it
+        self._static_channels = None  # the AO channels the manual task is configured for
 
     def get_actuator_value(self):
         """Get the current position from the hardware with scaling conversion.
@@ -93,8 +101,7 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
         """
         Terminate the communication protocol
         """
-        pass
-        ##
+        self.controller['sequence_tasks'].clear()
 
     def commit_settings(self, param):
         """
@@ -110,6 +117,8 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
 
         flag = '_act' in param.name() or '_val' in param.name() or 'offset' in param.name() or \
                'activate_all' in param.name()
+        if flag and self._setting_external:
+            return  # set_leds_external updates the LEDs once all the values are set
         if flag and 'digital_act' != param.name() and not self.settings.child('digital', 'digital_act').value():
             """
             If only activated state or value of the led is changed, just update the "manual" value, else update the task
@@ -118,11 +127,33 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
         else:
             self.update_tasks()
 
-    def set_leds_external(self, led_values):
-        for led in led_values:
-            self.settings.child(led, f'{led}_act').setValue(led_values[led][f'{led}_act'])
-            self.settings.child(led, f'{led}_val').setValue(led_values[led][f'{led}_val'])
-        self.check_led_and_update()
+    def set_leds_external(self, led_values, camera_idle=False):
+        """Set the values of the LEDs, updating the hardware once
+
+        In sequence mode, the new waveform cannot be written into the running task: its buffer is regenerated, so that
+        DAQmx waits (with an infinite timeout) for the camera to clock out the whole buffer, forever if the camera is
+        idle. The tasks are restarted with the new waveform instead (see update_tasks).
+
+        Parameters
+        ----------
+        led_values: (dict) for each LED, a dict with the '{led}_act' and '{led}_val' keys
+        camera_idle: (bool) if True, the camera is known not to be grabbing and the sequence is restarted without
+            waiting for a camera readout
+        """
+        self._setting_external = True
+        try:
+            for led in led_values:
+                self.settings.child(led, f'{led}_act').setValue(led_values[led][f'{led}_act'])
+                self.settings.child(led, f'{led}_val').setValue(led_values[led][f'{led}_val'])
+        finally:
+            self._setting_external = False
+        if self.settings.child('digital', 'digital_act').value():
+            led_values = self.get_led_values()
+            if led_values != self.led_values:
+                self.led_values = led_values
+                self.update_tasks(sync=not camera_idle)
+        else:
+            self.check_led_and_update()
 
     def set_led_type(self, led_type_dict):
         """
@@ -131,7 +162,9 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
         Parameters
         ----------
         led_type_dict: (dict) with  a key either 'manual' or 'sequence'
-            In the case of sequence, the associated value is a list of dict containing the status of the LEDs
+            In the case of sequence, the associated value is a list of dict containing the intensity of the LEDs (and
+            optionally a 'repeat' count) for each step, and an optional 'blank' key tells if all LEDs are switched off
+            after each step (default True)
 
         Returns
         -------
@@ -141,6 +174,7 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
         is_sequence = 'sequence' in led_type_dict
         if is_sequence:
             self.sequence_list = led_type_dict['sequence']
+            self.sequence_blank = led_type_dict.get('blank', True)
 
         if is_sequence != self.settings.child('digital', 'digital_act').value():
             self.settings.child('digital', 'digital_act').setValue(is_sequence)
@@ -160,18 +194,13 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
 
     def update_leds(self, led_values):
         if self.settings.child('digital', 'digital_act').value():
-            data = []
-            for dic in self.sequence_list:
-                data.append([led_values[channel][f'{channel}_val']
-                             if dic[f'{channel}']
-                             else 0. for channel in channels])
-                data.append([0. for channel in led_values])
-            data = np.array(list(map(list, zip(*data))),
-                            dtype=float)  # somehow on the transpose of what you would expect
-            # but cannot just use the transpose function for numpy as data are no more contiguous...
-
-            self.controller['ao'].writeAnalog(2 * len(self.sequence_list), len(self.channels_led), data,
-                                              autostart=False)
+            # C-contiguous (channels x steps) waveform, only recomputed for the LEDs whose value changed
+            data, changed = self.waveform_compiler.compile(self.sequence_list,
+                                                           [led_values[channel][f'{channel}_val']
+                                                            for channel in channels],
+                                                           blank=self.sequence_blank)
+            if changed.size != 0:  # the task is not started yet (see update_tasks), its buffer holds all the channels
+                self._sequence_task.writeAnalog(data.shape[1], len(self.channels_led), data, autostart=False)
 
         else:
             self.controller['ao'].writeAnalog(1, 4,
@@ -212,6 +241,7 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
 
 
         try:
+            from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import DAQmx
             # initialize the stage and its controller status
             # controller is an object that may be passed to other instances of DAQ_Move_Mock in case
             # of one controller controlling multiactuators (or detector)
@@ -228,8 +258,12 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
                     self.controller = controller
             else:  # Master stage
 
-                self.controller = dict(ao=DAQmx(), di=DAQmx())
+                # ao is the on demand task of the manual mode. The sequence mode switches between a few task
+                # configurations at each LED update or camera restart: its clocked AO, change detection and on demand
+                # DI (reading the camera TTL line) tasks are cached instead of being rebuilt each time
+                self.controller = dict(ao=DAQmx(), sequence_tasks=DAQmxTaskCache(DAQmx, maxsize=6))
 
+            self.set_enumerated_limits()
             self.update_tasks()
 
             self.emit_status(ThreadCommand('set_allowed_values', dict(decimals=0, minimum=0, maximum=3.5, step=0.1)))
@@ -245,7 +279,31 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
             self.status.initialized = False
             return self.status
 
-    def update_tasks(self):
+    def set_enumerated_limits(self):
+        """Limit the list parameters to the channels of the NI-DAQ enumeration"""
+        enumeration = get_enumeration()
+        for channel in channels:
+            self.settings.child(channel, f'{channel}_ao').setOpts(
+                limits=enumeration.get_channels(source_type='Analog_Output'))
+        self.settings.child('digital', 'digital_di').setOpts(
+            limits=enumeration.get_channels(source_type='Digital_Input'))
+        self.settings.child('digital', 'digital_clock').setOpts(
+            limits=enumeration.get_channels(source_type='Terminals'))
+
+    def update_tasks(self, sync=True):
+        """Configure the tasks for the manual or the sequence mode
+
+        In sequence mode, the AO and change detection tasks are started at the beginning of a camera readout (see
+        wait_readout), so that the first step is output at the next exposure. A 'leds_synchronized' ThreadCommand is
+        then sent with the time of this frame boundary (perf_counter), None if the camera was not grabbing, for the
+        grabber to derive its phases from it.
+
+        Parameters
+        ----------
+        sync: (bool) if False, the camera is known to be idle and the tasks are started at once
+        """
+        from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import (ClockSettings, ChangeDetectionSettings,
+                                                                               AOChannel, DIChannel)
 
         self.channels_led = [AOChannel(name=self.settings.child(channel, f'{channel}_ao').value(),
                                        source='Analog_Output', analog_type='Voltage',
@@ -257,36 +315,85 @@ class DAQ_Move_LedDC4104(DAQ_Move_base):
 
         self.stop_task_and_zero()
 
-        if self.settings.child('digital', 'digital_act').value():
-            clock_settings = ClockSettings(source=self.settings.child('digital', 'digital_clock').value(),
-                                           frequency=1000,
-                                           Nsamples=1000,
-                                           repetition=True)
-            digital_clock = ChangeDetectionSettings(rising_channel=self.settings.child('digital', 'digital_di').value(),
-                                                    falling_channel=self.settings.child('digital', 'digital_di').value(),
-                                                    repetition=True)
-
-            self.controller['di'].update_task(self.channel_clock, digital_clock)
-            self.controller['ao'].update_task(self.channels_led, clock_settings)
-            self.check_led_and_update(force_update=True)
+        t_sync = None
+        try:
+            if self.settings.child('digital', 'digital_act').value():
+                clock_settings = ClockSettings(source=self.settings.child('digital', 'digital_clock').value(),
+                                               frequency=1000,
+                                               Nsamples=1000,
+                                               repetition=True)
+                digital_clock = ChangeDetectionSettings(
+                    rising_channel=self.settings.child('digital', 'digital_di').value(),
+                    falling_channel=self.settings.child('digital', 'digital_di').value(),
+                    repetition=True)
+
+                # one AO task per waveform length (two samples per frame of a cycle), whose buffer size is fixed
+                Nsamples = 2 * sum([int(step.get('repeat', 1)) for step in self.sequence_list])
+                self._clock_task = self.controller['sequence_tasks'].get(
+                    ('di', self.settings['digital', 'digital_di']), self.channel_clock, digital_clock)
+                self._sequence_task = self.controller['sequence_tasks'].get(
+                    ('ao', tuple([channel.name for channel in self.channels_led]),
+                     self.settings['digital', 'digital_clock'], Nsamples), self.channels_led, clock_settings)
+                self.waveform_compiler.invalidate()  # the stopped task buffer is written again
+                self.check_led_and_update(force_update=True)
+
+                if sync:
+                    t_sync = self.wait_readout()
+                self._sequence_task.start()
+                self._clock_task.start()
+
+            else:
+                self.check_led_and_update(force_update=True)
+        finally:
+            if self.settings.child('digital', 'digital_act').value():  # even on failure, the grabber waits for it
+                self.emit_status(ThreadCommand('leds_synchronized', [t_sync]))
+
+    def wait_readout(self):
+        """Wait for the beginning of a camera readout, polling the camera TTL line (high during the exposure)
+
+        The tasks started at a falling edge of the line output their first step at the next rising edge, that is the
+        next exposure, the change detection on both edges then keeping the steps on the exposures. The line is read
+        every sync_poll_period s, the wait being bounded to sync_timeout s: if the line stays low, the camera is
+        considered not grabbing and any time is fine, if no falling edge is seen the sequence may not be synchronized.
 
-            self.controller['ao'].start()
-            self.controller['di'].start()
+        Returns
+        -------
+        float or None: the time (perf_counter) of the falling edge, None if the camera is not grabbing or no edge was
+            seen
+        """
+        from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import ClockSettings
+
+        di_level = self.controller['sequence_tasks'].get(('di_level', self.settings['digital', 'digital_di']),
+                                                         self.channel_clock, ClockSettings(Nsamples=1))  # on demand
+        start = perf_counter()
+        previous = bool(di_level.readDigital(1)[0])
+        seen_high = previous
+        while perf_counter() - start < sync_timeout:
+            sleep(sync_poll_period)
+            state = bool(di_level.readDigital(1)[0])
+            if previous and not state:
+                return perf_counter()
+            previous = state
+            seen_high = seen_high or state
+        if seen_high:
+            self.emit_status(ThreadCommand('Update_Status', [f'No camera readout seen within {sync_timeout}s, the LED '
+                                                             f'sequence may not be synchronized', 'log']))
+        return None
 
-        else:
+    def stop_task_and_zero(self):
+        """Stop the sequence tasks and switch the LEDs off with the manual task, only reconfigured if its channels
+        changed"""
+        from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import ClockSettings
+
+        for daqmx in (self._sequence_task, self._clock_task, self.controller['ao']):
+            if daqmx is not None and daqmx.task is not None:
+                if not daqmx.isTaskDone():
+                    daqmx.stop()
+        static_channels = tuple([channel.name for channel in self.channels_led])
+        if static_channels != self._static_channels:
             clock_settings = ClockSettings(frequency=1000, Nsamples=1)
             self.controller['ao'].update_task(self.channels_led, clock_settings)
-            self.check_led_and_update(force_update=True)
-
-    def stop_task_and_zero(self):
-        if self.controller['ao'].task is not None:
-            if not self.controller['ao'].isTaskDone():
-                self.controller['ao'].stop()
-        if self.controller['di'].task is not None:
-            if not self.controller['di'].isTaskDone():
-                self.controller['di'].stop()
-        clock_settings = ClockSettings(frequency=1000, Nsamples=1)
-        self.controller['ao'].update_task(self.channels_led, clock_settings)
+            self._static_channels = static_channels
 
         self.controller['ao'].writeAnalog(1, 4, np.array([0., 0., 0., 0.], dtype=float), autostart=True)
         self.controller['ao'].stop()
@@ -1,11 +1,14 @@
+import threading
+
 import numpy as np
 from easydict import EasyDict as edict
 from pymodaq.utils.daq_utils import ThreadCommand, getLineInfo
 from pymodaq.utils.data import DataFromPlugins
 from pymodaq.utils.logger import set_logger, get_module_name
 from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, comon_parameters, main
-from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import DAQmx, ClockSettings, AIChannel
 from pymodaq_plugins_moke import config
+from pymodaq_plugins_moke.hardware.daqmx_arbiter import get_arbiter
+from pymodaq_plugins_moke.hardware.nidaq_enumeration import get_enumeration
 
 logger = set_logger(get_module_name(__file__))
 
@@ -18,13 +21,22 @@ resistor = config('micro', 'current', 'resistor')
 class DAQ_0DViewer_ReadCurrent(DAQ_Viewer_base):
     """
     """
+    # the channels are limited to the configured one until ini_detector enumerates the hardware (see
+    # DAQ_Move_Current.params)
     params = comon_parameters+[
         {'title': 'Resistance:', 'name': 'resistance', 'type': 'float', 'value': resistor, 'min': 0., 'suffix': 'Ohm'},
         {'title': 'AI Channel:', 'name': 'ai_channel', 'type': 'list',
-         'values': DAQmx.get_NIDAQ_channels(source_type='Analog_Input'), 'value': f'{device_ai}/{channel_ai}'},
+         'values': [f'{device_ai}/{channel_ai}'], 'value': f'{device_ai}/{channel_ai}'},
+        {'title': 'Live:', 'name': 'live_settings', 'type': 'group', 'children': [
+            {'title': 'Emission rate:', 'name': 'emit_rate', 'type': 'float', 'value': 20., 'min': 0.1,
+             'suffix': 'Hz', 'tip': 'Rate at which the block means are emitted in live mode, the sampling '
+                                    'being shared by all the plugins (see the daqmx section of the config)'},
+            {'title': 'Emit ripple?', 'name': 'ripple', 'type': 'bool', 'value': False,
+             'tip': 'Also emit the RMS ripple of the current within each block'},
+        ]},
         ]
     hardware_averaging = False
-    live_mode_available = False
+    live_mode_available = True
 
     def __init__(self, parent=None, params_state=None):
         super().__init__(parent, params_state)
@@ -35,12 +47,20 @@ class DAQ_0DViewer_ReadCurrent(DAQ_Viewer_base):
         self.Nsamples = 2
         self.channels = None
         self.live = False
+        self.Naverage = 1
+        self._ring = None
+        self._ind_block = 0
+        self._Nblocks_emit = 1
+        self._snap = None  # the samples collected for a pending snap
+        self.subscription = None
 
     def commit_settings(self, param):
         """
         """
-
-        self.update_tasks()
+        if param.name() == 'ai_channel':  # the others are only used to process the data
+            self.update_tasks()
+        elif param.name() == 'emit_rate':
+            self.update_emit_rate()
 
     def ini_detector(self, controller=None):
         """Detector communication initialization
@@ -66,9 +86,12 @@ class DAQ_0DViewer_ReadCurrent(DAQ_Viewer_base):
                     self.controller = controller
             else:
 
-                self.controller = dict(ai=DAQmx())
+                # both the snaps and the live mode are served by the shared acquisition of the DAQmx arbiter, the
+                # device being never reserved by this plugin
+                self.controller = get_arbiter()
                 #####################################
 
+            self.settings.child('ai_channel').setOpts(limits=get_enumeration().get_channels(source_type='Analog_Input'))
             self.update_tasks()
 
 
@@ -84,25 +107,69 @@ class DAQ_0DViewer_ReadCurrent(DAQ_Viewer_base):
             return self.status
 
     def update_tasks(self):
+        """Subscribe the AI channel to the shared acquisition of its device, kept until the channel changes or the
+        plugin is closed, so that neither the snaps nor the live mode restart the shared task"""
+        from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import AIChannel
 
         self.channels_ai = [AIChannel(name=self.settings.child('ai_channel').value(),
                                       source='Analog_Input', analog_type='Voltage',
                                       value_min=-10., value_max=10., termination='Diff', ),
                             ]
 
-        self.clock_settings_ai = ClockSettings(frequency=1000,
-                                            Nsamples=10, repetition=self.live)
-
-        self.controller['ai'].update_task(self.channels_ai, self.clock_settings_ai)
-
-
+        self.unsubscribe()
+        self._ring = None
+        self.update_emit_rate()
+        self.subscription = get_arbiter().subscribe(self.channels_ai, self.read_block)
+
+    def update_emit_rate(self):
+        """Number of blocks of the shared acquisition aggregated into each emitted value in live mode"""
+        block_rate = config('daqmx', 'frequency') / config('daqmx', 'block_samples')
+        self._Nblocks_emit = max((1, int(round(block_rate / self.settings['live_settings', 'emit_rate']))))
+        self._ring = None
+
+    def unsubscribe(self):
+        if self.subscription is not None:
+            get_arbiter().unsubscribe(self.subscription)
+            self.subscription = None
+
+    def read_block(self, data):
+        """Callback of the shared acquisition: collect the samples of a pending snap and, in live mode, store the
+        block in the ring buffer and, every emission period, emit the mean over the Naverage latest periods (and
+        optionally the RMS ripple of the latest period)"""
+        snap = self._snap
+        if snap is not None:
+            snap['blocks'].append(data.reshape(-1))
+            snap['count'] += data.size
+            if snap['count'] >= snap['Nsamples']:
+                self._snap = None
+                snap['done'].set()
+        if not self.live:
+            return
+
+        Nblocks = self._Nblocks_emit * self.Naverage
+        if self._ring is None or self._ring.shape != (Nblocks, data.size):
+            self._ring = np.zeros((Nblocks, data.size))
+            self._ind_block = 0
+        self._ring[self._ind_block % Nblocks] = data.reshape(-1)
+        self._ind_block += 1
+        if self._ind_block % self._Nblocks_emit != 0:
+            return
+
+        resistance = self.settings.child('resistance').value()
+        current = np.mean(self._ring[:min((self._ind_block, Nblocks))]) / resistance
+        dwa_data = [np.array([current])]
+        labels = ['Current']
+        if self.settings['live_settings', 'ripple']:
+            indexes = np.arange(self._ind_block - self._Nblocks_emit, self._ind_block) % Nblocks
+            dwa_data.append(np.array([np.std(self._ring[indexes]) / resistance]))
+            labels.append('Ripple')
+        self.data_grabed_signal.emit([DataFromPlugins(name='Current', data=dwa_data, dim='Data0D', labels=labels)])
 
     def close(self):
         """
         Terminate the communication protocol
         """
-        pass
-        ##
+        self.unsubscribe()
 
     def grab_data(self, Naverage=1, **kwargs):
         """
@@ -112,7 +179,6 @@ class DAQ_0DViewer_ReadCurrent(DAQ_Viewer_base):
         Naverage: (int) Number of hardware averaging
         kwargs: (dict) of others optionals arguments
         """
-        Naverage = max((2, Naverage))  # at least 2 samples have to be grabed
         self.data = None
         update = False
 
@@ -120,28 +186,36 @@ class DAQ_0DViewer_ReadCurrent(DAQ_Viewer_base):
             if kwargs['live'] != self.live:
                 update = True
             self.live = kwargs['live']
-
-        if Naverage != self.Nsamples:
-            self.Nsamples = Naverage
-            update = True
-
-        if update:
+        if self.subscription is None:
             self.update_tasks()
-        while not self.controller['ai'].isTaskDone():
-            self.controller['ai'].task.StopTask()
 
-        data = self.controller['ai'].readAnalog(len(self.channels_ai), self.clock_settings_ai)
-        data_tot = np.mean(data) / self.settings.child('resistance').value()
+        if self.live:  # streaming: the shared acquisition calls read_block every block
+            self.Naverage = max((1, Naverage))
+            if update:
+                self._ring = None
+            return
+
+        self.Nsamples = max((2, Naverage))  # at least 2 samples have to be grabed
+        snap = dict(blocks=[], count=0, Nsamples=self.Nsamples, done=threading.Event())
+        self._snap = snap
+        # the shared acquisition may be paused by a plugin running its own task on the device
+        timeout = 1. + 2 * self.Nsamples / config('daqmx', 'frequency')
+        if snap['done'].wait(timeout):
+            data = np.concatenate(snap['blocks'])[:self.Nsamples]
+            data_tot = np.mean(data) / self.settings.child('resistance').value()
+        else:
+            self._snap = None
+            self.emit_status(ThreadCommand('Update_Status', [f'No current sample received within {timeout:.1f} s, '
+                                                             f'the device may be used by another plugin', 'log']))
+            data_tot = np.nan
 
         self.data_grabed_signal.emit([DataFromPlugins(name='Current', data=[np.array([data_tot])],
                                                       dim='Data0D',
                                       labels=['Current'])])
 
     def stop(self):
-        try:
-            self.controller['ai'].task.StopTask()
-        except:
-            pass
+        self.live = False  # the subscription is kept, the blocks being no more emitted
+        self._snap = None
         ##############################
 
         return ''
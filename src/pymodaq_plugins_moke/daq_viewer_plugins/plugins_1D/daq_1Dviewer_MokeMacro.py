@@ -4,14 +4,17 @@ from pymodaq.utils.daq_utils import ThreadCommand, getLineInfo
 from pymodaq.utils.data import DataFromPlugins, Axis
 from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, comon_parameters, main
 
-from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import DAQmx, DAQ_analog_types, DAQ_thermocouples,\
-    DAQ_termination, Edge, DAQ_NIDAQ_source, \
-    ClockSettings, AIChannel, Counter, AIThermoChannel, AOChannel, TriggerSettings, DOChannel, DIChannel
+from pymodaq_plugins_moke.hardware.processing import minmax_decimate, find_zero_crossings, resample_cycles
+from pymodaq_plugins_moke.hardware.raw_recording import RawRecorder, RawReplay
+from pymodaq_plugins_moke.hardware.daqmx_arbiter import get_arbiter, get_device
+from pymodaq_plugins_moke.hardware.nidaq_enumeration import get_enumeration
 
 
 class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
     """
     """
+    # the channels are limited to their default until ini_detector enumerates the hardware (see
+    # DAQ_Move_Current.params)
     params = comon_parameters+[
         {'title': 'Grab Photodiodes:', 'name': 'diodes', 'type': 'bool', 'value': True},
         {'title': 'Acquire:', 'name': 'acquire', 'type': 'bool', 'value': False},
@@ -20,23 +23,44 @@ class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
         {'title': 'Average cycles:', 'name': 'average_cycles', 'type': 'bool', 'value': False},
         {'title': 'Ncycles:', 'name': 'Ncycles', 'type': 'int', 'value': 3, 'min': 0, 'max': 3,
          'tip': 'Select the cycle to display between 0 and 3 or to average from this value up to 3'},
+        {'title': 'Decimate display:', 'name': 'decimate', 'type': 'bool', 'value': True,
+         'tip': 'Display a min/max envelope of the data, full resolution data are still saved'},
+        {'title': 'Display points:', 'name': 'display_points', 'type': 'int', 'value': 1000, 'min': 2},
+        {'title': 'Show intermediate averages:', 'name': 'show_averaging', 'type': 'bool', 'value': False,
+         'tip': 'Emit the running average after each acquisition when Naverage > 1'},
+        {'title': 'Align cycles on field:', 'name': 'align_cycles', 'type': 'bool', 'value': True,
+         'tip': 'Cut the cycles on the zero crossings of the field and resample them on a common phase grid'},
         {'title': 'Frequency Magnet:', 'name': 'frequency_magnet', 'type': 'float', 'value': 50., 'default': 50.,
          'min': 0., 'suffix': 'Hz'},
         {'title': 'Gain:', 'name': 'gain', 'type': 'float', 'value': 500., 'min': 0.},
         {'title': 'Resistance (Ohm):', 'name': 'resistance', 'type': 'float', 'value': 1.0004, 'min': 0.},
         {'title': 'Oe/A (solenoid):', 'name': 'solenoid', 'type': 'float', 'value': 97.},
         {'title': 'DO MagField:', 'name': 'do_mag', 'type': 'list',
-         'limits': DAQmx.get_NIDAQ_channels(source_type='Digital_Output'), 'value': 'cDAQ1Mod2/port0/line0'},
+         'limits': ['cDAQ1Mod2/port0/line0'], 'value': 'cDAQ1Mod2/port0/line0'},
         {'title': 'AI Phot. 1:', 'name': 'ai_phot1', 'type': 'list',
-         'limits': DAQmx.get_NIDAQ_channels(source_type='Analog_Input'), 'value': 'cDAQ1Mod1/ai0'},
+         'limits': ['cDAQ1Mod1/ai0'], 'value': 'cDAQ1Mod1/ai0'},
         {'title': 'AI Phot. 2:', 'name': 'ai_phot2', 'type': 'list',
-         'limits': DAQmx.get_NIDAQ_channels(source_type='Analog_Input'), 'value': 'cDAQ1Mod1/ai1'},
+         'limits': ['cDAQ1Mod1/ai1'], 'value': 'cDAQ1Mod1/ai1'},
         {'title': 'AI Ampli.:', 'name': 'ai_ampli', 'type': 'list',
-         'limits': DAQmx.get_NIDAQ_channels(source_type='Analog_Input'), 'value': 'cDAQ1Mod1/ai2'},
+         'limits': ['cDAQ1Mod1/ai2'], 'value': 'cDAQ1Mod1/ai2'},
         {'title': 'AI HField:', 'name': 'ai_hfield', 'type': 'list',
-         'limits': DAQmx.get_NIDAQ_channels(source_type='Analog_Input'), 'value': 'cDAQ1Mod1/ai3'},
+         'limits': ['cDAQ1Mod1/ai3'], 'value': 'cDAQ1Mod1/ai3'},
+        {'title': 'Record raw data:', 'name': 'record', 'type': 'bool', 'value': False,
+         'tip': 'Record each acquired raw block into the record file'},
+        {'title': 'Record file:', 'name': 'record_path', 'type': 'browsepath', 'value': '', 'filetype': True},
+        {'title': 'Replay from file:', 'name': 'replay', 'type': 'bool', 'value': False,
+         'tip': 'Process the raw blocks of the replay file instead of acquiring from the hardware'},
+        {'title': 'Replay file:', 'name': 'replay_path', 'type': 'browsepath', 'value': '', 'filetype': True},
+        {'title': 'Replay in real time:', 'name': 'replay_realtime', 'type': 'bool', 'value': False,
+         'tip': 'Deliver the replayed blocks at the acquisition rate, else as fast as possible'},
         ]
 
+    # parameters on which each DAQmx task configuration depends, others (but the acquisition mode) are display only
+    task_params = dict(do=['do_mag'],
+                       ai=['frequency', 'frequency_magnet', 'align_cycles', 'ai_ampli', 'ai_hfield', 'ai_phot1',
+                           'ai_phot2'],
+                       phot_only=['ai_phot1', 'ai_phot2'])
+
     def __init__(self, parent=None, params_state=None):
         super().__init__(parent, params_state)
         self.x_axis = None
@@ -47,6 +71,17 @@ class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
         self.data = None
         self.Nsamples = None
         self.channels = None
+        self._task_configs = dict([])
+        self.Naverage = 1
+        self.ind_average = 0
+        self._data_sum = None
+        self._data_average = None
+        self.channels_name = None
+        self.frequency = None
+        self.recorder = None
+        self._devices = []  # devices acquired from the DAQmx arbiter during a grab
+        self.replay = None
+        self._Ncycles_clamped = None  # the (requested, used) cycle index last reported as clamped
 
     def commit_settings(self, param):
         """
@@ -62,16 +97,29 @@ class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
                 self.settings.child('diodes').setValue(False)
             else:
                 self.settings.child('diodes').setValue(True)
-        elif param.name() == 'Ncycles' or param.name() == 'plot_cycles' or 'average_cycles':
-            if param.name() == 'plot_cycles' and param.value():
-                self.settings.child('average_cycles').setValue(False)
-            elif param.name() == 'average_cycles' and param.value():
-                self.settings.child('plot_cycles').setValue(False)
-            if self.data is not None:
-                self.emit_data(self.data)
-            return
-
-        self.update_tasks()
+        elif param.name() in ['record', 'record_path']:
+            self.close_recorder()
+        elif param.name() in ['replay', 'replay_path']:
+            self.close_replay()
+            if self.settings.child('replay').value():
+                self.open_replay()
+            else:
+                self.update_tasks()
+        elif param.name() == 'replay_realtime':
+            if self.replay is not None:
+                self.replay.realtime = param.value()
+        else:
+            tasks = [task for task in self.task_params if param.name() in self.task_params[task]]
+            if len(tasks) != 0:
+                if self.replay is None:  # tasks are configured when leaving the replay mode
+                    self.update_tasks(tasks)
+            else:
+                if param.name() == 'plot_cycles' and param.value():
+                    self.settings.child('average_cycles').setValue(False)
+                elif param.name() == 'average_cycles' and param.value():
+                    self.settings.child('plot_cycles').setValue(False)
+                if self.data is not None:
+                    self.emit_data(self.data)
 
     def ini_detector(self, controller=None):
         """Detector communication initialization
@@ -89,6 +137,7 @@ class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
         """
 
         try:
+            from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import DAQmx
             self.status.update(edict(initialized=False,info="",x_axis=None,y_axis=None,controller=None))
             if self.settings.child(('controller_status')).value() == "Slave":
                 if controller is None:
@@ -100,7 +149,12 @@ class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
                 self.controller = dict(do=DAQmx(), phot_only=DAQmx(), ai=DAQmx())
                 #####################################
 
-            self.update_tasks()
+            self.set_enumerated_limits()
+            self._task_configs = dict([])
+            if self.settings.child('replay').value():
+                self.open_replay()
+            else:
+                self.update_tasks()
 
 
             self.status.info = "Whatever info you want to log"
@@ -114,7 +168,24 @@ class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
             self.status.initialized = False
             return self.status
 
-    def update_tasks(self):
+    def set_enumerated_limits(self):
+        """Limit the channel parameters to the channels of the NI-DAQ enumeration"""
+        self.settings.child('do_mag').setOpts(limits=get_enumeration().get_channels(source_type='Digital_Output'))
+        for name in ['ai_phot1', 'ai_phot2', 'ai_ampli', 'ai_hfield']:
+            self.settings.child(name).setOpts(limits=get_enumeration().get_channels(source_type='Analog_Input'))
+
+    def update_tasks(self, tasks=None):
+        """Build the channels and configure the DAQmx tasks
+
+        Parameters
+        ----------
+        tasks: (list of str) keys of the controller tasks to configure, all of them if None. A task whose parameters
+            did not change since its last configuration is reused as is
+        """
+        from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import ClockSettings, AIChannel, DOChannel
+
+        if tasks is None:
+            tasks = list(self.task_params.keys())
 
         self.channel_do = DOChannel(name=self.settings.child('do_mag').value(), source='Digital_Output')
         self.channels_phot = [AIChannel(name=self.settings.child('ai_phot1').value(),
@@ -139,34 +210,110 @@ class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
                             ]
 
 
-        Nsamples = 1 / self.settings.child('frequency_magnet').value() * self.settings.child('frequency').value() * 4
+        # the cycles aligned on the zero crossings of the field start after the first crossing: one more period is
+        # acquired so that the 4 cycles are complete
+        Nperiods = 5 if self.settings.child('align_cycles').value() else 4
+        Nsamples = 1 / self.settings.child('frequency_magnet').value() * self.settings.child('frequency').value() * \
+            Nperiods
 
         self.clock_settings_ai = ClockSettings(frequency=self.settings.child('frequency').value(),
                                             Nsamples=int(Nsamples))
         self.clock_settings_phot = ClockSettings(frequency=100, Nsamples=10)
 
-        self.controller['do'].update_task([self.channel_do],
-                                          ClockSettings(frequency=1000, Nsamples=1))
-        self.controller['ai'].update_task(self.channels_ai, self.clock_settings_ai)
-        self.controller['phot_only'].update_task(self.channels_phot, self.clock_settings_phot)
+        for task in tasks:
+            task_config = tuple([self.settings.child(name).value() for name in self.task_params[task]])
+            if self._task_configs.get(task, None) == task_config:
+                continue
+            if task == 'do':
+                self.controller['do'].update_task([self.channel_do],
+                                                  ClockSettings(frequency=1000, Nsamples=1))
+            elif task == 'ai':
+                self.controller['ai'].update_task(self.channels_ai, self.clock_settings_ai)
+            elif task == 'phot_only':
+                self.controller['phot_only'].update_task(self.channels_phot, self.clock_settings_phot)
+            self._task_configs[task] = task_config
+
+
+    def open_replay(self):
+        self.replay = RawReplay(self.settings.child('replay_path').value(),
+                                realtime=self.settings.child('replay_realtime').value())
+        is_diodes = self.replay.header.get('mode', 'acquire') == 'diodes'
+        self.settings.child('diodes').setValue(is_diodes)
+        self.settings.child('acquire').setValue(not is_diodes)
+        self.emit_status(ThreadCommand('Update_Status', [f'Replaying {self.replay.Nblocks} blocks from '
+                                                         f'{self.replay.path}']))
+
+    def close_replay(self):
+        if self.replay is not None:
+            self.replay.close()
+            self.replay = None
+
+    def record(self, data):
+        """Record the raw data into the record file, opened on the first block"""
+        try:
+            if self.recorder is None:
+                self.recorder = RawRecorder(self.settings.child('record_path').value(), self.channels_name,
+                                            self.frequency, self.Nsamples,
+                                            mode='diodes' if self.settings.child('diodes').value() else 'acquire',
+                                            frequency_magnet=self.settings.child('frequency_magnet').value())
+            self.recorder.write(data)
+        except Exception as e:
+            self.settings.child('record').setValue(False)
+            self.close_recorder()
+            self.emit_status(ThreadCommand('Update_Status', [f'Recording stopped: {str(e)}', 'log']))
 
+    def close_recorder(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
     def close(self):
         """
         Terminate the communication protocol
         """
-        pass
-        ##
+        self.close_recorder()
+        self.close_replay()
+        self.release_devices()
 
     def grab_data(self, Naverage=1, **kwargs):
         """
 
         Parameters
         ----------
-        Naverage: (int) Number of hardware averaging
+        Naverage: (int) Number of hardware averaging: the acquisition is repeated Naverage times and accumulated
+            before a single emission
         kwargs: (dict) of others optionals arguments
         """
         self.data = None
+        self.Naverage = max((1, Naverage))
+        self.ind_average = 0
+        if self.replay is not None:
+            self.replay_data()
+        else:
+            self.acquire_devices()
+            self.start_acquisition()
+
+    def acquire_devices(self):
+        """Pause the acquisitions shared by the other plugins on the devices used by the hardware timed tasks"""
+        self.release_devices()
+        channels = self.channels_phot if self.settings.child('diodes').value() else self.channels_ai
+        for device in sorted(set([get_device(channel.name) for channel in channels])):
+            get_arbiter().acquire(device)
+            self._devices.append(device)  # only the acquired ones are released
+
+    def release_devices(self):
+        for device in self._devices:
+            get_arbiter().release(device)
+        self._devices = []
+
+    def replay_data(self):
+        self.channels_name = self.replay.channels
+        self.frequency = self.replay.frequency
+        self.Nsamples = self.replay.Nsamples
+        while self.ind_average < self.Naverage:
+            self.process_data(self.replay.next_block())
+
+    def start_acquisition(self):
         if self.settings.child('diodes').value():
             while not self.controller['phot_only'].isTaskDone():
                 self.controller['phot_only'].task.StopTask()
@@ -186,29 +333,68 @@ class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
         if self.settings.child('acquire').value():
             self.controller['do'].writeDigital(1, np.array([0], dtype=np.uint8), autostart=True)
             self.channels = self.channels_ai
-            self.data = self.controller['ai'].readAnalog(len(self.channels), self.clock_settings_ai)
+            data = self.controller['ai'].readAnalog(len(self.channels), self.clock_settings_ai)
             self.Nsamples = self.clock_settings_ai.Nsamples
+            self.frequency = self.clock_settings_ai.frequency
             self.controller['ai'].task.StopTask()
         elif self.settings.child('diodes').value():
             self.channels = self.channels_phot
-            self.data = self.controller['phot_only'].readAnalog(len(self.channels), self.clock_settings_phot)
+            data = self.controller['phot_only'].readAnalog(len(self.channels), self.clock_settings_phot)
             self.Nsamples = self.clock_settings_phot.Nsamples
+            self.frequency = self.clock_settings_phot.frequency
             self.controller['phot_only'].task.StopTask()
+        else:
+            return 0
 
-        self.emit_data(self.data)
+        self.channels_name = [ch.name for ch in self.channels]
+        if self.settings.child('record').value():
+            self.record(data)
+        self.process_data(data)
         return 0  #mandatory for the PyDAQmx callback
 
-    def emit_data(self, data):
-        channels_name = [ch.name for ch in self.channels]
+    def process_data(self, data):
+        self.accumulate(data)
+        if self.ind_average < self.Naverage:
+            if self.settings.child('show_averaging').value():
+                self.emit_data(self.get_average(), temp=True)
+            if self.replay is None:
+                self.start_acquisition()
+        else:
+            if self.replay is None:
+                self.release_devices()
+            self.data = self.get_average()
+            self.emit_data(self.data)
+
+    def accumulate(self, data):
+        """Add in place the raw data of one acquisition to the preallocated sum"""
+        if self._data_sum is None or self._data_sum.shape != data.shape:
+            self._data_sum = np.zeros(data.shape)
+            self._data_average = np.zeros(data.shape)
+        if self.ind_average == 0:
+            np.copyto(self._data_sum, data)
+        else:
+            np.add(self._data_sum, data, out=self._data_sum)
+        self.ind_average += 1
+
+    def get_average(self):
+        """Get the average of the acquisitions accumulated so far"""
+        if self.ind_average < self.Naverage:
+            return self._data_sum / self.ind_average  # intermediate values are not kept
+        np.multiply(self._data_sum, 1 / self.ind_average, out=self._data_average)
+        return self._data_average
+
+    def emit_data(self, data, temp=False):
+        signal = self.data_grabed_signal_temp if temp else self.data_grabed_signal
+        channels_name = self.channels_name
         data_tot = []
 
         if self.settings.child('diodes').value():
-            for ind in range(len(self.channels)):
+            for ind in range(len(channels_name)):
                 data_tot.append(np.array([np.mean(data[ind*self.Nsamples:(ind+1)*self.Nsamples])]))
-            self.data_grabed_signal.emit([DataFromPlugins(name='NI AI', data=data_tot, dim='Data0D',
-                                          labels=channels_name)])
+            signal.emit([DataFromPlugins(name='NI AI', data=data_tot, dim='Data0D',
+                                         labels=channels_name)])
         else:
-            for ind in range(len(self.channels)):
+            for ind in range(len(channels_name)):
                 data_tot.append(data[ind*self.Nsamples:(ind+1)*self.Nsamples])
 
             ind_cycles = self.settings.child('Ncycles').value()
@@ -218,13 +404,29 @@ class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
                 delta_diode = data_tot[1]
                 diode = (data_tot[2] + data_tot[3]) / 2
             else:
-                length = int(1 / self.settings.child('frequency_magnet').value() *
-                    self.settings.child('frequency').value())
-                Bfields = [data_tot[0][ind*length:(ind+1)*length] / self.settings.child('resistance').value() *
-                    self.settings.child('solenoid').value() for ind in range(4)]
-                delta_diodes = [data_tot[1][ind*length:(ind+1)*length] for ind in range(4)]
-                diodes = [(data_tot[2][ind*length:(ind+1)*length] + data_tot[3][ind*length:(ind+1)*length]) / 2
-                          for ind in range(4)]
+                length = int(1 / self.settings.child('frequency_magnet').value() * self.frequency)
+                crossings = find_zero_crossings(data_tot[0], min_distance=length / 2) \
+                    if self.settings.child('align_cycles').value() else np.array([])
+                if len(crossings) > 1:
+                    Bfields, delta_diodes, diodes_1, diodes_2 = [cycles[:4] for cycles in
+                                                                 resample_cycles(crossings, data_tot[:4], length)]
+                    Bfields *= self.settings.child('solenoid').value() / self.settings.child('resistance').value()
+                    diodes = (diodes_1 + diodes_2) / 2
+                    if ind_cycles > len(crossings) - 2:
+                        if self._Ncycles_clamped != (ind_cycles, len(crossings) - 2):
+                            self.emit_status(ThreadCommand('Update_Status', [
+                                f'Only {len(crossings) - 1} complete cycles were found, cycle {len(crossings) - 2} '
+                                f'is used instead of cycle {ind_cycles}', 'log']))
+                            self._Ncycles_clamped = (ind_cycles, len(crossings) - 2)
+                        ind_cycles = len(crossings) - 2
+                    else:
+                        self._Ncycles_clamped = None
+                else:
+                    Bfields = [data_tot[0][ind*length:(ind+1)*length] / self.settings.child('resistance').value() *
+                        self.settings.child('solenoid').value() for ind in range(4)]
+                    delta_diodes = [data_tot[1][ind*length:(ind+1)*length] for ind in range(4)]
+                    diodes = [(data_tot[2][ind*length:(ind+1)*length] + data_tot[3][ind*length:(ind+1)*length]) / 2
+                              for ind in range(4)]
                 if self.settings.child('average_cycles').value():
                     Bfield = np.mean(np.array(Bfields[ind_cycles:]), 0)
                     delta_diode = np.mean(np.array(delta_diodes[ind_cycles:]), 0)
@@ -235,12 +437,26 @@ class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
                     diode = diodes[ind_cycles]
 
             rotation = 180 / np.pi / (self.settings.child('gain').value() * 4) * np.arctan(delta_diode / diode)
-
-            self.data_grabed_signal.emit([DataFromPlugins(name='NI AI', data=[Bfield, rotation], dim='Data1D',
-                                          labels=['Bfield', 'Rotation'],
-                                          x_axis=Axis(data=np.linspace(0, self.Nsamples /
-                                                                       self.clock_settings_ai.frequency, self.Nsamples),
-                                          label='Time', units='s'))])
+            time_axis = np.linspace(0, len(Bfield) / self.frequency, len(Bfield))
+
+            if self.settings.child('decimate').value() and \
+                    len(Bfield) > self.settings.child('display_points').value():
+                # the decimated envelope is only displayed while full resolution data are only saved. Each signal
+                # keeps its own samples, hence its own time axis
+                times_decimated, signals_decimated = \
+                    minmax_decimate(time_axis, [Bfield, rotation], self.settings.child('display_points').value())
+                data = [DataFromPlugins(name=f'NI AI {label}', data=[signal_decimated], dim='Data1D', labels=[label],
+                                        do_save=False, x_axis=Axis(data=time_decimated, label='Time', units='s'))
+                        for label, time_decimated, signal_decimated in
+                        zip(['Bfield', 'Rotation'], times_decimated, signals_decimated)]
+                data.append(DataFromPlugins(name='NI AI Full', data=[Bfield, rotation], dim='Data1D',
+                                            labels=['Bfield', 'Rotation'], do_plot=False,
+                                            x_axis=Axis(data=time_axis, label='Time', units='s')))
+                signal.emit(data)
+            else:
+                signal.emit([DataFromPlugins(name='NI AI', data=[Bfield, rotation], dim='Data1D',
+                                             labels=['Bfield', 'Rotation'],
+                                             x_axis=Axis(data=time_axis, label='Time', units='s'))])
 
     def stop(self):
         try:
@@ -259,6 +475,7 @@ class DAQ_1DViewer_MokeMacro(DAQ_Viewer_base):
             self.controller['phot_only'].task.StopTask()
         except:
             pass
+        self.release_devices()
         #self.emit_status(ThreadCommand('Update_Status', ['Some info you want to log']))
         ##############################
 
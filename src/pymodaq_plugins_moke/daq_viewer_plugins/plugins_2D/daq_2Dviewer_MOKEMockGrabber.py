@@ -1,3 +1,5 @@
+from time import time
+
 from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, main
 from easydict import EasyDict as edict
 from pymodaq.utils.daq_utils import ThreadCommand, getLineInfo
@@ -125,6 +127,14 @@ class DAQ_2DViewer_MOKEMockGrabber(DAQ_Viewer_base):
         self.data_grabed_signal.emit([DataFromPlugins(name='Mock2DPID', data=[image], dim='Data2D'),])
 
 
+    def apply_camera_profile(self, profile):
+        """No camera settings to apply, the profile is just acknowledged"""
+        self.emit_status(ThreadCommand('camera_profile_applied', [profile]))
+
+    def mark_frames(self):
+        """Send a 'frames_marked' ThreadCommand with the current time, as the MOKEGrabber"""
+        self.emit_status(ThreadCommand('frames_marked', [time()]))
+
     def stop(self):
         return ""
 
@@ -0,0 +1,163 @@
+import json
+
+import numpy as np
+import tables
+
+from qtpy import QtCore
+from pymodaq.control_modules.move_utility_classes import MoveCommand
+
+from pymodaq_plugins_moke.hardware.live_loop import roi_signal
+
+
+class AdaptiveStepper:
+    """Choose the next actuator position of a loop from the measured signal
+
+    The loop goes from offset + amplitude to offset - amplitude and back, the field always moving forward within a
+    branch so that every point lies on the branch being measured. The step is shrunk as soon as the signal derivative
+    (in signal units per actuator unit) rises: it is threshold * min_step / derivative, bounded by min_step and
+    coarse_step, hence min_step above the threshold. If the switching happened within a single step larger than
+    min_step, the field is brought back to the saturation at the start of the branch and the interval is sampled again
+    with the minimum step, approaching it from the same side.
+
+    Parameters
+    ----------
+    amplitude: (float) half span of the loop
+    coarse_step: (float) step used in the saturated parts of the loop
+    min_step: (float) step used in the switching regions
+    threshold: (float) derivative above which the minimum step is used
+    offset: (float) center of the loop
+    """
+
+    def __init__(self, amplitude, coarse_step, min_step, threshold, offset=0.):
+        if coarse_step <= 0 or min_step <= 0:
+            raise ValueError('The steps should be strictly positive')
+        if threshold <= 0:
+            raise ValueError('The threshold should be strictly positive')
+        self.coarse_step = coarse_step
+        self.min_step = min(min_step, coarse_step)
+        self.threshold = threshold
+        self.branches = [(offset + amplitude, offset - amplitude), (offset - amplitude, offset + amplitude)]
+        self.ind_branch = 0
+        self._last = None  # (position, signal) of the last point of the branch
+        self._plan = []  # positions to be visited after a return to saturation
+
+    @property
+    def start_position(self):
+        return self.branches[0][0]
+
+    @property
+    def direction(self):
+        start, stop = self.branches[self.ind_branch]
+        return np.sign(stop - start)
+
+    def step(self, derivative):
+        """Get the step to be used after a point where the signal derivative is derivative"""
+        if derivative <= 0:
+            return self.coarse_step
+        return float(np.clip(self.threshold * self.min_step / derivative, self.min_step, self.coarse_step))
+
+    def next_position(self, position, signal):
+        """Get the next position from the signal measured at position, None when the loop is done"""
+        last = self._last
+        self._last = (position, signal)
+        if len(self._plan) != 0:  # resampling an interval after a return to saturation
+            return self._plan.pop(0)
+
+        start, stop = self.branches[self.ind_branch]
+        derivative = 0.
+        if last is not None and position != last[0]:
+            derivative = abs(signal - last[1]) / abs(position - last[0])
+            if derivative > self.threshold and abs(position - last[0]) > self.min_step * (1 + 1e-9):
+                # the switching happened within the last step: saturate again, then sample the step finely
+                Nsteps = int(np.ceil(abs(position - last[0]) / self.min_step - 1e-9))
+                self._plan = list(last[0] + self.direction * self.min_step * np.arange(1, Nsteps))
+                self._plan.append(position)
+                if last[0] != start:
+                    self._plan.insert(0, last[0])
+                self._last = None
+                return start
+
+        if position == stop:
+            self.ind_branch += 1
+            if self.ind_branch == len(self.branches):
+                return None
+            stop = self.branches[self.ind_branch][1]
+            derivative = 0.
+        next_position = position + self.direction * self.step(derivative)
+        if (next_position - stop) * self.direction > 0:
+            next_position = stop
+        return next_position
+
+
+class AdaptiveScan(QtCore.QObject):
+    """Run a loop with an AdaptiveStepper: move the actuator, snap the camera, choose the next position...
+
+    The measured points are kept, with the index of their branch, and can be saved into a HDF5 file.
+
+    Parameters
+    ----------
+    actuator: (DAQ_Move) the field actuator
+    detector: (DAQ_Viewer) the camera, its first ROI mean being the Kerr signal
+    """
+    finished_signal = QtCore.Signal(int)  # the number of acquired points
+
+    def __init__(self, actuator, detector):
+        super().__init__()
+        self.actuator = actuator
+        self.detector = detector
+        self.stepper = None
+        self.position = None
+        self.settings = None
+        self._points = []
+        self.running = False
+
+    @property
+    def npoints(self):
+        return len(self._points)
+
+    @property
+    def data(self) -> np.ndarray:
+        """The acquired points as an array of shape (npoints, 3): position, signal and branch index"""
+        return np.array(self._points, dtype=float).reshape((-1, 3))
+
+    def start(self, amplitude, coarse_step, min_step, threshold, offset=0.):
+        self.stepper = AdaptiveStepper(amplitude, coarse_step, min_step, threshold, offset=offset)
+        self.settings = dict(amplitude=amplitude, coarse_step=coarse_step, min_step=min_step, threshold=threshold,
+                             offset=offset)
+        self._points = []
+        self.running = True
+        self.actuator.move_done_signal.connect(self.moved)
+        self.detector.grab_done_signal.connect(self.grabbed)
+        self.move(self.stepper.start_position)
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.actuator.move_done_signal.disconnect(self.moved)
+            self.detector.grab_done_signal.disconnect(self.grabbed)
+            self.finished_signal.emit(self.npoints)
+
+    def move(self, position):
+        self.position = position
+        self.actuator.move(MoveCommand('abs', position))
+
+    def moved(self, *args):
+        self.detector.snap()
+
+    def grabbed(self, dte):
+        signal = roi_signal(dte)
+        self._points.append((self.position, signal, self.stepper.ind_branch))
+        next_position = self.stepper.next_position(self.position, signal)
+        if next_position is None:
+            self.stop()
+        else:
+            self.move(next_position)
+
+    def save(self, path):
+        """Save the acquired points and the loop settings into a HDF5 file"""
+        data = self.data
+        with tables.open_file(str(path), mode='w', title='Adaptive loop') as h5file:
+            h5file.root._v_attrs.settings = json.dumps(self.settings)
+            h5file.create_array('/', 'positions', data[:, 0])
+            h5file.create_array('/', 'signal', data[:, 1])
+            h5file.create_array('/', 'branch', data[:, 2].astype(int))
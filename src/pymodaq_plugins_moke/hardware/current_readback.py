@@ -0,0 +1,89 @@
+import threading
+from time import perf_counter
+
+import numpy as np
+
+
+class ReadbackCache:
+    """Thread safe cache of the block means of a continuously sampled signal
+
+    Each pushed block of samples is decimated to its mean, stored with its timestamp into a preallocated ring buffer so
+    that the latest value, a running mean or a settling check are available without touching the hardware. While the
+    acquisition is paused, the cache is suspended: emptied and flagged until the next pushed block, so that no stale
+    value is served.
+
+    Parameters
+    ----------
+    Nhistory: (int) the number of block means kept in the ring buffer
+    """
+
+    def __init__(self, Nhistory=1000):
+        self._values = np.zeros((Nhistory,))
+        self._times = np.zeros((Nhistory,))
+        self._ind = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        self._new_value = threading.Event()
+        self.suspended = False
+
+    def clear(self):
+        with self._lock:
+            self._ind = 0
+            self._count = 0
+            self._new_value.clear()
+
+    def suspend(self):
+        """Empty the cache and flag it as suspended until the next pushed block"""
+        self.clear()
+        self.suspended = True
+
+    def push(self, block: np.ndarray):
+        with self._lock:
+            self.suspended = False
+            self._values[self._ind] = np.mean(block)
+            self._times[self._ind] = perf_counter()
+            self._ind = (self._ind + 1) % self._values.size
+            self._count = min((self._count + 1, self._values.size))
+        self._new_value.set()
+
+    def wait(self, timeout=1.):
+        """Wait until at least one value has been pushed, return False on timeout"""
+        return self._new_value.wait(timeout)
+
+    @property
+    def latest(self):
+        """tuple of float: the latest value and its timestamp (perf_counter), (None, None) if empty"""
+        with self._lock:
+            if self._count == 0:
+                return None, None
+            return self._values[self._ind - 1], self._times[self._ind - 1]
+
+    def get_values(self, Nvalues=None):
+        """Get a copy of the Nvalues latest values in chronological order (all the cached ones if None)"""
+        with self._lock:
+            Nvalues = self._count if Nvalues is None else min((Nvalues, self._count))
+            indexes = np.arange(self._ind - Nvalues, self._ind) % self._values.size
+            return self._values[indexes]
+
+    def get_times(self, Nvalues=None):
+        """Get the timestamps (perf_counter) of the Nvalues latest values in chronological order"""
+        with self._lock:
+            Nvalues = self._count if Nvalues is None else min((Nvalues, self._count))
+            indexes = np.arange(self._ind - Nvalues, self._ind) % self._times.size
+            return self._times[indexes]
+
+    def get_since(self, start):
+        """Get the values and their timestamps (perf_counter) pushed after start, in chronological order"""
+        with self._lock:
+            indexes = np.arange(self._ind - self._count, self._ind) % self._values.size
+            values, times = self._values[indexes], self._times[indexes]
+        return values[times >= start], times[times >= start]
+
+    def running_mean(self, Nvalues=None):
+        values = self.get_values(Nvalues)
+        return np.mean(values) if values.size != 0 else None
+
+    def is_settled(self, target, epsilon, window):
+        """Check that the window latest values are all within epsilon of the target"""
+        values = self.get_values(window)
+        return values.size == window and bool(np.all(np.abs(values - target) < epsilon))
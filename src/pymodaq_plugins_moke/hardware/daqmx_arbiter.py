@@ -0,0 +1,235 @@
+import threading
+
+import numpy as np
+
+from pymodaq.utils.logger import set_logger, get_module_name
+
+logger = set_logger(get_module_name(__file__))
+
+
+def get_device(channel_name: str) -> str:
+    """Get the device from a physical channel name such as 'cDAQ1Mod1/ai0'"""
+    return channel_name.strip('/').split('/')[0]
+
+
+class Subscription:
+    """A set of analog input channels whose samples are dispatched to a callback by the DAQmxArbiter
+
+    The callback is called from the acquisition thread of the device with a 2D array of shape (Nchannels, Nsamples)
+    whose rows follow the order of the subscribed channels. The optional pause_callback is called (without argument)
+    when the device is acquired by a plugin, no block being dispatched until it is released, so that the subscriber
+    can invalidate what it derived from the previous blocks.
+    """
+
+    def __init__(self, channels, callback, pause_callback=None):
+        self.channels = channels
+        self.callback = callback
+        self.pause_callback = pause_callback
+        self.rows = None  # indexes of the channels in the merged task, set by the arbiter
+
+    @property
+    def channel_names(self):
+        return [channel.name for channel in self.channels]
+
+
+class DeviceStream:
+    """The shared continuous analog input task of one device and its reading thread"""
+
+    def __init__(self, device, daqmx, clock_settings):
+        self.device = device
+        self.daqmx = daqmx
+        self.clock_settings = clock_settings
+        self.subscriptions = []
+        self.channels = []
+        self.Nexclusive = 0
+        self.restart_timer = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and not self._stop_event.is_set()
+
+    def merge_channels(self):
+        """Merge the subscribed channels into the task channels, the first definition of a channel wins"""
+        self.channels = []
+        names = []
+        for subscription in self.subscriptions:
+            for channel in subscription.channels:
+                if channel.name not in names:
+                    names.append(channel.name)
+                    self.channels.append(channel)
+        for subscription in self.subscriptions:
+            subscription.rows = [names.index(name) for name in subscription.channel_names]
+
+    def start(self):
+        if self.running or len(self.channels) == 0:
+            return
+        self.stop()  # a reader asked to stop before has to be gone before the task is touched
+        self.daqmx.update_task(self.channels, self.clock_settings)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ask the reading thread to stop and wait for it to exit
+
+        The thread exits after its pending read, within a block duration. If it did not (the read hangs), a
+        RuntimeError is raised, the task being left untouched: a later stop or start waits for the thread again.
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        timeout = self.clock_settings.Nsamples / self.clock_settings.frequency + 1.
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise RuntimeError(f'The acquisition thread of {self.device} did not exit within {timeout:.1f}s, its task '
+                               f'cannot be stopped nor reconfigured')
+        self._thread = None
+
+    def cancel_restart(self):
+        if self.restart_timer is not None:
+            self.restart_timer.cancel()
+            self.restart_timer = None
+
+    def pause(self):
+        """Stop the task for an exclusive use of the device, telling the subscribers"""
+        self.cancel_restart()
+        self.stop()
+        for subscription in self.subscriptions:
+            if subscription.pause_callback is not None:
+                try:
+                    subscription.pause_callback()
+                except Exception as e:
+                    logger.exception(str(e))
+
+    def _run(self):
+        self.daqmx.start()
+        try:
+            while not self._stop_event.is_set():
+                data = self.daqmx.readAnalog(len(self.channels), self.clock_settings)
+                data = np.reshape(data, (len(self.channels), -1))
+                for subscription in list(self.subscriptions):
+                    if subscription.rows is None:  # subscribed while the thread is being stopped
+                        continue
+                    try:
+                        subscription.callback(data[subscription.rows])
+                    except Exception as e:
+                        logger.exception(str(e))
+        finally:
+            self.daqmx.stop()
+
+
+class DAQmxArbiter:
+    """Process wide arbiter of the NI-DAQ analog input resources shared by the MOKE plugins
+
+    Channel requests are merged per device into a single continuous task whose samples are fanned out to the
+    subscribers. A plugin needing the device for its own (finite, hardware timed...) task acquires it: the shared task
+    is then stopped until the device is released. All reconfigurations are serialized.
+
+    The shared task is restarted release_delay s after the last release, so that consecutive acquisitions (the points
+    of a scan) do not stop and restart it each time.
+
+    Parameters
+    ----------
+    factory: (callable) returns a new task wrapper (for instance the DAQmx class)
+    clock_factory: (callable) returns the ClockSettings of the shared tasks
+    release_delay: (float) the delay (s) before restarting the shared task after the device is released
+    """
+
+    def __init__(self, factory, clock_factory, release_delay=0.):
+        self._factory = factory
+        self._clock_factory = clock_factory
+        self.release_delay = release_delay
+        self._lock = threading.RLock()
+        self._streams = dict([])
+
+    def _get_stream(self, device) -> DeviceStream:
+        if device not in self._streams:
+            self._streams[device] = DeviceStream(device, self._factory(), self._clock_factory())
+        return self._streams[device]
+
+    def _reconfigure(self, stream: DeviceStream):
+        stream.cancel_restart()
+        stream.stop()
+        stream.merge_channels()
+        if stream.Nexclusive == 0:
+            stream.start()
+
+    def subscribe(self, channels, callback, pause_callback=None) -> Subscription:
+        """Subscribe to the samples of analog input channels, all on the same device (see Subscription)"""
+        devices = set([get_device(channel.name) for channel in channels])
+        if len(devices) != 1:
+            raise ValueError(f'Subscribed channels should belong to a single device, not {devices}')
+        subscription = Subscription(channels, callback, pause_callback)
+        with self._lock:
+            stream = self._get_stream(devices.pop())
+            stream.subscriptions.append(subscription)
+            try:
+                self._reconfigure(stream)
+            except Exception:
+                stream.subscriptions.remove(subscription)
+                raise
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for stream in self._streams.values():
+                if subscription in stream.subscriptions:
+                    stream.subscriptions.remove(subscription)
+                    self._reconfigure(stream)
+
+    def acquire(self, device):
+        """Pause the shared task of the device so that the caller can use its own tasks on it until released"""
+        with self._lock:
+            stream = self._get_stream(get_device(device))
+            stream.Nexclusive += 1
+            try:
+                if stream.running:
+                    stream.pause()
+                else:
+                    stream.cancel_restart()  # still paused since the previous release
+                    stream.stop()  # waiting for a thread that did not exit when asked to
+            except Exception:
+                stream.Nexclusive -= 1
+                raise
+
+    def release(self, device):
+        with self._lock:
+            stream = self._get_stream(get_device(device))
+            stream.Nexclusive = max((0, stream.Nexclusive - 1))
+            if stream.Nexclusive == 0:
+                stream.cancel_restart()
+                if self.release_delay > 0:
+                    stream.restart_timer = threading.Timer(self.release_delay, self._restart, [stream])
+                    stream.restart_timer.daemon = True
+                    stream.restart_timer.start()
+                else:
+                    stream.start()
+
+    def _restart(self, stream: DeviceStream):
+        with self._lock:
+            stream.restart_timer = None
+            if stream.Nexclusive == 0:
+                try:
+                    stream.start()
+                except Exception as e:
+                    logger.exception(str(e))
+
+
+_arbiter = None
+_arbiter_lock = threading.Lock()
+
+
+def get_arbiter() -> DAQmxArbiter:
+    """Get the process wide DAQmxArbiter, created on first use"""
+    global _arbiter
+    with _arbiter_lock:
+        if _arbiter is None:
+            from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import DAQmx, ClockSettings
+            from pymodaq_plugins_moke import config
+            _arbiter = DAQmxArbiter(
+                DAQmx, lambda: ClockSettings(frequency=config('daqmx', 'frequency'),
+                                             Nsamples=config('daqmx', 'block_samples'), repetition=True),
+                release_delay=config('daqmx', 'release_delay_s'))
+        return _arbiter
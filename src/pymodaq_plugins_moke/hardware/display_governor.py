@@ -0,0 +1,70 @@
+from time import perf_counter
+
+import numpy as np
+import pyqtgraph as pg
+
+
+class DisplayGovernor:
+    """Limit the rate of the display levels of the live frames and compute them on a subsample
+
+    It is called from the acquisition callback for each completed average: the levels are computed only if the
+    previous ones were more than 1 / max_fps ago, the rate at which the DAQ_Viewer displays the frames (its refresh
+    time). The frames themselves are all emitted.
+
+    Parameters
+    ----------
+    max_fps: (float) the maximum number of level updates per second, 0 for no limit
+    stride: (int) the step, along both axes, of the subsample used to compute the levels
+    percentile: (float) the percentage of the subsample pixels clipped at each end of the levels
+    """
+
+    def __init__(self, max_fps=25., stride=8, percentile=0.5):
+        self.max_fps = max_fps
+        self.stride = stride
+        self.percentile = percentile
+        self._last_time = None
+        self.Ndropped = 0
+
+    def reset(self):
+        self._last_time = None
+        self.Ndropped = 0
+
+    def accept(self) -> bool:
+        """Tell if the levels of a frame completed now should be computed"""
+        now = perf_counter()
+        if self.max_fps > 0 and self._last_time is not None and now - self._last_time < 1 / self.max_fps:
+            self.Ndropped += 1
+            return False
+        self._last_time = now
+        return True
+
+    def levels(self, data: np.ndarray, symmetric=False):
+        """Get the (low, high) display levels of an image from its strided subsample
+
+        Parameters
+        ----------
+        data: (ndarray) the image
+        symmetric: (bool) if True, the levels are centered on zero (subtraction images)
+        """
+        stride = max((1, int(self.stride)))
+        sub = data[::stride, ::stride] if data.ndim == 2 else data[::stride]
+        if symmetric:
+            high = float(np.percentile(np.abs(sub), 100 - self.percentile))
+            return -high, high
+        low, high = np.percentile(sub, [self.percentile, 100 - self.percentile])
+        return float(low), float(high)
+
+
+def set_viewer_levels(viewer, levels):
+    """Set the levels of the histograms of a 2D viewer, its own auto levels being turned off
+
+    Parameters
+    ----------
+    viewer: (Viewer2D) the viewer of a DAQ_Viewer
+    levels: (tuple) the (low, high) levels
+    """
+    for action in ('autolevels', 'auto_levels_sym'):
+        if viewer.is_action_checked(action):
+            viewer.get_action(action).trigger()
+    for histogram in viewer.parent.findChildren(pg.HistogramLUTWidget):
+        histogram.setLevels(*levels)
@@ -9,6 +9,26 @@ from pymodaq.utils.gui_utils.widgets import QLED
 from collections import OrderedDict
 from pathlib import Path
 
+from pymodaq_plugins_moke import config
+
+
+def load_sequences():
+    """Get the LED sequences defined in the [micro.led.sequences] section of the config
+
+    Returns
+    -------
+    OrderedDict: the sequences by name, each a dict with a title, an image path (or None), a blank flag and a list of
+        steps (dict of LED intensities with an optional repeat count)
+    """
+    sequences = OrderedDict([])
+    for name, sequence in config('micro', 'led', 'sequences').items():
+        image_path = Path(__file__).parent.joinpath('images', sequence.get('image', f'{name}_leds.png'))
+        sequences[name] = dict(title=sequence.get('title', name),
+                               image=str(image_path) if image_path.is_file() else None,
+                               blank=bool(sequence.get('blank', True)),
+                               steps=[dict(step) for step in sequence['steps']])
+    return sequences
+
 
 class LedControl(QtCore.QObject):
     led_type_signal = QtCore.Signal(dict)
@@ -150,18 +170,17 @@ class SequenceLedControl(QtCore.QObject):
 
     sequence_signal = QtCore.Signal()
 
-    sequence_types = ['polar', 'polar_hor', 'polar_ver', 'longitudinal_hor', 'longitudinal_ver', 'longitudinal_dual']
-    sequence_titles = ['Polar', 'Polar Horizontal', 'Polar Vertical', 'Longitudinal Horizontal',
-                       'Longitudinal Vertical', 'Longitudinal Dual']
-
     def __init__(self, parent_widget):
         super().__init__()
         self.parent = parent_widget
+        self.sequences = load_sequences()
         self.setupUi()
 
         self.connecting()
 
-        self.sequence = [dict(top=True, bottom=True, left=True, right=True)]
+        first = next(iter(self.sequences.values()))
+        self.sequence = first['steps']
+        self.blank = first['blank']
 
     def connecting(self):
         self.radio_group.buttonClicked[QtWidgets.QAbstractButton].connect(self.update_sequence)
@@ -177,16 +196,17 @@ class SequenceLedControl(QtCore.QObject):
         self.radio_buttons = OrderedDict([])
         self.sequences_label = OrderedDict([])
         widgets = []
-        for ind, sequence in enumerate(self.sequence_types):
+        for ind, sequence in enumerate(self.sequences):
             widgets.append(QtWidgets.QWidget())
             widgets[-1].setLayout(QtWidgets.QHBoxLayout())
             self.scroll_widget.layout().addWidget(widgets[-1])
-            self.radio_buttons[sequence] = QtWidgets.QRadioButton(self.sequence_titles[ind])
+            self.radio_buttons[sequence] = QtWidgets.QRadioButton(self.sequences[sequence]['title'])
+            self.radio_buttons[sequence].setObjectName(sequence)
             if ind == 0:
                 self.radio_buttons[sequence].setChecked(True)
             self.sequences_label[sequence] = QtWidgets.QLabel()
-            image_path = str(Path(__file__).parent.joinpath(f'images/{sequence}_leds.png'))
-            self.sequences_label[sequence].setPixmap(QtGui.QPixmap(image_path))
+            if self.sequences[sequence]['image'] is not None:
+                self.sequences_label[sequence].setPixmap(QtGui.QPixmap(self.sequences[sequence]['image']))
 
             self.radio_group.addButton(self.radio_buttons[sequence])
             widgets[-1].layout().addWidget(self.radio_buttons[sequence])
@@ -201,24 +221,9 @@ class SequenceLedControl(QtCore.QObject):
         self.parent.setMaximumWidth(570)
 
     def update_sequence(self, button):
-        seq_type = self.sequence_types[self.sequence_titles.index(button.text())]
-        if seq_type == 'polar':
-            self.sequence = [dict(top=True, bottom=True, left=True, right=True)]
-        elif seq_type == 'polar_hor':
-            self.sequence = [dict(top=False, bottom=False, left=True, right=True)]
-        elif seq_type == 'polar_ver':
-            self.sequence = [dict(top=True, bottom=True, left=False, right=False)]
-        elif seq_type == 'longitudinal_hor':
-            self.sequence = [dict(top=False, bottom=False, left=True, right=False),
-                             dict(top=False, bottom=False, left=False, right=True)]
-        elif seq_type == 'longitudinal_ver':
-            self.sequence = [dict(top=True, bottom=False, left=False, right=False),
-                             dict(top=False, bottom=True, left=False, right=False)]
-        elif seq_type == 'longitudinal_dual':
-            self.sequence = [dict(top=True, bottom=False, left=False, right=False),
-                             dict(top=False, bottom=True, left=False, right=False),
-                             dict(top=False, bottom=False, left=True, right=False),
-                             dict(top=False, bottom=False, left=False, right=True)]
+        sequence = self.sequences[button.objectName()]
+        self.sequence = sequence['steps']
+        self.blank = sequence['blank']
 
         self.sequence_signal.emit()
 
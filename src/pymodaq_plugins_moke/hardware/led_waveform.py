@@ -0,0 +1,93 @@
+import numpy as np
+
+
+def phase_pattern(sequence_list):
+    """Get the sign with which the grabber accumulates each frame of a cycle of a LED sequence
+
+    Each step may define a 'sign': 1 (added), -1 (subtracted) or 0 (ignored); by default the steps are alternately
+    added and subtracted, a single step being added. A step repeated n times gives n frames with its sign.
+
+    Parameters
+    ----------
+    sequence_list: (list of dict) the LED steps
+
+    Returns
+    -------
+    list of int: the sign of each frame of a cycle
+    """
+    phases = []
+    for ind, step in enumerate(sequence_list):
+        sign = int(step.get('sign', 1 if ind % 2 == 0 else -1))
+        phases.extend([sign] * int(step.get('repeat', 1)))
+    return phases
+
+
+class LedWaveformCompiler:
+    """Compile a sequence of LED steps into the clocked analog output waveform of the LED driver
+
+    Each step maps LED names to an intensity, a factor applied to the LED value (a bool meaning full or no intensity,
+    a missing LED being off), and may define a 'repeat' count. The waveform is clocked on both edges of the camera
+    TTL, so each step gives two samples: the first one is output during the exposure and the second one during the
+    readout, all LEDs being off (blank is True) or kept at the step intensities (blank is False). The waveform is a
+    C-contiguous (Nchannels, Nsamples) array, as expected by DAQmx.writeAnalog for data grouped by channel. The
+    intensity pattern of a sequence is built once and kept until another sequence is compiled; the waveform is then
+    only recomputed for the channels whose value changed.
+
+    Parameters
+    ----------
+    channels: (list of str) the LED names, in the order of the analog output channels
+    """
+
+    def __init__(self, channels):
+        self.channels = list(channels)
+        self._sequence_key = None
+        self._pattern = None
+        self._values = None
+        self.waveform = None
+
+    def sequence_key(self, sequence_list, blank=True):
+        steps = [tuple([float(step.get(channel, 0.)) for channel in self.channels] + [int(step.get('repeat', 1))])
+                 for step in sequence_list]
+        return (bool(blank),) + tuple(steps)
+
+    def compile_pattern(self, sequence_list, blank=True):
+        """Build the (Nchannels, Nsamples) intensity pattern of a sequence, readout samples and repeats included"""
+        intensities = np.array([[float(step.get(channel, 0.)) for step in sequence_list] for channel in self.channels],
+                               dtype=float).reshape((len(self.channels), len(sequence_list)))
+        repeats = np.array([int(step.get('repeat', 1)) for step in sequence_list], dtype=int)
+        pattern = np.zeros((len(self.channels), len(sequence_list), 2), dtype=float)  # exposure, readout
+        pattern[:, :, 0] = intensities
+        if not blank:
+            pattern[:, :, 1] = intensities
+        return np.repeat(pattern, repeats, axis=1).reshape((len(self.channels), -1))
+
+    def compile(self, sequence_list, values, blank=True):
+        """Get the waveform of a sequence for the given LED values
+
+        Parameters
+        ----------
+        sequence_list: (list of dict) the LED steps, each dict mapping the LED names to an intensity (or a bool)
+        values: (array like) the value of each LED, in the order of the channels
+        blank: (bool) if True, all LEDs are off during the readout following each step
+
+        Returns
+        -------
+        ndarray: the C-contiguous (Nchannels, Nsamples) waveform
+        ndarray: the indexes of the channels whose waveform changed, all of them if the sequence changed
+        """
+        values = np.asarray(values, dtype=float)
+        key = self.sequence_key(sequence_list, blank)
+        if key != self._sequence_key:
+            self._sequence_key = key
+            self._pattern = self.compile_pattern(sequence_list, blank)
+            self.waveform = np.zeros(self._pattern.shape, dtype=float)
+            changed = np.arange(len(self.channels))
+        else:
+            changed = np.flatnonzero(values != self._values)
+        if changed.size != 0:
+            self.waveform[changed] = self._pattern[changed] * values[changed, np.newaxis]
+        self._values = values.copy()
+        return self.waveform, changed
+
+    def invalidate(self):
+        self._sequence_key = None
@@ -0,0 +1,97 @@
+import numpy as np
+import pyqtgraph as pg
+
+from qtpy import QtWidgets, QtCore
+
+
+def roi_signal(dte) -> float:
+    """Get the Kerr signal from the data exported by the camera: the first ROI mean if any, else the image mean
+
+    Parameters
+    ----------
+    dte: (DataToExport) as emitted by the grab_done_signal of the detector
+    """
+    data_0D = dte.get_data_from_dim('Data0D')
+    if len(data_0D) != 0:
+        return float(np.squeeze(data_0D.data[0][0]))
+    return float(np.mean(dte.data[0][0]))
+
+
+class LiveLoopPlot(QtCore.QObject):
+    """Incremental plot of a hysteresis loop: the detector signal against the actuator value, point by point
+
+    The points are appended to preallocated arrays (grown by doubling if the scan has more points than expected) and
+    the curve is redrawn by a timer, at most every refresh_ms, if points were added. Above max_displayed points, the
+    displayed curve is subsampled.
+
+    Parameters
+    ----------
+    parent_widget: (QWidget) the widget holding the plot
+    max_displayed: (int) the maximum number of displayed points
+    refresh_ms: (int) the minimum time between two redraws of the curve
+    """
+
+    def __init__(self, parent_widget, max_displayed=2000, refresh_ms=100):
+        super().__init__()
+        self.parent = parent_widget
+        self.max_displayed = max_displayed
+        self.active = False
+        self.actuator_value = None
+        self._x = np.zeros((0,))
+        self._y = np.zeros((0,))
+        self._npoints = 0
+        self._Ndisplayed = 0
+        self.redraw_timer = QtCore.QTimer()
+        self.redraw_timer.setInterval(refresh_ms)
+        self.redraw_timer.timeout.connect(self.redraw)
+        self.setupUi()
+
+    def setupUi(self):
+        self.parent.setLayout(QtWidgets.QVBoxLayout())
+        self.plot_widget = pg.PlotWidget()
+        self.plot_widget.setLabel('bottom', 'Current')
+        self.plot_widget.setLabel('left', 'Kerr signal')
+        self.curve = self.plot_widget.plot(pen='r', symbol='o', symbolSize=4)
+        self.parent.layout().addWidget(self.plot_widget)
+
+    @property
+    def npoints(self):
+        return self._npoints
+
+    def start(self, npoints):
+        """Clear the plot and preallocate the arrays for a scan of npoints"""
+        self._x = np.zeros((max((1, npoints)),))
+        self._y = np.zeros((max((1, npoints)),))
+        self._npoints = 0
+        self._Ndisplayed = 0
+        self.actuator_value = None
+        self.curve.setData([], [])
+        self.active = True
+        self.redraw_timer.start()
+
+    def stop(self):
+        self.active = False
+        self.redraw_timer.stop()
+        self.redraw()
+
+    def set_actuator_value(self, value: float):
+        self.actuator_value = value
+
+    def add_point(self, signal: float):
+        """Append a point made of the latest actuator value and the given signal"""
+        if not self.active or self.actuator_value is None:
+            return
+        if self._npoints == self._x.size:
+            self._x = np.concatenate((self._x, np.zeros_like(self._x)))
+            self._y = np.concatenate((self._y, np.zeros_like(self._y)))
+        self._x[self._npoints] = self.actuator_value
+        self._y[self._npoints] = signal
+        self._npoints += 1
+
+    def redraw(self):
+        """Update the curve data if points were added since the last redraw"""
+        if self._npoints == self._Ndisplayed:
+            return
+        self._Ndisplayed = self._npoints
+        stride = int(np.ceil(self._npoints / self.max_displayed))
+        self.curve.setData(self._x[:self._npoints:stride], self._y[:self._npoints:stride])
@@ -0,0 +1,362 @@
+import numpy as np
+from qtpy import QtWidgets, QtCore
+from pymodaq.utils.daq_utils import ThreadCommand
+from pymodaq.utils.data import DataFromPlugins
+from pymodaq.utils.logger import set_logger, get_module_name
+
+from pymodaq_plugins_andor.daq_viewer_plugins.plugins_2D.daq_2Dviewer_AndorSCMOS import DAQ_2DViewer_AndorSCMOS
+from time import perf_counter, time
+from pymodaq_plugins_moke import config
+from pymodaq_plugins_moke.hardware.display_governor import DisplayGovernor
+
+logger = set_logger(get_module_name(__file__))
+
+
+class DAQ_2DViewer_MOKEGrabber(DAQ_2DViewer_AndorSCMOS):
+    """
+        Inherited class from Andor SCMOS camera
+
+    """
+    hardware_averaging = True  # will use the accumulate acquisition mode if averaging is neccessary
+    live_mode_available = True
+    params = DAQ_2DViewer_AndorSCMOS.params + \
+        [{'title': 'Do substraction:', 'name': 'do_sub', 'type': 'bool', 'value': False},
+         {'title': 'Live display:', 'name': 'display', 'type': 'group', 'children': [
+             {'title': 'Max fps:', 'name': 'max_fps', 'type': 'float', 'value': config('micro', 'display', 'max_fps'),
+              'min': 0., 'tip': 'Maximum rate of the displayed live averages (refresh time of the DAQ_Viewer), 0 '
+                                'for no limit. All the averages are still emitted (saving, scans, ROIs...)'},
+             {'title': 'Governed levels:', 'name': 'levels', 'type': 'bool',
+              'value': config('micro', 'display', 'governed_levels'),
+              'tip': 'Compute the levels on a subsample of the displayed frames instead of the viewer auto levels'},
+             {'title': 'Levels stride:', 'name': 'stride', 'type': 'int', 'value': config('micro', 'display', 'stride'),
+              'min': 1},
+         ]}]
+
+
+    def __init__(self, parent=None, params_state=None):
+
+        super().__init__(parent, params_state)  # initialize base class with commom attributes and methods
+
+        self.buffers = []
+        self.buffers_pointer = []
+        self._Nbuffers = None
+        self._reset_buffers_cmd = False
+        self.refresh_time_fr = 200
+
+        self.current_buffer = -1
+        self.n_grabed_data = None
+        self.n_grabed_frame_rate = None
+        self.start_time = None
+        self.live = False
+        self.wait_time = 0
+
+        self.x_axis = None
+        self.y_axis = None
+        self.camera_controller = None
+        self.data = None
+        self.SIZEX, self.SIZEY = (None, None)
+        self.camera_done = False
+        self.acquirred_image = None
+        self.callback_thread = None
+        self.Naverage = None
+        self.data_shape = None  # 'Data2D' if sizey != 1 else 'Data1D'
+
+        self.phases = None  # sign of each frame of a cycle (see set_phases)
+        self._weights = None
+        self.set_phases([1])
+        self._pending_phases = None  # phases to be applied at a frame boundary (see reconfigure_phases)
+        self._grabbing = False
+        self.display_governor = DisplayGovernor(config('micro', 'display', 'max_fps'),
+                                                config('micro', 'display', 'stride'),
+                                                config('micro', 'display', 'percentile'))
+
+        self.temperature_timer = QtCore.QTimer()
+        self.temperature_timer.timeout.connect(self.update_temperature)
+
+    def commit_settings(self, param):
+
+        if param.parent() is not None and param.parent().name() == 'display':
+            if param.name() == 'max_fps':
+                self.display_governor.max_fps = param.value()
+                self.update_display_rate()
+            elif param.name() == 'stride':
+                self.display_governor.stride = param.value()
+        elif param.name() == 'do_sub':
+            if param.value() != bool(np.any(self.phases < 0)):  # set by hand: default two frames pattern
+                self.set_phases([1, -1] if param.value() else [1])
+        else:
+            super().commit_settings(param)
+
+    def emit_data(self, buffer_pointer):
+        """
+            Fonction used to emit data obtained by callback.
+
+            See Also
+            --------
+            daq_utils.ThreadCommand
+        """
+        try:
+            t_frame = perf_counter()
+            buff_temp = buffer_pointer[0]
+            self.current_buffer += 1
+            self.n_grabed_data += 1
+            self.n_grabed_frame_rate += 1
+            #print(f'ind_grabemit:{self.n_grabed_data}')
+            self.current_buffer = self.current_buffer % self._Nbuffers
+            #print(f'ind_current_buffer:{self.current_buffer}')
+
+            if self.buffers[self.current_buffer].ctypes.data != buff_temp:
+                # buff_val = [self.buffers[ind].ctypes.data for ind in range(len(self.buffers))].index(buff_temp)
+                # print(f'Buffer index should be {self.current_buffer} but is in fact {buff_val}')
+                self.stop()
+                QtWidgets.QApplication.processEvents()
+
+                self.emit_status(ThreadCommand('Update_Status',
+                                               ['Returned buffer not equal to expected buffer,'
+                                                ' restarting acquisition and'
+                                                ' freeing buffers', 'log']))
+                logger.warning('Returned buffer not equal to expected buffer, restarting acquisition and'
+                               ' freeing buffers')
+                self._reset_buffers_cmd = True
+                self.grab_data(self.Naverage, live=self.live, wait_time=self.wait_time)
+                return
+
+            if self._pending_phases is not None:  # at a frame boundary
+                if not self.apply_pending_phases(t_frame):  # frame acquired while the LEDs were switching
+                    self.n_grabed_data = 0
+                    self.camera_controller.queue_single_buffer(self.buffers[self.current_buffer])
+                    return
+                self.ind_sub = 0
+                self.n_grabed_data = 1  # this frame starts a new average
+
+            Naverage_sub = self.phases.size * self.Naverage
+
+            cam_name = self.settings.child('camera_settings', 'camera_model').value()
+            Nx = self.settings.child('camera_settings', 'image_settings', 'im_width').value()
+            Ny = self.settings.child('camera_settings', 'image_settings', 'im_height').value()
+            data = self.camera_controller.get_image_fom_buffer(Nx, Ny, self.buffers[self.current_buffer]).T
+
+            weight = self._weights[self.ind_sub % self.phases.size] / self.Naverage
+            if (self.n_grabed_data-1) % Naverage_sub == 0:
+                self.data = weight * data
+                logger.debug(f'Init data')
+            else:
+                logger.debug(f'Adding data with weight {weight}')
+                self.data += weight * data
+
+            logger.debug(f'Naverage_sub: {Naverage_sub}')
+            logger.debug(f'n_grabed_data: {self.n_grabed_data}')
+            logger.debug(f'ind_sub: {self.ind_sub}')
+            logger.debug(f'live: {self.live}')
+            self.ind_sub += 1
+
+            if not self.live:
+                if self.n_grabed_data > Naverage_sub:
+                    self.stop()
+                else:
+                    #self.data += 1 / self.Naverage * data
+                    if self.n_grabed_data == Naverage_sub:
+                        logger.debug(f'emit snap')
+                        self.data_grabed_signal.emit([
+                            DataFromPlugins(name=cam_name, data=[self.data], dim=self.data_shape)])
+                        self.stop()
+                    # elif self.n_grabed_data < self.Naverage:
+                    #     if self.ind_sub % 2 == 1:
+                    #         self.data_grabed_signal_temp.emit([
+                    #             DataFromPlugins(name=cam_name, data=[self.data * self.Naverage / self.n_grabed_data],
+                    #                             dim=self.data_shape)])
+            else:  # in live mode
+                if perf_counter() - self.start_time > self.refresh_time_fr / 1000:  # refresh the frame rate every
+                    # refresh_time_fr ms
+                    self.settings.child('camera_settings',
+                                        'frame_rate').setValue(self.n_grabed_frame_rate / (self.refresh_time_fr / 1000))
+                    self.start_time = perf_counter()
+                    self.n_grabed_frame_rate = 0
+
+                # every average is emitted, the DAQ_Viewer only displaying them at max_fps (its refresh time): the
+                # levels are only computed at that rate too
+                if self.n_grabed_data % Naverage_sub == 0:
+                    logger.debug(f'emit grab')
+                    self.data_grabed_signal.emit([
+                        DataFromPlugins(name=cam_name, data=[self.data], dim=self.data_shape)])
+                    if self.settings['display', 'levels'] and self.display_governor.accept():
+                        self.emit_status(ThreadCommand('display_levels', [
+                            self.display_governor.levels(self.data, symmetric=self.settings['do_sub'])]))
+                # else:
+                #     if self.ind_sub % 2 == 1:
+                #         if self.n_grabed_data % self.Naverage != 0:
+                #             n_grabed = self.n_grabed_data % self.Naverage
+                #         else:
+                #             n_grabed = self.Naverage
+                #         self.data_grabed_signal_temp.emit([
+                #             DataFromPlugins(name=cam_name,
+                #                             data=[self.data * self.Naverage / n_grabed],
+                #                             dim=self.data_shape)])
+
+            self.camera_controller.queue_single_buffer(self.buffers[self.current_buffer])
+
+        except Exception as e:
+            logger.exception(str(e))
+
+    def ini_detector(self, controller=None):
+        status = super().ini_detector(controller)
+        self.update_display_rate()
+        return status
+
+    def update_display_rate(self):
+        """Throttle the display of the live averages through the refresh time of the DAQ_Viewer, which still emits
+        (and saves) all of them"""
+        max_fps = self.settings['display', 'max_fps']
+        self.emit_status(ThreadCommand('update_main_settings', [['refresh_time'],
+                                                                1000 / max_fps if max_fps > 0 else 0., 'value']))
+
+    def apply_camera_profile(self, profile):
+        """Apply a whole camera profile in one go from the detector thread
+
+        The exposure and the encoding are committed one by one. The binnings are all set before the image geometry is
+        applied once to the camera, the buffers being then reallocated once by the next grab. A
+        'camera_profile_applied' ThreadCommand is finally sent with the profile.
+
+        Parameters
+        ----------
+        profile: (dict) with optional keys exposure_ms, encoding_index, binning_x and binning_y
+        """
+        params = []
+        if 'exposure_ms' in profile:
+            params.append((self.settings.child('camera_settings', 'exposure'), profile['exposure_ms']))
+        if 'encoding_index' in profile:
+            param = self.settings.child('camera_settings', 'encoding')
+            params.append((param, param.opts['limits'][profile['encoding_index']]))
+        for param, value in params:
+            if param.value() != value:
+                param.setValue(value)
+                self.commit_settings(param)
+
+        geometry_changed = False
+        for key, name in (('binning_x', 'bin_x'), ('binning_y', 'bin_y')):
+            param = self.settings.child('camera_settings', 'image_settings', name)
+            if key in profile and param.value() != profile[key]:
+                param.setValue(profile[key])
+                geometry_changed = True
+        if geometry_changed:
+            try:
+                self.apply_binning()
+            except Exception as e:
+                self.emit_status(ThreadCommand('Update_Status', [str(e), 'log']))
+        self.emit_status(ThreadCommand('camera_profile_applied', [profile]))
+
+    def mark_frames(self):
+        """Send a 'frames_marked' ThreadCommand with the current time. The detector thread processes its commands in
+        order, so every frame of an aborted snap has been created (and timestamped) before this mark"""
+        self.emit_status(ThreadCommand('frames_marked', [time()]))
+
+    def apply_binning(self):
+        """Set both binnings on the camera and update the image geometry once"""
+        self.stop()
+        QtWidgets.QApplication.processEvents()
+        self.camera_controller.AOIHBin.setValue(self.settings['camera_settings', 'image_settings', 'bin_x'])
+        self.camera_controller.AOIVBin.setValue(self.settings['camera_settings', 'image_settings', 'bin_y'])
+        self.settings.child('camera_settings', 'image_settings', 'im_width').setValue(
+            self.camera_controller.AOIWidth.getValue())
+        self.settings.child('camera_settings', 'image_settings', 'im_height').setValue(
+            self.camera_controller.AOIHeight.getValue())
+        self.setup_image()
+
+    def activate_substraction(self, do_sub=False):
+        self.set_phases([1, -1] if do_sub else [1])
+
+    def set_phases(self, phases):
+        """Set the sign with which each frame of a cycle is accumulated
+
+        The frames of each sign are averaged separately, so that the result is the mean of the added frames minus the
+        mean of the subtracted ones whatever their number in a cycle.
+
+        Parameters
+        ----------
+        phases: (list of int) 1 (added), -1 (subtracted) or 0 (ignored) for each frame of a cycle
+        """
+        self.phases = np.asarray(phases, dtype=int).reshape((-1,))
+        counts = dict([(sign, max((1, np.count_nonzero(self.phases == sign)))) for sign in (-1, 1)])
+        self._weights = np.array([sign / counts[sign] if sign != 0 else 0. for sign in self.phases])
+        self.settings.child('do_sub').setValue(bool(np.any(self.phases < 0)))
+
+    def reconfigure_phases(self, phases=(1,), n_discard=0, wait_sync=False):
+        """Change the subtraction phases without stopping the acquisition
+
+        The frames are dropped until the change is applied, the running average being then restarted. For a change of
+        LED sequence (wait_sync is True), the frames are dropped until the LED driver reports the camera readout at
+        which it started its tasks (see synchronize_phases), so that the first frame of the new average is the one
+        exposed with the first step. Else the change is applied after the n_discard next frames. If not grabbing, it
+        is applied by the next grab.
+
+        Parameters
+        ----------
+        phases: (list of int) the sign of each frame of a cycle, see set_phases
+        n_discard: (int) the number of frames to drop after the change
+        wait_sync: (bool) if True, wait for synchronize_phases before applying the change
+        """
+        self._pending_phases = dict(phases=phases, n_discard=n_discard, wait_sync=wait_sync, t_sync=None)
+
+    def synchronize_phases(self, t_sync=None):
+        """Apply the pending phases from the frame boundary at which the LED driver started its sequence
+
+        The frames received before t_sync and the frame being read out at t_sync are dropped, the next one being
+        exposed with the first step of the sequence. This assumes the frames are received less than a frame period
+        after their readout. Without pending change (the sequence restarted for new LED values), the current phases
+        are restarted the same way.
+
+        Parameters
+        ----------
+        t_sync: (float) the time (perf_counter) of the beginning of the readout at which the LED tasks started, None
+            if the LED driver saw the camera not grabbing
+        """
+        pending = self._pending_phases
+        if pending is None:
+            if self.phases is None:
+                return
+            pending = dict(phases=self.phases, n_discard=0, wait_sync=True, t_sync=None)
+        elif not pending['wait_sync']:
+            return
+        if t_sync is None and self._grabbing:
+            logger.warning('The LED sequence was started without camera frame boundary, the phases may be wrong')
+        self._pending_phases = dict(phases=pending['phases'], n_discard=0 if t_sync is None else 1,
+                                    wait_sync=False, t_sync=t_sync)
+
+    def apply_pending_phases(self, t_frame=None):
+        """Apply the pending phases if the frame received at t_frame (perf_counter) starts the new average
+
+        Returns
+        -------
+        bool: False if the frame should be dropped
+        """
+        pending = self._pending_phases
+        if pending['wait_sync']:
+            return False
+        if pending['t_sync'] is not None and t_frame is not None and t_frame < pending['t_sync']:
+            return False
+        if pending['n_discard'] > 0:
+            pending['n_discard'] -= 1
+            return False
+        self.set_phases(pending['phases'])
+        self._pending_phases = None
+        return True
+
+    def grab_data(self, Naverage=1, **kwargs):
+        """
+        """
+        if self._pending_phases is not None and not self._pending_phases['wait_sync']:
+            # the acquisition restarts anyway, no frame to discard
+            self.set_phases(self._pending_phases['phases'])
+            self._pending_phases = None
+        self.ind_sub = 0
+        self.display_governor.reset()
+        Naverage_sub = self.phases.size * Naverage
+        self._grabbing = True
+        super().grab_data(Naverage_sub, **kwargs)
+        self.Naverage = Naverage
+
+    def stop(self):
+        self._grabbing = False
+        super().stop()
+        QtWidgets.QApplication.processEvents()
+        self.emit_status(ThreadCommand('stopped'))
@@ -0,0 +1,120 @@
+import json
+import threading
+from pathlib import Path
+
+from pymodaq.utils.logger import set_logger, get_module_name
+
+logger = set_logger(get_module_name(__file__))
+
+
+def _query_devices():
+    from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import DAQmx
+    return DAQmx.get_NIDAQ_devices()
+
+
+def _query_channels(devices=None, source_type='Analog_Input'):
+    from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import DAQmx
+    return DAQmx.get_NIDAQ_channels(devices=devices, source_type=source_type)
+
+
+def _query_ai_ranges(device):
+    from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import DAQmx
+    return [list(r) for r in DAQmx.getAIVoltageRange(device)]
+
+
+def _query_ao_ranges(device):
+    from pymodaq_plugins_daqmx.hardware.national_instruments.daqmx import DAQmx
+    return [list(r) for r in DAQmx.getAOVoltageRange(device)]
+
+
+class NIDAQEnumeration:
+    """Memoized enumeration of the NI-DAQ devices, channels and voltage ranges used to build the parameter trees
+
+    Each query hits the driver only once per process. If a snapshot file is given, it is loaded at creation (so that
+    the cache can be pre-filled for offline runs) and saved each time a new query is done.
+
+    Parameters
+    ----------
+    snapshot_path: (str or Path) optional json file storing the enumeration results
+    """
+    queries = dict(devices=_query_devices, channels=_query_channels, ai_ranges=_query_ai_ranges,
+                   ao_ranges=_query_ao_ranges)
+
+    def __init__(self, snapshot_path=None):
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self._cache = dict([])
+        self._lock = threading.Lock()
+        if self.snapshot_path is not None and self.snapshot_path.is_file():
+            self.load()
+
+    @staticmethod
+    def _key(query, *args):
+        return json.dumps([query] + list(args))
+
+    def _get(self, query, *args):
+        key = self._key(query, *args)
+        with self._lock:
+            if key in self._cache:
+                return list(self._cache[key])
+        value = list(self.queries[query](*args))
+        with self._lock:
+            self._cache[key] = value
+        if self.snapshot_path is not None:
+            self.save()
+        return list(value)
+
+    def get_devices(self):
+        return self._get('devices')
+
+    def get_channels(self, devices=None, source_type='Analog_Input'):
+        return self._get('channels', devices, source_type)
+
+    def get_ai_voltage_ranges(self, device):
+        """list of [min, max] voltage ranges of the analog inputs of a device"""
+        return self._get('ai_ranges', device)
+
+    def get_ao_voltage_ranges(self, device):
+        """list of [min, max] voltage ranges of the analog outputs of a device"""
+        return self._get('ao_ranges', device)
+
+    def refresh(self):
+        """Query again the driver for all the cached entries, for instance after plugging a new module"""
+        with self._lock:
+            keys = list(self._cache.keys())
+            self._cache = dict([])
+        for key in keys:
+            query, *args = json.loads(key)
+            try:
+                self._get(query, *args)
+            except Exception as e:
+                logger.warning(f'Could not refresh the NI-DAQ enumeration {key}: {str(e)}')
+
+    def save(self, path=None):
+        path = self.snapshot_path if path is None else Path(path)
+        with self._lock:
+            content = json.dumps(self._cache, indent=1)
+        path.write_text(content)
+
+    def load(self, path=None):
+        path = self.snapshot_path if path is None else Path(path)
+        try:
+            cache = json.loads(path.read_text())
+        except (OSError, ValueError) as e:
+            logger.warning(f'Could not load the NI-DAQ enumeration snapshot {path}: {str(e)}')
+            return
+        with self._lock:
+            self._cache.update(cache)
+
+
+_enumeration = None
+_enumeration_lock = threading.Lock()
+
+
+def get_enumeration() -> NIDAQEnumeration:
+    """Get the process wide NIDAQEnumeration, its snapshot file being set in the daqmx section of the config"""
+    global _enumeration
+    with _enumeration_lock:
+        if _enumeration is None:
+            from pymodaq_plugins_moke import config
+            _enumeration = NIDAQEnumeration(config('daqmx', 'enumeration_snapshot'))
+        return _enumeration
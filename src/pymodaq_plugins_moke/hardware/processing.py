@@ -0,0 +1,84 @@
+import numpy as np
+
+
+def minmax_decimate(x_axis: np.ndarray, signals: list, npoints: int = 1000):
+    """Reduce 1D signals sharing the same axis to about npoints using a min/max envelope.
+
+    The signals are cut into buckets of equal length and, within each bucket, only the minimum and
+    maximum samples are kept (in their chronological order) so that the envelope of the data, and in
+    particular its peaks, is preserved on display. The kept samples differ from one signal to the
+    other, so does the decimated axis: one is returned per signal.
+
+    Parameters
+    ----------
+    x_axis: (ndarray) the axis shared by all signals, of length N
+    signals: (list of ndarray) the signals to decimate, all of length N
+    npoints: (int) the target number of points of the decimated signals
+
+    Returns
+    -------
+    list of ndarray: the decimated axis of each signal
+    list of ndarray: the decimated signals
+    """
+    length = len(x_axis)
+    nbuckets = max(1, int(npoints) // 2)
+    if length <= 2 * nbuckets:
+        return [x_axis for signal in signals], signals
+
+    bucket = int(np.ceil(length / nbuckets))
+    nbuckets = length // bucket
+    stop = nbuckets * bucket  # the incomplete last bucket is appended as is
+
+    offsets = np.arange(nbuckets) * bucket
+    x_decimated = []
+    signals_decimated = []
+    for signal in signals:
+        buckets = signal[:stop].reshape((nbuckets, bucket))
+        ind_min = np.argmin(buckets, axis=1)
+        ind_max = np.argmax(buckets, axis=1)
+        indexes = (np.sort(np.stack((ind_min, ind_max), axis=1), axis=1) + offsets[:, None]).reshape((-1,))
+        x_decimated.append(np.concatenate((x_axis[indexes], x_axis[stop:])))
+        signals_decimated.append(np.concatenate((signal[indexes], signal[stop:])))
+
+    return x_decimated, signals_decimated
+
+
+def find_zero_crossings(signal: np.ndarray, min_distance: float = 1.):
+    """Get the sub-sample positions where a signal crosses its mean value with a positive slope
+
+    Parameters
+    ----------
+    signal: (ndarray) the periodic signal, for instance the magnetic field
+    min_distance: (float) crossings closer than this number of samples from the previous one are considered as noise
+        and discarded
+
+    Returns
+    -------
+    ndarray: the fractional indexes of the crossings obtained by linear interpolation
+    """
+    centered = signal - np.mean(signal)
+    indexes = np.nonzero((centered[:-1] < 0) & (centered[1:] >= 0))[0]
+    crossings = indexes + centered[indexes] / (centered[indexes] - centered[indexes + 1])
+    if len(crossings) > 1:
+        crossings = crossings[np.concatenate(([True], np.diff(crossings) > min_distance))]
+    return crossings
+
+
+def resample_cycles(crossings: np.ndarray, signals: list, npoints: int):
+    """Cut signals into the cycles delimited by consecutive crossings and resample them on a common phase grid
+
+    Parameters
+    ----------
+    crossings: (ndarray) fractional indexes of the start of each cycle, see find_zero_crossings
+    signals: (list of ndarray) the signals to cut and resample
+    npoints: (int) the number of points of the phase grid
+
+    Returns
+    -------
+    list of ndarray: for each signal, a 2D array of shape (Ncycles, npoints) with Ncycles = len(crossings) - 1
+    """
+    phase = np.linspace(0, 1, npoints, endpoint=False)
+    positions = crossings[:-1, None] + np.diff(crossings)[:, None] * phase[None, :]
+    indexes = np.clip(np.floor(positions).astype(int), 0, len(signals[0]) - 2)
+    weights = positions - indexes
+    return [signal[indexes] * (1 - weights) + signal[indexes + 1] * weights for signal in signals]
@@ -0,0 +1,95 @@
+import json
+from pathlib import Path
+from time import perf_counter, sleep
+
+import numpy as np
+
+MAGIC = b'MOKERAW1'
+
+
+class RawRecorder:
+    """Record raw blocks of analog input data into a compact binary file
+
+    The file starts with a magic string, the length of a json header (as a little endian uint32) and the header itself
+    (channels, clock frequency, samples per channel and any other metadata). Blocks of
+    len(channels) x Nsamples float64 values grouped by channel (as returned by DAQmx.readAnalog) follow.
+
+    Parameters
+    ----------
+    path: (str or Path) the file to be created
+    channels: (list of str) the names of the recorded channels
+    frequency: (float) the sampling frequency of the blocks
+    Nsamples: (int) the number of samples per channel in each block
+    metadata: (dict) other json serializable info to store in the header
+    """
+
+    def __init__(self, path, channels, frequency, Nsamples, **metadata):
+        self.path = Path(path)
+        self.block_size = len(channels) * Nsamples
+        self.Nblocks = 0
+        header = json.dumps(dict(channels=list(channels), frequency=frequency, Nsamples=Nsamples,
+                                 **metadata)).encode()
+        self._file = open(self.path, 'wb')
+        self._file.write(MAGIC)
+        self._file.write(np.array([len(header)], dtype='<u4').tobytes())
+        self._file.write(header)
+
+    def write(self, data: np.ndarray):
+        if data.size != self.block_size:
+            raise ValueError(f'Cannot record a block of {data.size} values in a file of {self.block_size} values '
+                             f'blocks')
+        self._file.write(np.ascontiguousarray(data, dtype='<f8').tobytes())
+        self.Nblocks += 1
+
+    def close(self):
+        self._file.close()
+
+
+class RawReplay:
+    """Read back the blocks recorded by a RawRecorder, in a loop
+
+    Parameters
+    ----------
+    path: (str or Path) the recorded file
+    realtime: (bool) if True, next_block waits so that blocks are not delivered faster than they were acquired
+    """
+
+    def __init__(self, path, realtime=False):
+        self.path = Path(path)
+        self.realtime = realtime
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise IOError(f'{self.path} is not a raw MOKE recording')
+            header_length = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+            self.header = json.loads(f.read(header_length).decode())
+        self.channels = self.header['channels']
+        self.frequency = self.header['frequency']
+        self.Nsamples = self.header['Nsamples']
+        block_size = len(self.channels) * self.Nsamples
+        offset = len(MAGIC) + 4 + header_length
+        Nblocks = (self.path.stat().st_size - offset) // (8 * block_size)
+        if Nblocks == 0:
+            raise IOError(f'No recorded block in {self.path}')
+        self._blocks = np.memmap(self.path, dtype='<f8', mode='r', offset=offset, shape=(Nblocks, block_size))
+        self.ind_block = 0
+        self._next_time = None
+
+    @property
+    def Nblocks(self):
+        return self._blocks.shape[0]
+
+    @property
+    def block_duration(self):
+        return self.Nsamples / self.frequency
+
+    def next_block(self) -> np.ndarray:
+        if self.realtime:
+            if self._next_time is not None:
+                sleep(max((0., self._next_time - perf_counter())))
+            self._next_time = perf_counter() + self.block_duration
+        data = np.array(self._blocks[self.ind_block])
+        self.ind_block = (self.ind_block + 1) % self.Nblocks
+        return data
+
+    def close(self):
+        self._blocks = None
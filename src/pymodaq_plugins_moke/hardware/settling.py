@@ -0,0 +1,83 @@
+import threading
+
+import numpy as np
+
+
+def settling_time(times, values, target, epsilon, start):
+    """Get the settling time of a step from a timestamped readback history
+
+    The settling time is the time, from the step start, of the first sample after which all the values stay within
+    epsilon of the target. Its resolution is the period of the samples (the readback block period).
+
+    Parameters
+    ----------
+    times: (ndarray) timestamps of the samples (perf_counter), in chronological order
+    values: (ndarray) the samples, in actuator units
+    target: (float) the target of the step
+    epsilon: (float) the tolerance
+    start: (float) the timestamp of the step start
+
+    Returns
+    -------
+    float or None: the settling time in s, None if not settled within the history
+    """
+    after = times >= start
+    times = times[after]
+    values = values[after]
+    outside = np.flatnonzero(np.abs(values - target) >= epsilon)
+    ind_settled = 0 if outside.size == 0 else outside[-1] + 1
+    if ind_settled >= times.size:
+        return None
+    return float(times[ind_settled] - start)
+
+
+class SettlingModel:
+    """First order model of the settling time of the coil current after a step
+
+    For an exponential response of time constant tau, the time needed for a step of amplitude delta to get within
+    epsilon of its target is t = a + tau * ln(|delta| / epsilon), a accounting for the latencies. a and tau are fitted
+    by least squares on the (delta, settling time) pairs measured from the readback.
+
+    Parameters
+    ----------
+    a: (float) initial latency in s
+    tau: (float) initial time constant in s
+    max_time: (float) upper bound of the predicted settling times in s
+    Nhistory: (int) the number of latest measurements used for the fit
+    """
+
+    def __init__(self, a=0.002, tau=0.005, max_time=1., Nhistory=100):
+        self.a = a
+        self.tau = tau
+        self.max_time = max_time
+        self._logs = np.zeros((Nhistory,))
+        self._times = np.zeros((Nhistory,))
+        self._ind = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def count(self):
+        return self._count
+
+    def predict(self, delta, epsilon):
+        """Predict the time (s) for a step of amplitude delta to settle within epsilon"""
+        if abs(delta) <= epsilon:
+            return min((max((self.a, 0.)), self.max_time))
+        return float(np.clip(self.a + self.tau * np.log(abs(delta) / epsilon), 0., self.max_time))
+
+    def add_measurement(self, delta, epsilon, settling_time):
+        """Add a measured settling time and fit the model again, a step within epsilon being not informative"""
+        if abs(delta) <= epsilon:
+            return
+        with self._lock:
+            self._logs[self._ind] = np.log(abs(delta) / epsilon)
+            self._times[self._ind] = settling_time
+            self._ind = (self._ind + 1) % self._logs.size
+            self._count = min((self._count + 1, self._logs.size))
+            logs = self._logs[:self._count]
+            times = self._times[:self._count]
+        if logs.size >= 3 and np.ptp(logs) > 0:
+            tau, a = np.polyfit(logs, times, 1)
+            self.tau = max((float(tau), 0.))
+            self.a = max((float(a), 0.))
@@ -13,17 +13,52 @@ from pymodaq.utils.scanner.scanners._1d_scanners import Scan1DSparse
 from pymodaq.utils.parameter import pymodaq_ptypes as ptypes
 from pymodaq.utils.parameter import utils as putils
 from pymodaq.utils.plotting.data_viewers.viewer1D import Viewer1D
-from pymodaq.utils.data import DataActuator
+from pymodaq.utils.data import DataActuator, DataRaw
 from pymodaq.control_modules.daq_move import DAQ_Move
 from pymodaq.utils.messenger import dialog
 
+from pymodaq_plugins_moke.hardware.sweep import SweepBuilder
+
 
 class StepsSequencer(ParameterManager, QtCore.QObject):
 
     scanner_parameter = QtCore.Signal(Parameter)
+    positions_signal = QtCore.Signal(object)  # ndarray of the sweep builder positions, sent as is to the scanner
+    adaptive_signal = QtCore.Signal(object)  # dict of the adaptive loop settings to start it, None to stop it
     params = [dict(title='Npts', name='npts', type='int', readonly=True),
               dict(title='', label='Send Points', name='send_points', type='bool_push'),
-              dict(title='', label='Show Points', name='show_points', type='bool_push'),]
+              dict(title='', label='Show Points', name='show_points', type='bool_push'),
+              dict(title='', label='Play Points', name='play_points', type='bool_push',
+                   tip='Play the points as a hardware timed sequence on the actuator (if supported)'),
+              dict(title='Readback error:', name='readback_error', type='float', value=0., readonly=True,
+                   tip='Largest deviation of the measured mean current of a step from its target, for the last '
+                       'played sequence with readback'),
+              dict(title='Sweep builder:', name='sweep', type='group', children=[
+                  dict(title='Loop type:', name='loop_type', type='list', limits=['Major', 'Minor']),
+                  dict(title='Offset:', name='offset', type='float', value=0.,
+                       tip='Center of a minor loop'),
+                  dict(title='Amplitude:', name='amplitude', type='float', value=1., min=0.),
+                  dict(title='Step:', name='step', type='float', value=0.01, min=0.),
+                  dict(title='Repeat:', name='repeat', type='int', value=1, min=1),
+                  dict(title='Exponent:', name='exponent', type='float', value=1., min=0.1,
+                       tip='Above 1, the steps are denser near the loop center'),
+                  dict(title='', label='Add Loop', name='add_loop', type='bool_push'),
+                  dict(title='', label='Clear Loops', name='clear_loops', type='bool_push'),
+                  dict(title='Loops:', name='loops', type='text', value='', readonly=True),
+                  dict(title='', label='Build Sweep', name='build_sweep', type='bool_push',
+                       tip='Set the scanner points from the loops'),
+              ]),
+              dict(title='Adaptive loop:', name='adaptive', type='group', expanded=False, children=[
+                  dict(title='Offset:', name='offset', type='float', value=0.),
+                  dict(title='Amplitude:', name='amplitude', type='float', value=1., min=0.),
+                  dict(title='Coarse step:', name='coarse_step', type='float', value=0.1, min=0.),
+                  dict(title='Min step:', name='min_step', type='float', value=0.01, min=0.),
+                  dict(title='Threshold:', name='threshold', type='float', value=1., min=0.,
+                       tip='Derivative of the ROI signal (per actuator unit) above which the steps are refined'),
+                  dict(title='', label='Run Adaptive Loop', name='run_adaptive', type='bool_push'),
+                  dict(title='', label='Stop Adaptive Loop', name='stop_adaptive', type='bool_push'),
+              ]),
+              ]
 
     def __init__(self, dockarea: DockArea, actuator: DAQ_Move):
         ParameterManager.__init__(self)
@@ -32,8 +67,12 @@ class StepsSequencer(ParameterManager, QtCore.QObject):
         self.actuator_name = actuator.title
         self.dockarea = dockarea
         self.scanner = Scan1DSparse([actuator])
+        self.sweep_builder = SweepBuilder()
+        self._sweep_string = None  # the scanner string set from the sweep builder, if still in use
+        self.sequence_readback = None  # (3, Nsteps) targets, mean and std of the current of the last played sequence
         self.setup_docks()
         self.scanner.settings.child('parsed_string').sigValueChanged.connect(self.value_changed)
+        self.actuator.custom_sig.connect(self.info_actuator)
 
     def setup_docks(self):
         '''
@@ -50,11 +89,25 @@ class StepsSequencer(ParameterManager, QtCore.QObject):
         self.dock.addWidget(widget, 10)
         self.settings_tree.setMinimumSize(350, 100)
 
+        readback_widget = QtWidgets.QWidget()
+        self.readback_viewer = Viewer1D(readback_widget)
+        self.readback_dock = Dock('Sequence Readback')
+        self.readback_dock.addWidget(readback_widget)
+        self.dockarea.addDock(self.readback_dock, 'bottom', self.dock)
+        self.readback_dock.setVisible(False)
+
     def emit_positions(self):
-        self.scanner_parameter.emit(self.scanner.settings.child('parsed_string'))
+        """Send the positions to the DAQ_Scan scanner: the array of the sweep builder if its sweep is in use, else
+        the parsed string"""
+        if self._sweep_string is not None:
+            self.positions_signal.emit(self.sweep_builder.positions)
+        else:
+            self.scanner_parameter.emit(self.scanner.settings.child('parsed_string'))
 
     def value_changed(self, param):
         if param.name() == 'parsed_string':
+            if param.value() != self._sweep_string:
+                self._sweep_string = None  # edited by hand, the sweep positions are no more in use
             self.evaluate_nsteps()
         elif param.name() == 'send_points':
             if param.value():
@@ -64,34 +117,89 @@ class StepsSequencer(ParameterManager, QtCore.QObject):
             if param.value():
                 self.show_positions()
                 param.setValue(False)
+        elif param.name() == 'play_points':
+            if param.value():
+                self.play_positions()
+                param.setValue(False)
+        elif param.name() == 'add_loop':
+            if param.value():
+                self.add_loop()
+                param.setValue(False)
+        elif param.name() == 'clear_loops':
+            if param.value():
+                self.sweep_builder.clear()
+                self.settings.child('sweep', 'loops').setValue('')
+                param.setValue(False)
+        elif param.name() == 'build_sweep':
+            if param.value():
+                self.build_sweep()
+                param.setValue(False)
+        elif param.name() == 'run_adaptive':
+            if param.value():
+                adaptive = self.settings.child('adaptive')
+                self.adaptive_signal.emit(dict([(name, adaptive[name]) for name in
+                                                ['offset', 'amplitude', 'coarse_step', 'min_step', 'threshold']]))
+                param.setValue(False)
+        elif param.name() == 'stop_adaptive':
+            if param.value():
+                self.adaptive_signal.emit(None)
+                param.setValue(False)
+
+    def add_loop(self):
+        sweep = self.settings.child('sweep')
+        offset = sweep['offset'] if sweep['loop_type'] == 'Minor' else 0.
+        try:
+            self.sweep_builder.add_loop(sweep['loop_type'], offset, sweep['amplitude'], sweep['step'],
+                                        repeat=sweep['repeat'], exponent=sweep['exponent'])
+        except ValueError as e:
+            dialog('Sweep builder', str(e))
+        sweep.child('loops').setValue(self.sweep_builder.describe())
+
+    def build_sweep(self):
+        """Use the compiled sweep, its string being only displayed in the scanner: its positions are used as is by
+        show_positions, play_positions and emit_positions"""
+        if len(self.sweep_builder) == 0:
+            return
+        self._sweep_string = self.sweep_builder.to_sparse_string()
+        self.scanner.settings.child('parsed_string').setValue(self._sweep_string)
+
+    def get_positions(self) -> np.ndarray:
+        """Get the positions of the scanner, directly from the sweep builder cache if its sweep is in use"""
+        if self._sweep_string is not None:
+            return self.sweep_builder.positions
+        self.scanner.set_scan()
+        return np.atleast_1d(np.squeeze(self.scanner.positions))
 
     def show_positions(self):
         widget = QtWidgets.QWidget()
         viewer = Viewer1D(widget)
-        self.scanner.set_scan()
-        dwa = DataActuator(self.actuator_name, data=[np.atleast_1d(np.squeeze(self.scanner.positions))])
+        dwa = DataActuator(self.actuator_name, data=[self.get_positions()])
         viewer.show_data(dwa)
         dialog('Positions to be send to Tabular Scan', '', widget)
 
+    def play_positions(self):
+        self.actuator.command_hardware.emit(utils.ThreadCommand('play_sequence', [self.get_positions()]))
+
+    def info_actuator(self, status: utils.ThreadCommand):
+        if status.command == 'sequence_readback':
+            self.show_readback(status.attribute[0])
+
+    def show_readback(self, sequence_readback: np.ndarray):
+        """Plot the target and the measured mean current of each step of a played sequence"""
+        self.sequence_readback = sequence_readback
+        error = np.abs(sequence_readback[1] - sequence_readback[0])
+        self.settings.child('readback_error').setValue(float(np.max(error)))
+        self.readback_dock.setVisible(True)
+        self.readback_viewer.show_data(DataRaw('Sequence readback', data=[sequence_readback[0], sequence_readback[1]],
+                                               labels=['Target', 'Measured']))
+
     def evaluate_nsteps(self):
-        Nsteps = self.scanner.evaluate_steps()
+        if self._sweep_string is not None:
+            Nsteps = self.sweep_builder.npoints
+        else:
+            Nsteps = self.scanner.evaluate_steps()
         self.settings.child('npts').setValue(Nsteps)
 
-    def update_steps_calculation(self):
-        init = False
-        values = np.array([])
-        for ind, data in enumerate(self._table_model.raw_data):
-            if not init and self._table_model.is_checked(ind):
-                values = utils.linspace_step(*data)
-                init = True
-            elif self._table_model.is_checked(ind):
-                values = np.concatenate((values, utils.linspace_step(*data)))
-        return values
-
-    @property
-    def view(self):
-        return self._table_view
-
 
 def print_positions(param: Parameter):
     print(param.value())
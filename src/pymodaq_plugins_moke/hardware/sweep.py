@@ -0,0 +1,98 @@
+import numpy as np
+
+
+class SweepBuilder:
+    """Describe a field sweep as a list of loops and compile it into the array of actuator positions
+
+    A major loop goes from +amplitude to -amplitude and back, a minor loop does the same around an offset. Each loop
+    can be repeated and its steps can be made denser near its center with an exponent larger than 1 (the positions
+    are then center + amplitude * sign(u) * |u|**exponent, u being uniformly spaced in [-1, 1]). The compiled array is
+    cached until the loops are modified.
+    """
+
+    def __init__(self):
+        self.loops = []
+        self._positions = None
+
+    def __len__(self):
+        return len(self.loops)
+
+    def add_major_loop(self, amplitude, step, repeat=1, exponent=1.):
+        self.add_loop('Major', 0., amplitude, step, repeat=repeat, exponent=exponent)
+
+    def add_minor_loop(self, offset, amplitude, step, repeat=1, exponent=1.):
+        self.add_loop('Minor', offset, amplitude, step, repeat=repeat, exponent=exponent)
+
+    def add_loop(self, kind, offset, amplitude, step, repeat=1, exponent=1.):
+        """Add a loop of the given kind ('Major' or 'Minor', only used to describe it)"""
+        if amplitude <= 0 or step <= 0:
+            raise ValueError('The amplitude and the step of a loop should be strictly positive')
+        self.loops.append(dict(kind=kind, offset=float(offset), amplitude=float(amplitude), step=float(step),
+                               repeat=max((1, int(repeat))), exponent=float(exponent)))
+        self._positions = None
+
+    def clear(self):
+        self.loops = []
+        self._positions = None
+
+    @staticmethod
+    def compile_loop(offset, amplitude, step, repeat=1, exponent=1.):
+        """Get the positions of a (repeated) loop, the junction points being not duplicated"""
+        Nbranch = max((1, int(np.round(2 * amplitude / step))))
+        u = np.linspace(1., -1., Nbranch + 1)
+        branch = offset + amplitude * np.sign(u) * np.abs(u) ** exponent
+        cycle = np.concatenate((branch, branch[-2::-1]))
+        return np.concatenate((cycle[:1], np.tile(cycle[1:], repeat)))
+
+    @property
+    def positions(self) -> np.ndarray:
+        if self._positions is None:
+            segments = [self.compile_loop(loop['offset'], loop['amplitude'], loop['step'], repeat=loop['repeat'],
+                                          exponent=loop['exponent']) for loop in self.loops]
+            for ind in range(1, len(segments)):
+                if segments[ind][0] == segments[ind - 1][-1]:
+                    segments[ind] = segments[ind][1:]
+            self._positions = np.concatenate(segments) if len(segments) != 0 else np.array([])
+        return self._positions
+
+    @property
+    def npoints(self):
+        return self.positions.size
+
+    def describe(self):
+        return ', '.join([f"{loop['kind']}({loop['offset']:g}"
+                          f"±{loop['amplitude']:g}, step {loop['step']:g}, x{loop['repeat']}"
+                          f"{'' if loop['exponent'] == 1 else ', exp ' + format(loop['exponent'], 'g')})"
+                          for loop in self.loops])
+
+    def to_sparse_string(self, decimals=6):
+        """Encode the positions as a Scan1DSparse string, runs of at least 3 points with a constant step being
+        written start:step:stop
+
+        The string is only meant to be displayed and edited by hand, the positions themselves being sent as an array
+        """
+        positions = np.round(self.positions, decimals)
+        if positions.size == 0:
+            return ''
+        steps = np.round(np.diff(positions), decimals)
+        # index of the last point of the run of constant step each step belongs to
+        changes = np.flatnonzero(steps[1:] != steps[:-1]) + 1
+        run_ids = np.zeros(steps.shape, dtype=int)
+        run_ids[changes] = 1
+        run_ids = np.cumsum(run_ids)
+        run_last_points = np.concatenate((changes, [steps.size]))[run_ids]
+
+        def fmt(value):
+            return np.format_float_positional(value, trim='-')
+
+        items = []
+        ind = 0
+        while ind < positions.size:
+            last = run_last_points[ind] if ind < steps.size else ind
+            if last - ind >= 2 and steps[ind] != 0:
+                items.append(f'{fmt(positions[ind])}:{fmt(steps[ind])}:{fmt(positions[last])}')
+                ind = last + 1
+            else:
+                items.append(fmt(positions[ind]))
+                ind += 1
+        return ','.join(items)
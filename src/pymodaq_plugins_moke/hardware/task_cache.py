@@ -0,0 +1,63 @@
+from collections import OrderedDict
+
+
+class DAQmxTaskCache:
+    """Least recently used cache of configured DAQmx task wrappers
+
+    Switching between a few task configurations (channel, range, number of samples, repetition...) then reuses the
+    already configured tasks instead of clearing and creating them each time. Only one of the cached tasks using a
+    given channel should be running at a time.
+
+    Parameters
+    ----------
+    factory: (callable) returns a new, not configured, task wrapper (for instance the DAQmx class)
+    maxsize: (int) the maximum number of cached tasks, the least recently used one is cleared above
+    """
+
+    def __init__(self, factory, maxsize=4):
+        self._factory = factory
+        self.maxsize = maxsize
+        self._tasks = OrderedDict([])
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def __contains__(self, key):
+        return key in self._tasks
+
+    def get(self, key, channels, clock_settings, **kwargs):
+        """Get the task configured for the given key, creating and configuring it if not cached
+
+        Parameters
+        ----------
+        key: (hashable) identifies the configuration, for instance (channel, min, max, Nsamples, repetition)
+        channels: (list of channels) used to configure a new task
+        clock_settings: (ClockSettings) used to configure a new task
+        kwargs: other arguments of the update_task method of the task wrapper (trigger_settings...)
+        """
+        if key in self._tasks:
+            self._tasks.move_to_end(key)
+            return self._tasks[key]
+
+        daqmx = self._factory()
+        daqmx.update_task(channels, clock_settings, **kwargs)
+        self._tasks[key] = daqmx
+        while len(self._tasks) > self.maxsize:
+            self.release(self._tasks.popitem(last=False)[1])
+        return daqmx
+
+    def invalidate(self, key):
+        """Remove a configuration from the cache, clearing its task"""
+        if key in self._tasks:
+            self.release(self._tasks.pop(key))
+
+    def clear(self):
+        while len(self._tasks) != 0:
+            self.release(self._tasks.popitem()[1])
+
+    @staticmethod
+    def release(daqmx):
+        if daqmx.task is not None:
+            if not daqmx.isTaskDone():
+                daqmx.stop()
+            daqmx.task.ClearTask()
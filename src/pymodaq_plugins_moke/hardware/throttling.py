@@ -0,0 +1,56 @@
+from time import perf_counter
+
+from qtpy import QtCore
+
+
+class Coalescer(QtCore.QObject):
+    """Forward values at a limited rate, only the latest value received during a period being kept
+
+    The first value after a quiet period is forwarded at once, the following ones are coalesced and the latest is
+    forwarded at the end of the period, so that the last value is never lost.
+
+    Parameters
+    ----------
+    max_rate: (float) the maximum number of forwarded values per second
+    """
+    value_signal = QtCore.Signal(object)
+
+    def __init__(self, max_rate=10.):
+        super().__init__()
+        self._period = 1 / max_rate
+        self._last_time = None
+        self._pending = None
+        self._has_pending = False
+
+        self._timer = QtCore.QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+
+    @property
+    def max_rate(self):
+        return 1 / self._period
+
+    @max_rate.setter
+    def max_rate(self, max_rate):
+        self._period = 1 / max_rate
+
+    def push(self, value):
+        self._pending = value
+        self._has_pending = True
+        if self._timer.isActive():
+            return
+        elapsed = None if self._last_time is None else perf_counter() - self._last_time
+        if elapsed is None or elapsed >= self._period:
+            self.flush()
+        else:
+            self._timer.start(int(1000 * (self._period - elapsed)))
+
+    def flush(self):
+        """Forward the pending value, if any"""
+        self._timer.stop()
+        if self._has_pending:
+            value = self._pending
+            self._pending = None
+            self._has_pending = False
+            self._last_time = perf_counter()
+            self.value_signal.emit(value)
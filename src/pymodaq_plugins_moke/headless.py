@@ -0,0 +1,281 @@
+"""
+Headless runner of MicroMOKE scan recipes
+
+Usage: python -m pymodaq_plugins_moke.headless --preset MokeMicro_Mock.xml --recipe my_recipe.toml
+
+The recipe is a toml file (see resources/recipe_example.toml) holding an output directory and a list of steps, each
+one with its LED sequence, camera profile, averaging and field loops. The steps are run back to back with the Qt
+offscreen platform and each one is saved into its own HDF5 file.
+"""
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+import tables
+import toml
+
+from qtpy import QtWidgets, QtCore
+from pymodaq.utils.daq_utils import ThreadCommand
+from pymodaq.utils.logger import set_logger, get_module_name
+from pymodaq.control_modules.move_utility_classes import MoveCommand
+
+from pymodaq_plugins_moke import config
+from pymodaq_plugins_moke.hardware.sweep import SweepBuilder
+from pymodaq_plugins_moke.hardware.live_loop import roi_signal
+from pymodaq_plugins_moke.hardware.led_waveform import phase_pattern
+
+logger = set_logger(get_module_name(__file__))
+
+
+def load_recipe(path) -> dict:
+    """Load a recipe file, checking that each step defines at least one loop"""
+    recipe = toml.load(Path(path))
+    recipe.setdefault('output_dir', str(Path(path).parent))
+    for ind, step in enumerate(recipe.get('steps', [])):
+        step.setdefault('name', f'step{ind:03d}')
+        if len(step.get('loops', [])) == 0:
+            raise ValueError(f"The recipe step {step['name']} has no loop")
+    return recipe
+
+
+class StepWriter:
+    """Write the points of a recipe step into a HDF5 file: positions, ROI signal and frames (extendable arrays)"""
+
+    def __init__(self, path, step: dict):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = tables.open_file(str(self.path), mode='w', title=step['name'])
+        self._file.root._v_attrs.recipe_step = json.dumps(step)
+        self.positions = self._file.create_earray('/', 'positions', tables.Float64Atom(), shape=(0,))
+        self.signal = self._file.create_earray('/', 'signal', tables.Float64Atom(), shape=(0,))
+        self.frames = None
+
+    def append(self, position: float, signal: float, frame: np.ndarray = None):
+        self.positions.append(np.array([position]))
+        self.signal.append(np.array([signal]))
+        if frame is not None:
+            if self.frames is None:
+                self.frames = self._file.create_earray('/', 'frames', tables.Float64Atom(),
+                                                       shape=(0,) + frame.shape)
+            self.frames.append(frame[np.newaxis, ...])
+
+    def close(self):
+        self._file.close()
+
+
+class RecipeRunner(QtCore.QObject):
+    """Run the steps of a recipe with the modules of a dashboard, driven by the modules signals (no event loop spinning)
+
+    For each point: the Current actuator is moved, its move_done triggers a snap of the Camera, whose grab_done stores
+    the point and moves to the next position. A watchdog aborts the step if a point takes more than the recipe timeout:
+    the pending move or snap is stopped and the signals are only accepted at the stage the runner waits for ('move' or
+    'grab'), so that a late move_done or grab_done of the aborted point is not taken for one of the next step. After
+    a move timeout, the next step starts once the actuator has reported its stop ('stop'). After a grab timeout, the
+    detector thread is asked to mark the frames ('mark'): the frames created before the mark, i.e. the late frame of
+    the aborted snap whenever it comes, are then never stored.
+
+    Parameters
+    ----------
+    dashboard: (DashBoard) with a loaded preset
+    recipe: (dict) as returned by load_recipe
+    """
+    finished_signal = QtCore.Signal(int)  # the number of failed steps
+
+    def __init__(self, dashboard, recipe: dict):
+        super().__init__()
+        self.recipe = recipe
+        self.detector = dashboard.modules_manager.get_mod_from_name('Camera', mod='det')
+        self.actuator = dashboard.modules_manager.get_mod_from_name('Current', mod='act')
+        self.led_actuator = dashboard.modules_manager.get_mod_from_name('LedDriver', mod='act')
+        if self.detector is None or self.actuator is None:
+            raise ValueError('The preset should define a Camera detector and a Current actuator')
+
+        self.ind_step = -1
+        self.Nfailed = 0
+        self.positions = None
+        self.ind_point = 0
+        self.writer = None
+        self._phases = None
+        self._waiting = None  # the stage of the current point: 'move', 'grab', 'stop', 'mark' or None
+        self._frames_mark = 0.  # the frames created before are stale
+
+        self.watchdog = QtCore.QTimer()
+        self.watchdog.setSingleShot(True)
+        self.watchdog.timeout.connect(self.point_timeout)
+
+    @property
+    def step(self) -> dict:
+        return self.recipe['steps'][self.ind_step]
+
+    def start(self):
+        self.actuator.move_done_signal.connect(self.moved)
+        self.detector.grab_done_signal.connect(self.grabbed)
+        self.detector.custom_sig.connect(self.info_detector)
+        if self.led_actuator is not None:
+            self.led_actuator.custom_sig.connect(self.info_led)
+        self.next_step()
+
+    def info_detector(self, status):
+        if status.command == 'frames_marked':
+            self._frames_mark = status.attribute[0]
+            if self._waiting == 'mark':
+                self.watchdog.stop()
+                self.next_step()
+        elif status.command == 'stopped' and self._phases is not None:
+            # each snap starts with the first step of the sequence, restarted at the next camera readout
+            self.detector.command_hardware.emit(ThreadCommand('reconfigure_phases', [self._phases, 0, True]))
+            self.led_actuator.command_hardware.emit(ThreadCommand('update_tasks'))
+
+    def info_led(self, status):
+        if status.command == 'leds_synchronized':
+            self.detector.command_hardware.emit(ThreadCommand('synchronize_phases', status.attribute))
+
+    def next_step(self):
+        self.close_writer()
+        self.ind_step += 1
+        if self.ind_step >= len(self.recipe.get('steps', [])):
+            self._waiting = None
+            self.actuator.move_done_signal.disconnect(self.moved)
+            self.detector.grab_done_signal.disconnect(self.grabbed)
+            self.detector.custom_sig.disconnect(self.info_detector)
+            self.finished_signal.emit(self.Nfailed)
+            return
+
+        step = self.step
+        logger.info(f"Recipe step {self.ind_step}: {step['name']}")
+        self.setup_step(step)
+        builder = SweepBuilder()
+        for loop in step['loops']:
+            builder.add_minor_loop(loop.get('offset', 0.), loop['amplitude'], loop['step'],
+                                   repeat=loop.get('repeat', 1), exponent=loop.get('exponent', 1.))
+        self.positions = builder.positions
+        self.ind_point = 0
+        path = Path(self.recipe['output_dir']).expanduser().joinpath(f"{self.ind_step:03d}_{step['name']}.h5")
+        self.writer = StepWriter(path, step)
+        self.move()
+
+    def setup_step(self, step: dict):
+        """Send the camera profile, the averaging and the LED settings of a step, commands being queued in the
+        modules threads before the first move"""
+        if 'camera' in step:
+            self.detector.command_hardware.emit(ThreadCommand('apply_camera_profile', [step['camera']]))
+        self.detector.settings.child('main_settings', 'Naverage').setValue(step.get('naverage', 1))
+
+        sequence_name = step.get('led_sequence', 'manual')
+        if self.led_actuator is None:
+            if sequence_name != 'manual' or 'led_values' in step:
+                logger.warning('No LedDriver actuator in the preset, the LED settings are ignored')
+        else:
+            if 'led_values' in step:
+                led_values = dict([(led, {f'{led}_val': value, f'{led}_act': value > 0.})
+                                   for led, value in step['led_values'].items()])
+                self.led_actuator.command_hardware.emit(ThreadCommand('set_leds_external', [led_values, True]))
+            if sequence_name == 'manual':
+                led_type = dict(manual=None)
+            else:
+                sequence = config('micro', 'led', 'sequences', sequence_name)
+                led_type = dict(sequence=[dict(s) for s in sequence['steps']], blank=sequence.get('blank', True))
+            phases = phase_pattern(led_type['sequence']) if 'sequence' in led_type else [1]
+            self._phases = phases if 'sequence' in led_type else None
+            self.detector.command_hardware.emit(ThreadCommand('reconfigure_phases',
+                                                              [phases, 0, self._phases is not None]))
+            self.led_actuator.command_hardware.emit(ThreadCommand('set_led_type', [led_type]))
+
+    def move(self):
+        self._waiting = 'move'
+        self.watchdog.start(int(1000 * self.recipe.get('timeout_s', 30.)))
+        self.actuator.move(MoveCommand('abs', float(self.positions[self.ind_point])))
+
+    def moved(self, *args):
+        if self._waiting == 'stop':
+            # the aborted move is over: the actuator is free for the next step
+            self.watchdog.stop()
+            self.next_step()
+        elif self._waiting == 'move' and self.writer is not None:
+            self._waiting = 'grab'
+            self.detector.snap()
+
+    def grabbed(self, dte):
+        if self._waiting != 'grab' or self.writer is None:
+            return  # a late frame of an aborted point
+        if min([dwa.timestamp for dwa in dte]) < self._frames_mark:
+            return  # the late frame of an aborted snap, created before the mark
+        self._waiting = None
+        self.watchdog.stop()
+        data_2D = dte.get_data_from_dim('Data2D')
+        frame = np.asarray(data_2D.data[0][0], dtype=float) if len(data_2D) != 0 else None
+        self.writer.append(self.positions[self.ind_point], roi_signal(dte), frame)
+        self.ind_point += 1
+        if self.ind_point < self.positions.size:
+            self.move()
+        else:
+            self.next_step()
+
+    def point_timeout(self):
+        if self._waiting in ('stop', 'mark'):
+            if self._waiting == 'stop':
+                logger.error("The actuator did not report its stop, the recipe goes on")
+            else:
+                logger.error("The detector did not mark its frames, the recipe goes on")
+            self.next_step()
+            return
+        logger.error(f"Recipe step {self.step['name']} aborted: point {self.ind_point} timed out")
+        self.Nfailed += 1
+        if self._waiting == 'move':
+            self._waiting = 'stop'
+            self.watchdog.start(int(1000 * self.recipe.get('timeout_s', 30.)))
+            self.actuator.stop_motion()
+        else:
+            self._waiting = 'mark'
+            self.watchdog.start(int(1000 * self.recipe.get('timeout_s', 30.)))
+            self.detector.stop_grab()
+            self.detector.command_hardware.emit(ThreadCommand('mark_frames'))
+
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run MicroMOKE scan recipes without GUI')
+    parser.add_argument('--preset', required=True,
+                        help='preset file name (in the pymodaq preset folder or the plugin resources) or path')
+    parser.add_argument('--recipe', required=True, help='recipe toml file')
+    args = parser.parse_args()
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from pymodaq.utils.daq_utils import get_set_preset_path
+    from pymodaq.utils.gui_utils import DockArea
+    from pymodaq.dashboard import DashBoard
+
+    recipe = load_recipe(args.recipe)
+    preset = Path(args.preset)
+    if not preset.is_file():
+        preset = Path(get_set_preset_path()).joinpath(args.preset)
+    if not preset.is_file():
+        preset = Path(__file__).parent.joinpath('resources', args.preset)  # e.g. the shipped MokeMicro_Mock.xml
+    if not preset.is_file():
+        logger.error(f'No preset file {args.preset}')
+        sys.exit(1)
+
+    app = QtWidgets.QApplication(sys.argv)
+    win = QtWidgets.QMainWindow()
+    area = DockArea()
+    win.setCentralWidget(area)
+    dashboard = DashBoard(area)
+    dashboard.set_preset_mode(preset)
+
+    runner = RecipeRunner(dashboard, recipe)
+    runner.finished_signal.connect(lambda Nfailed: app.exit(1 if Nfailed else 0))
+    QtCore.QTimer.singleShot(0, runner.start)
+    exit_code = app.exec_()
+    dashboard.quit_fun()
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 import sys
+from datetime import datetime
+import numpy as np
 from pymodaq.utils.gui_utils import DockArea
 from pymodaq.dashboard import DashBoard
 
@@ -13,9 +15,13 @@ from pymodaq.utils.daq_utils import ThreadCommand
 from pymodaq.utils.logger import set_logger, get_module_name
 
 from pymodaq_plugins_moke.hardware import LedControl,  ManualActuation, StepsSequencer
+from pymodaq_plugins_moke.hardware.throttling import Coalescer
+from pymodaq_plugins_moke.hardware.live_loop import LiveLoopPlot, roi_signal
+from pymodaq_plugins_moke.hardware.adaptive_scan import AdaptiveScan
+from pymodaq_plugins_moke.hardware.display_governor import set_viewer_levels
+from pymodaq_plugins_moke.hardware.led_waveform import phase_pattern
 
 from pymodaq.utils.messenger import messagebox
-from pymodaq.utils.plotting.data_viewers.viewer1D import Viewer1D
 
 from pymodaq_plugins_moke import config
 
@@ -26,6 +32,8 @@ class MicroMOKE(CustomApp):
     def __init__(self, dockarea: DockArea, dashboard: DashBoard):
         super().__init__(dockarea, dashboard)
         self.led_control = LedControl(dockarea)
+        # slider drags emit many values, only the latest ones are sent to the LED driver at a limited rate
+        self.led_coalescer = Coalescer(config('micro', 'led', 'max_update_rate'))
 
         self.manual_actuation = ManualActuation(dockarea,
                                                 absolute_values=config('micro', 'actuation', 'absolute_current_values'),
@@ -34,8 +42,12 @@ class MicroMOKE(CustomApp):
         self.current_actuator = self.modules_manager.get_mod_from_name('Current', mod='act')
         self.steps_sequencer = StepsSequencer(dockarea, self.current_actuator)
         self.led_actuator = self.modules_manager.get_mod_from_name('LedDriver', mod='act')
+        self.adaptive_scan = AdaptiveScan(self.current_actuator, self.detector)
 
         self.scan_window = None
+        self._phases = None
+        self._viewer_ready = False
+        self._scan_acquisition = None
 
         self.setup_ui()
         self.setup_camera()
@@ -50,39 +62,111 @@ class MicroMOKE(CustomApp):
             self.show_scanner(self.is_action_checked('show_scan'))
             self.connect_action('do_scan', self.dashboard.scan_module.do_scan)
             self.connect_action('do_scan', self.show_hide_live_viewer)
-            #self.dashboard.scan_module.live_data_1D_signal.connect(self.update_live_viewer)
+            self.connect_action('do_scan', self.start_live_loop)
+        self.dashboard.scan_module.ui.command_sig.connect(self.scan_command)
 
         self.dashboard.scan_module.scanner.set_scan_type_and_subtypes('Scan1D', 'Sparse')
         self.dashboard.scan_module.modules_manager.selected_detectors_name = ['Camera']
         self.dashboard.scan_module.modules_manager.selected_actuators_name = ['Current']
         QtWidgets.QApplication.processEvents()
 
-    def update_live_viewer(self, data_all):
-        self.scan_live_viewer.show_data(data_all[1], x_axis=data_all[0])
+    def start_live_loop(self, start=True):
+        if start:
+            self.scan_live_viewer.start(self.dashboard.scan_module.scanner.n_steps)
+            self.connect_scan_acquisition()
+        else:
+            self.scan_live_viewer.stop()
+
+    def connect_scan_acquisition(self):
+        """Connect the status of the acquisition object created by the DAQ_Scan for each started scan"""
+        scan_thread = self.dashboard.scan_module.scan_thread
+        acquisition = getattr(scan_thread, 'scan_acquisition', None)
+        if acquisition is not None and acquisition is not self._scan_acquisition:
+            self._scan_acquisition = acquisition
+            acquisition.status_sig.connect(self.scan_acquisition_status)
+
+    def scan_acquisition_status(self, status: ThreadCommand):
+        if status.command == 'Scan_done':
+            self.scan_stopped()
+
+    def scan_command(self, command: ThreadCommand):
+        """Commands sent by the actions of the DAQ_Scan window"""
+        if command.command == 'stop':
+            self.scan_stopped()
+
+    def scan_stopped(self):
+        """Stop the live loop once the DAQ_Scan acquisition has finished or has been stopped from the DAQ_Scan
+        window, the do_scan action being unchecked without triggering it"""
+        self.start_live_loop(False)
+        if self.is_action_checked('do_scan'):
+            self.set_action_checked('do_scan', False)
+
+    def run_adaptive_scan(self, settings=None):
+        """Start (or stop if settings is None) a loop whose steps are refined where the Kerr signal switches"""
+        if settings is None:
+            self.adaptive_scan.stop()
+            return
+        if self.adaptive_scan.running:
+            return
+        if self.detector.grab_state:
+            self.detector.stop()
+        try:
+            self.adaptive_scan.start(**settings)
+        except ValueError as e:
+            messagebox(text=str(e))
+            return
+        self.show_hide_live_viewer(True)
+        self.scan_live_viewer.start(int(4 * settings['amplitude'] / settings['coarse_step']) + 1)
+
+    def adaptive_scan_done(self, npoints):
+        """Save the points of the adaptive loop in the pymodaq data saving folder"""
+        self.scan_live_viewer.stop()
+        if npoints == 0:
+            return
+        save_dir = Path(config_mod.Config()('data_saving', 'h5file', 'save_path')).expanduser()
+        save_dir = save_dir.joinpath('adaptive_loops')
+        save_dir.mkdir(parents=True, exist_ok=True)
+        path = save_dir.joinpath(f"adaptive_loop_{datetime.now().strftime('%Y%m%d_%H%M%S')}.h5")
+        try:
+            self.adaptive_scan.save(path)
+            logger.info(f'Adaptive loop done with {npoints} points, saved in {path}')
+        except Exception as e:
+            logger.exception(f'Adaptive loop done with {npoints} points, could not be saved in {path}: {str(e)}')
+
+    def update_live_actuator(self, data):
+        self.scan_live_viewer.set_actuator_value(float(data.value()))
+
+    def update_live_viewer(self, dte):
+        """Add the ROI mean of the Kerr signal (or the mean of the image if no ROI) to the live loop"""
+        if not self.scan_live_viewer.active:
+            return
+        self.scan_live_viewer.add_point(roi_signal(dte))
 
     def show_hide_live_viewer(self, show=True):
-        self.scan_live_dock.setVisible(show)
+        if self._viewer_ready:
+            self.scan_live_dock.setVisible(show)
 
     def setup_camera(self):
-        try:
-            self.detector.settings.child('detector_settings', 'camera_settings', 'exposure').setValue(100)
-            QtWidgets.QApplication.processEvents()
-            encoding = self.detector.settings.child('detector_settings', 'camera_settings',
-                                                    'encoding').opts['limits'][2]
-            self.detector.settings.child('detector_settings', 'camera_settings', 'encoding').setValue(encoding)
-            QtWidgets.QApplication.processEvents()
-            self.detector.settings.child('detector_settings', 'camera_settings', 'image_settings', 'bin_x').setValue(2)
-            QtWidgets.QApplication.processEvents()
-            self.detector.settings.child('detector_settings', 'camera_settings', 'image_settings', 'bin_y').setValue(2)
-            QtWidgets.QApplication.processEvents()
-        except KeyError as e:  # will fail if a Mock camera is used for testing
-            pass
-        finally:
-            self.detector.viewers[0].show_roi(True, False)
-
-    def setup_docks(self):
+        """Send the camera profile of the config to the detector thread in a single command, the grabber answering
+        with a 'camera_profile_applied' command once the image geometry is set (see setup_viewer)"""
+        profile = dict(exposure_ms=config('micro', 'camera', 'exposure_ms'),
+                       encoding_index=config('micro', 'camera', 'encoding_index'),
+                       binning_x=config('micro', 'camera', 'binning_x'),
+                       binning_y=config('micro', 'camera', 'binning_y'))
+        self.detector.command_hardware.emit(ThreadCommand('apply_camera_profile', [profile]))
+
+    def setup_viewer(self):
+        """Place the viewer docks and show the ROI, once the camera profile has been applied"""
+        if self._viewer_ready:
+            return
         for dock in self.detector.viewer_docks:
             self.detector.dockarea.moveDock(dock, 'right', self.led_control.dock_manual)
+        self.dockarea.addDock(self.scan_live_dock, 'bottom', self.detector.viewer_docks[0])
+        self.scan_live_dock.setVisible(False)
+        self.detector.viewers[0].show_roi(True, False)
+        self._viewer_ready = True
+
+    def setup_docks(self):
         self.dockarea.moveDock(self.led_control.dock_sequence, 'bottom', self.led_control.dock_manual)
         self.dockarea.moveDock(self.steps_sequencer.dock, 'bottom', self.led_control.dock_manual)
         self.dockarea.moveDock(self.manual_actuation.dock, 'right', self.led_control.dock_manual)
@@ -92,10 +176,8 @@ class MicroMOKE(CustomApp):
 
         self.scan_live_dock = Dock('Live Scan Plot')
         widget = QtWidgets.QWidget()
-        self.scan_live_viewer = Viewer1D(widget)
+        self.scan_live_viewer = LiveLoopPlot(widget)
         self.scan_live_dock.addWidget(widget)
-        self.dockarea.addDock(self.scan_live_dock, 'bottom', self.detector.viewer_docks[0])
-        self.scan_live_dock.setVisible(False)
 
     def setup_actions(self):
         self.add_action('quit', 'Quit', 'close2', "Quit program")
@@ -141,15 +223,22 @@ class MicroMOKE(CustomApp):
 
         self.connect_action('config', self.show_config)
 
-        self.led_control.led_manual_control.leds_value.connect(self.set_LEDs)
+        self.led_control.led_manual_control.leds_value.connect(self.led_coalescer.push)
+        self.led_coalescer.value_signal.connect(self.set_LEDs)
         self.led_control.led_type_signal.connect(self.set_led_type)
         self.led_control.led_sequence_control.sequence_signal.connect(self.set_led_type)
 
         self.detector.custom_sig.connect(self.info_detector)
+        self.led_actuator.custom_sig.connect(self.info_led)
+        self.detector.grab_done_signal.connect(self.update_live_viewer)
+        self.current_actuator.move_done_signal.connect(self.update_live_actuator)
 
         self.manual_actuation.actuation_signal.connect(self.current_actuator.move)
 
         self.steps_sequencer.scanner_parameter.connect(self.update_scanner)
+        self.steps_sequencer.positions_signal.connect(self.update_scanner_positions)
+        self.steps_sequencer.adaptive_signal.connect(self.run_adaptive_scan)
+        self.adaptive_scan.finished_signal.connect(self.adaptive_scan_done)
 
     def save_layout(self):
         layout.save_layout_state(self.dockarea)
@@ -161,6 +250,12 @@ class MicroMOKE(CustomApp):
         self.setup_scan()
         self.dashboard.scan_module.scanner.scanner.settings.child('parsed_string').setValue(param.value())
 
+    def update_scanner_positions(self, positions: np.ndarray):
+        """Set the positions of the DAQ_Scan as they are, with a tabular scanner"""
+        self.setup_scan()
+        self.dashboard.scan_module.scanner.set_scan_type_and_subtypes('Tabular', 'Linear')
+        self.dashboard.scan_module.scanner.scanner.update_tabular_positions(np.reshape(positions, (-1, 1)))
+
     def show_dashboard(self, show=True):
         self.dashboard.mainwindow.setVisible(show)
 
@@ -179,13 +274,28 @@ class MicroMOKE(CustomApp):
 
     def info_detector(self, status):
         if status.command == 'stopped':
+            if self._phases is not None:
+                # the restarted sequence is synchronized on the next camera readout, whenever the camera restarts
+                self.detector.command_hardware.emit(ThreadCommand('reconfigure_phases', [self._phases, 0, True]))
             self.led_actuator.command_hardware.emit(ThreadCommand('update_tasks'))
             logger.debug('stopped')
+        elif status.command == 'camera_profile_applied':
+            logger.info(f'Camera profile applied: {status.attribute[0]}')
+            self.setup_viewer()
+        elif status.command == 'display_levels':
+            set_viewer_levels(self.detector.ui.viewers[0], status.attribute[0])
+
+    def info_led(self, status):
+        if status.command == 'leds_synchronized':
+            self.detector.command_hardware.emit(ThreadCommand('synchronize_phases', status.attribute))
 
     def set_LEDs(self, led_values):
-        self.led_actuator.command_hardware.emit(ThreadCommand('set_leds_external', [led_values]))
-        if self.is_action_checked('toggle_sequence'):
-            self.set_led_type()
+        camera_idle = not self.detector.grab_state
+        if self._phases is not None:
+            # in sequence mode the driver restarts its tasks with the new waveform at a camera readout, without
+            # stopping the camera, the grabber restarting its average from there
+            self.detector.command_hardware.emit(ThreadCommand('reconfigure_phases', [self._phases, 0, True]))
+        self.led_actuator.command_hardware.emit(ThreadCommand('set_leds_external', [led_values, camera_idle]))
 
     def set_led_type(self, led_type=None):
         if not isinstance(led_type, dict):
@@ -195,26 +305,30 @@ class MicroMOKE(CustomApp):
                 sequence = self.led_control.led_sequence_control.sequence
                 led_state = dict(top=False, bottom=False, left=False, right=False)
                 for seq in sequence:
-                    for led in seq:
-                        if seq[led] is True:
+                    for led in led_state:
+                        if seq.get(led, 0.) > 0.:
                             led_state[led] = True
                 for led in led_state:
                     self.led_control.led_manual_control.leds[led].set_as(led_state[led])
-                led_type = dict(sequence=sequence)
-
-        was_grabing = False
-        if self.detector.grab_state:
-            was_grabing = True
-            self.detector.stop()
+                led_type = dict(sequence=sequence, blank=self.led_control.led_sequence_control.blank)
 
-        QtWidgets.QApplication.processEvents()
-        self.led_actuator.command_hardware.emit(ThreadCommand('set_led_type', [led_type]))
+        phases = phase_pattern(led_type['sequence']) if 'sequence' in led_type else [1]
+        do_sub = min(phases) < 0
         if 'sequence' in led_type:
-            do_sub = len(led_type['sequence']) > 1
+            # the camera keeps grabbing: the LED driver starts its sequence at a camera readout and reports it, the
+            # grabber dropping the frames until the first one exposed with the first step of the sequence
+            self._phases = phases
+            self.detector.command_hardware.emit(ThreadCommand('reconfigure_phases', [phases, 0, True]))
         else:
-            do_sub = False
-        self.detector.command_hardware.emit(ThreadCommand('activate_substraction', [do_sub]))
-        if not do_sub:
+            # no phase to keep, only the frames acquired while the LEDs switch are dropped
+            self._phases = None
+            self.detector.command_hardware.emit(ThreadCommand('reconfigure_phases',
+                                                              [phases, config('micro', 'camera', 'transition_frames')]))
+        self.led_actuator.command_hardware.emit(ThreadCommand('set_led_type', [led_type]))
+        if self.detector.settings.child('detector_settings', 'display', 'levels').value():
+            # the levels are computed by the grabber and sent with the displayed frames
+            self.detector.ui.viewers[0].set_gradient('red', 'bipolar' if do_sub else 'grey')
+        elif not do_sub:
             self.detector.ui.viewers[0].set_gradient('red', 'grey')
             self.detector.ui.viewers[0].set_action_checked('auto_levels_sym', False)
             self.detector.ui.viewers[0].get_action('auto_levels_sym').trigger()
@@ -225,10 +339,6 @@ class MicroMOKE(CustomApp):
             self.detector.ui.viewers[0].set_action_checked('auto_levels_sym', True)
             self.detector.ui.viewers[0].get_action('autolevels').trigger()
             self.detector.ui.viewers[0].get_action('auto_levels_sym').trigger()
-        QtWidgets.QApplication.processEvents()
-
-        if was_grabing:
-            self.detector.grab()
 
 
 def main():
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_moke.hardware.adaptive_scan import AdaptiveStepper
+
+
+class SquareLoopSample:
+    """Hysteretic sample: the magnetization switches to -1 below -coercive and to +1 above coercive, with a small
+    reversible slope, so that stepping the field backwards after a switch stays on the switched branch"""
+
+    def __init__(self, coercive=0.15, slope=0.05):
+        self.coercive = coercive
+        self.slope = slope
+        self.m = 1.
+
+    def measure(self, field):
+        if field <= -self.coercive:
+            self.m = -1.
+        elif field >= self.coercive:
+            self.m = 1.
+        return self.m + self.slope * field
+
+    def branch_value(self, field, ind_branch):
+        """The signal on the major loop branch (0: descending, 1: ascending)"""
+        if ind_branch == 0:
+            m = -1. if field <= -self.coercive else 1.
+        else:
+            m = 1. if field >= self.coercive else -1.
+        return m + self.slope * field
+
+
+def run_loop(stepper, sample, max_points=10000):
+    points = []
+    position = stepper.start_position
+    while position is not None and len(points) < max_points:
+        signal = sample.measure(position)
+        points.append((position, signal, stepper.ind_branch))
+        position = stepper.next_position(position, signal)
+    return np.array(points)
+
+
+def test_points_on_measured_branch():
+    sample = SquareLoopSample()
+    stepper = AdaptiveStepper(amplitude=1., coarse_step=0.1, min_step=0.01, threshold=1.)
+    points = run_loop(stepper, sample)
+    for position, signal, ind_branch in points:
+        assert signal == pytest.approx(sample.branch_value(position, int(ind_branch)))
+
+
+def test_field_never_steps_back_within_branch():
+    stepper = AdaptiveStepper(amplitude=1., coarse_step=0.1, min_step=0.01, threshold=1.)
+    points = run_loop(stepper, SquareLoopSample())
+    for ind in range(1, len(points)):
+        position, ind_branch = points[ind, 0], int(points[ind, 2])
+        start, stop = stepper.branches[ind_branch]
+        if points[ind - 1, 2] == ind_branch and (position - points[ind - 1, 0]) * np.sign(stop - start) < 0:
+            assert position == start  # only a return to saturation
+
+
+def test_switch_resolved_with_fewer_points():
+    sample = SquareLoopSample()
+    stepper = AdaptiveStepper(amplitude=1., coarse_step=0.1, min_step=0.01, threshold=1.)
+    points = run_loop(stepper, sample)
+    Nuniform = 2 * int(round(2 / 0.01)) + 1
+    assert len(points) < Nuniform / 2
+
+    for ind_branch, coercive in ((0, -sample.coercive), (1, sample.coercive)):
+        positions = points[points[:, 2] == ind_branch, 0]
+        # the switching field is bracketed by measured points at most min_step apart
+        below = positions[positions < coercive - 1e-9].max()
+        above = positions[positions >= coercive - 1e-9].min()
+        assert above - below <= 0.01 + 1e-9
+
+
+def test_smooth_loop_step_shrinks():
+    stepper = AdaptiveStepper(amplitude=1., coarse_step=0.1, min_step=0.01, threshold=1.)
+    assert stepper.step(0.) == 0.1
+    assert stepper.step(0.5) == pytest.approx(0.02)
+    assert stepper.step(10.) == 0.01
+
+
+def test_invalid_steps():
+    with pytest.raises(ValueError):
+        AdaptiveStepper(amplitude=1., coarse_step=0., min_step=0.01, threshold=1.)
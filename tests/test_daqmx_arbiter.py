@@ -0,0 +1,109 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_moke.hardware.daqmx_arbiter import DAQmxArbiter
+from pymodaq_plugins_moke.hardware.current_readback import ReadbackCache
+
+
+class FakeTask:
+    """Continuous task returning blocks of a constant value per channel"""
+
+    def __init__(self):
+        self.Nstarts = 0
+        self.Nupdates = 0
+        self.channels = []
+        self.hang = threading.Event()  # set to block the reads
+        self.unblock = threading.Event()
+
+    def update_task(self, channels, clock_settings):
+        self.Nupdates += 1
+        self.channels = channels
+
+    def start(self):
+        self.Nstarts += 1
+
+    def stop(self):
+        pass
+
+    def readAnalog(self, Nchannels, clock_settings):
+        time.sleep(0.002)
+        if self.hang.is_set():
+            self.unblock.wait()
+        return np.repeat(np.arange(Nchannels, dtype=float), clock_settings.Nsamples)
+
+
+def make_arbiter(release_delay=0.):
+    tasks = []
+
+    def factory():
+        tasks.append(FakeTask())
+        return tasks[-1]
+    return DAQmxArbiter(factory, lambda: SimpleNamespace(Nsamples=10, frequency=100.),
+                        release_delay=release_delay), tasks
+
+
+def channels(*names):
+    return [SimpleNamespace(name=f'Dev1/{name}') for name in names]
+
+
+def wait_for(condition, timeout=1.):
+    start = time.perf_counter()
+    while not condition() and time.perf_counter() - start < timeout:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_merged_channels_dispatch():
+    arbiter, tasks = make_arbiter()
+    blocks = dict(first=[], second=[])
+    first = arbiter.subscribe(channels('ai0', 'ai1'), blocks['first'].append)
+    second = arbiter.subscribe(channels('ai1'), blocks['second'].append)
+    assert wait_for(lambda: len(blocks['second']) > 0)
+    arbiter.unsubscribe(first)
+    arbiter.unsubscribe(second)
+    assert np.all(blocks['first'][-1][0] == 0.) and np.all(blocks['first'][-1][1] == 1.)
+    assert blocks['second'][-1].shape == (1, 10) and np.all(blocks['second'][-1] == 1.)
+    assert len(tasks) == 1
+
+
+def test_acquire_suspends_cache_and_release_is_delayed():
+    arbiter, tasks = make_arbiter(release_delay=0.1)
+    cache = ReadbackCache()
+    subscription = arbiter.subscribe(channels('ai0'), cache.push, cache.suspend)
+    assert cache.wait(1.)
+
+    arbiter.acquire('Dev1/ai0')
+    assert cache.suspended and cache.latest == (None, None)
+    arbiter.release('Dev1/ai0')
+    arbiter.acquire('Dev1/ai0')  # the next point of a scan, within the release delay
+    time.sleep(0.15)
+    assert tasks[0].Nstarts == 1 and cache.suspended  # the shared task was not restarted in between
+    arbiter.release('Dev1/ai0')
+    assert wait_for(lambda: not cache.suspended)
+    assert tasks[0].Nstarts == 2
+    arbiter.unsubscribe(subscription)
+
+
+def test_no_reconfiguration_while_the_reader_hangs():
+    arbiter, tasks = make_arbiter()
+    blocks = []
+    subscription = arbiter.subscribe(channels('ai0'), blocks.append)
+    assert wait_for(lambda: len(blocks) > 0)
+    tasks[0].hang.set()
+    time.sleep(0.05)
+    with pytest.raises(RuntimeError):
+        arbiter.acquire('Dev1/ai0')
+    with pytest.raises(RuntimeError):
+        arbiter.subscribe(channels('ai1'), blocks.append)
+    assert tasks[0].Nupdates == 1  # the task was not touched under the reader
+
+    tasks[0].unblock.set()  # the read returns, the thread exits
+    tasks[0].hang.clear()
+    other = arbiter.subscribe(channels('ai1'), blocks.append)
+    assert tasks[0].Nupdates == 2 and [channel.name for channel in tasks[0].channels] == ['Dev1/ai0', 'Dev1/ai1']
+    arbiter.unsubscribe(other)
+    arbiter.unsubscribe(subscription)
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from pymodaq.utils.daq_utils import ThreadCommand
+
+from pymodaq_plugins_moke import headless
+
+
+class FakeActuator:
+    def __init__(self):
+        self.move_done_signal = mock.MagicMock()
+        self.targets = []
+        self.Nstops = 0
+
+    def move(self, move_command):
+        self.targets.append(move_command.value)
+
+    def stop_motion(self):
+        self.Nstops += 1
+
+
+class FakeDetector:
+    def __init__(self):
+        self.grab_done_signal = mock.MagicMock()
+        self.custom_sig = mock.MagicMock()
+        self.settings = mock.MagicMock()
+        self.command_hardware = mock.MagicMock()
+        self.Nsnaps = 0
+        self.Nstops = 0
+
+    def snap(self):
+        self.Nsnaps += 1
+
+    def stop_grab(self):
+        self.Nstops += 1
+
+
+class FakeData:
+    def __init__(self, value):
+        self.data = [np.array([value])]
+
+    def __len__(self):
+        return 1
+
+
+class FakeDataToExport:
+    def __init__(self, value, timestamp=None):
+        self.value = value
+        self.data = [mock.Mock(timestamp=time.time() if timestamp is None else timestamp)]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def get_data_from_dim(self, dim):
+        return FakeData(self.value) if dim == 'Data0D' else []
+
+
+class FakeWriter:
+    written = []
+
+    def __init__(self, path, step):
+        self.points = []
+        FakeWriter.written.append((step['name'], self.points))
+
+    def append(self, position, signal, frame=None):
+        self.points.append((position, signal))
+
+    def close(self):
+        pass
+
+
+def make_runner(monkeypatch, tmp_path):
+    monkeypatch.setattr(headless, 'StepWriter', FakeWriter)
+    monkeypatch.setattr(headless, 'MoveCommand', lambda move_type, value: mock.Mock(value=value))
+    FakeWriter.written = []
+    actuator = FakeActuator()
+    detector = FakeDetector()
+    mods = dict(Current=actuator, Camera=detector, LedDriver=None)
+    dashboard = mock.Mock()
+    dashboard.modules_manager.get_mod_from_name = lambda name, mod: mods[name]
+    recipe = dict(output_dir=str(tmp_path), timeout_s=1.,
+                  steps=[dict(name='first', loops=[dict(amplitude=1., step=1.)]),
+                         dict(name='second', loops=[dict(amplitude=1., step=1.)])])
+    runner = headless.RecipeRunner(dashboard, recipe)
+    runner.watchdog = mock.MagicMock()
+    runner.start()
+    return runner, actuator, detector
+
+
+def test_stale_signals_after_move_timeout(monkeypatch, tmp_path):
+    runner, actuator, detector = make_runner(monkeypatch, tmp_path)
+    Npoints = runner.positions.size
+    runner.moved()
+    runner.grabbed(FakeDataToExport(1.))
+
+    runner.point_timeout()  # the second move of the first step hangs
+    assert runner.Nfailed == 1
+    assert actuator.Nstops == 1
+    assert runner.ind_step == 0  # waiting for the actuator to stop
+    runner.grabbed(FakeDataToExport(2.))  # nothing to grab
+    assert detector.Nsnaps == 1
+
+    runner.moved()  # the stop of the aborted move
+    assert runner.ind_step == 1
+    assert len(actuator.targets) == 3
+    for ind in range(Npoints):
+        runner.moved()
+        runner.grabbed(FakeDataToExport(float(ind)))
+        runner.grabbed(FakeDataToExport(-1.))  # duplicated frame, ignored
+    assert FakeWriter.written[0][1] == [(actuator.targets[0], 1.)]
+    assert [point[1] for point in FakeWriter.written[1][1]] == list(range(Npoints))
+
+
+def test_stale_frame_after_grab_timeout(monkeypatch, tmp_path):
+    runner, actuator, detector = make_runner(monkeypatch, tmp_path)
+    runner.moved()
+    late_frame = FakeDataToExport(-1.)  # created by the hanging snap of the first point...
+    runner.point_timeout()
+    assert detector.Nstops == 1
+    assert detector.command_hardware.emit.call_args[0][0].command == 'mark_frames'
+    assert runner.ind_step == 0  # waiting for the detector mark
+
+    runner.info_detector(ThreadCommand('frames_marked', [time.time()]))
+    assert runner.ind_step == 1
+    runner.moved()  # the first move of the second step
+    assert detector.Nsnaps == 2
+    runner.grabbed(late_frame)  # ...but received after the next snap
+    runner.grabbed(FakeDataToExport(1.))
+    assert FakeWriter.written[0][1] == []
+    assert FakeWriter.written[1][1] == [(actuator.targets[1], 1.)]
+
+
+def test_one_step_recipe_with_mock_preset(tmp_path):
+    """Run a recipe step with the modules of MokeMicro_Mock.xml, offscreen, and read back the written HDF5 file"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    tables = pytest.importorskip('tables')
+    QtWidgets = pytest.importorskip('qtpy.QtWidgets')
+    from qtpy import QtCore
+    from pymodaq.utils.daq_utils import get_plugins
+    if 'CurrentMock' not in [plugin['name'] for plugin in get_plugins('daq_move')]:
+        pytest.skip('the moke plugins are not installed')
+    from pymodaq.utils.gui_utils import DockArea
+    from pymodaq.dashboard import DashBoard
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    win = QtWidgets.QMainWindow()
+    area = DockArea()
+    win.setCentralWidget(area)
+    dashboard = DashBoard(area)
+    dashboard.set_preset_mode(Path(headless.__file__).parent.joinpath('resources', 'MokeMicro_Mock.xml'))
+    recipe = dict(output_dir=str(tmp_path), timeout_s=10.,
+                  steps=[dict(name='one', loops=[dict(amplitude=1., step=1.)])])
+    runner = headless.RecipeRunner(dashboard, recipe)
+    results = []
+    loop = QtCore.QEventLoop()
+    runner.finished_signal.connect(results.append)
+    runner.finished_signal.connect(loop.quit)
+    QtCore.QTimer.singleShot(0, runner.start)
+    QtCore.QTimer.singleShot(60000, loop.quit)
+    try:
+        loop.exec()
+    finally:
+        dashboard.quit_fun()
+    assert results == [0]
+
+    with tables.open_file(str(tmp_path.joinpath('000_one.h5'))) as h5file:
+        np.testing.assert_allclose(h5file.root.positions[:], [1., 0., -1., 0., 1.])
+        assert h5file.root.signal.shape == (5,) and np.all(np.isfinite(h5file.root.signal[:]))
+        assert h5file.root.frames.shape[0] == 5 and h5file.root.frames.ndim == 3
+        assert json.loads(h5file.root._v_attrs.recipe_step)['name'] == 'one'
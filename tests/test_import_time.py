@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import pymodaq_plugins_moke
+
+# run in a fresh interpreter: the plugins are discovered (and imported) by pymodaq at its first import
+BENCHMARK = """
+import json
+import sys
+from pathlib import Path
+from time import perf_counter
+
+start = perf_counter()
+from pymodaq.utils.daq_utils import get_plugins
+plugins = [plugin['name'] for plugin_type in ['daq_move', 'daq_0Dviewer', 'daq_1Dviewer', 'daq_2Dviewer']
+           for plugin in get_plugins(plugin_type)]
+discovery = perf_counter() - start
+
+from pymodaq_plugins_moke.hardware.nidaq_enumeration import get_enumeration
+queries = len(get_enumeration()._cache)
+grabber_imported = 'pymodaq_plugins_moke.hardware.moke_grabber' in sys.modules
+
+from qtpy import QtWidgets
+from pymodaq.utils.gui_utils import DockArea
+from pymodaq.dashboard import DashBoard
+app = QtWidgets.QApplication(sys.argv)
+win = QtWidgets.QMainWindow()
+area = DockArea()
+win.setCentralWidget(area)
+dashboard = DashBoard(area)
+start = perf_counter()
+dashboard.set_preset_mode(Path(sys.argv[1]))
+preset = perf_counter() - start
+modules = dashboard.modules_manager.actuators_name + dashboard.modules_manager.detectors_name
+dashboard.quit_fun()
+print(json.dumps(dict(plugins=plugins, discovery=discovery, queries=queries, grabber_imported=grabber_imported,
+                      preset=preset, modules=modules)))
+"""
+
+
+def test_plugins_import_without_hardware():
+    """Discover the plugins and load MokeMicro_Mock.xml, checking that no hardware was queried on the way"""
+    pytest.importorskip('qtpy.QtWidgets')
+    preset = Path(pymodaq_plugins_moke.__file__).parent.joinpath('resources', 'MokeMicro_Mock.xml')
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    process = subprocess.run([sys.executable, '-c', BENCHMARK, str(preset)], capture_output=True, text=True,
+                             env=env, timeout=240)
+    assert process.returncode == 0, process.stderr
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    if 'CurrentMock' not in result['plugins']:
+        pytest.skip('the moke plugins are not installed')
+    print(f"plugins discovery: {result['discovery']:.2f}s, MokeMicro_Mock.xml loaded in {result['preset']:.2f}s")
+
+    # the daqmx and andor based plugins are listed whether or not their hardware packages are installed
+    for name in ['Current', 'LedDC4104', 'ReadCurrent', 'MokeMacro', 'MOKEGrabber']:
+        assert name in result['plugins']
+    assert result['queries'] == 0
+    assert not result['grabber_imported']
+    assert sorted(result['modules']) == ['Camera', 'Current']
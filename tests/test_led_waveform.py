@@ -0,0 +1,43 @@
+import numpy as np
+
+from pymodaq_plugins_moke.hardware.led_waveform import LedWaveformCompiler, phase_pattern
+
+channels = ['top', 'left', 'right', 'bottom']
+
+
+def test_blank_sequence():
+    compiler = LedWaveformCompiler(channels)
+    waveform, changed = compiler.compile([dict(top=1.), dict(bottom=0.5)], [2., 1., 1., 3.], blank=True)
+    assert waveform.shape == (4, 4)
+    assert waveform.flags['C_CONTIGUOUS']
+    assert np.allclose(waveform[0], [2., 0., 0., 0.])
+    assert np.allclose(waveform[3], [0., 0., 1.5, 0.])
+    assert np.allclose(waveform[1:3], 0.)
+    assert np.all(changed == np.arange(4))
+
+
+def test_unblanked_sequence_holds_each_step_on_both_edges():
+    compiler = LedWaveformCompiler(channels)
+    waveform, _ = compiler.compile([dict(top=1.), dict(bottom=1.)], [1., 1., 1., 1.], blank=False)
+    # exposure and readout samples of a step are equal: every step is lit during an exposure
+    assert np.allclose(waveform[0], [1., 1., 0., 0.])
+    assert np.allclose(waveform[3], [0., 0., 1., 1.])
+
+
+def test_repeat_and_partial_update():
+    compiler = LedWaveformCompiler(channels)
+    sequence = [dict(top=1., repeat=2), dict(bottom=1.)]
+    waveform, _ = compiler.compile(sequence, [1., 1., 1., 1.])
+    assert np.allclose(waveform[0], [1., 0., 1., 0., 0., 0.])
+    waveform, changed = compiler.compile(sequence, [1., 1., 1., 2.])
+    assert list(changed) == [3]
+    assert np.allclose(waveform[3], [0., 0., 0., 0., 2., 0.])
+    _, changed = compiler.compile(sequence, [1., 1., 1., 2.])
+    assert changed.size == 0
+
+
+def test_phase_pattern():
+    assert phase_pattern([dict(top=1.)]) == [1]
+    assert phase_pattern([dict(top=1.), dict(bottom=1.)]) == [1, -1]
+    assert phase_pattern([dict(top=1., repeat=2), dict(bottom=1., repeat=2)]) == [1, 1, -1, -1]
+    assert phase_pattern([dict(top=1.), dict(bottom=1.), dict(left=1., sign=0)]) == [1, -1, 0]
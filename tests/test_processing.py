@@ -0,0 +1,48 @@
+import numpy as np
+
+from pymodaq_plugins_moke.hardware.processing import minmax_decimate, find_zero_crossings, resample_cycles
+
+
+def test_minmax_decimate_keeps_peaks():
+    x_axis = np.arange(10000, dtype=float)
+    signal = np.sin(2 * np.pi * x_axis / 2500)
+    signal[1234] = 5.
+    signal[7777] = -5.
+    (x_decimated, x_cosine), (decimated, cosine) = minmax_decimate(x_axis, [signal, np.cos(signal)], 100)
+    assert x_decimated.size == decimated.size <= 102
+    assert decimated.max() == 5. and decimated.min() == -5.
+    assert np.all(np.diff(x_decimated) > 0)
+    # each signal is kept at its own samples, on its own axis
+    np.testing.assert_array_equal(decimated, signal[x_decimated.astype(int)])
+    np.testing.assert_array_equal(cosine, np.cos(signal)[x_cosine.astype(int)])
+    assert not np.array_equal(x_decimated, x_cosine)
+
+
+def test_minmax_decimate_order_and_remainder():
+    x_axis = np.arange(11, dtype=float)
+    signal = np.array([0., 3., 1., 2., -1., 0., 4., 4., 0., 7., 8.])
+    (x_decimated,), (decimated,) = minmax_decimate(x_axis, [signal], 6)
+    # buckets of 4 samples: the min and max in their chronological order, the last 3 samples kept as is
+    np.testing.assert_array_equal(decimated, [0., 3., -1., 4., 0., 7., 8.])
+    np.testing.assert_array_equal(x_decimated, [0., 1., 4., 6., 8., 9., 10.])
+
+
+def test_minmax_decimate_short_signal_unchanged():
+    x_axis = np.arange(10, dtype=float)
+    (x_decimated,), signals = minmax_decimate(x_axis, [x_axis ** 2], 1000)
+    assert x_decimated is x_axis
+    np.testing.assert_array_equal(signals[0], x_axis ** 2)
+
+
+def test_zero_crossings_and_cycles():
+    length = 200
+    phase_offset = 37.3
+    t = np.arange(5 * length, dtype=float)
+    field = np.sin(2 * np.pi * (t - phase_offset) / length) + 0.01 * np.sin(2 * np.pi * t / 7)
+    crossings = find_zero_crossings(field, min_distance=length / 2)
+    np.testing.assert_allclose(np.diff(crossings), length, atol=1.)
+    assert abs(crossings[0] - phase_offset) < 1.
+
+    cycles, = resample_cycles(crossings, [t], length)
+    assert cycles.shape == (crossings.size - 1, length)
+    np.testing.assert_allclose(cycles[:, 0], crossings[:-1])
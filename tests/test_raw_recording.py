@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_moke.hardware.raw_recording import RawRecorder, RawReplay
+
+
+def test_record_and_replay(tmp_path):
+    path = tmp_path.joinpath('raw.bin')
+    blocks = [np.arange(6, dtype=float) + 10 * ind for ind in range(3)]
+    recorder = RawRecorder(path, ['ai0', 'ai1'], 1000., 3, gain=500.)
+    for block in blocks:
+        recorder.write(block)
+    recorder.close()
+    assert recorder.Nblocks == 3
+
+    replay = RawReplay(path)
+    assert replay.channels == ['ai0', 'ai1']
+    assert replay.Nsamples == 3 and replay.frequency == 1000. and replay.header['gain'] == 500.
+    assert replay.Nblocks == 3
+    assert replay.block_duration == pytest.approx(3e-3)
+    for ind in range(4):  # looping back to the first block
+        np.testing.assert_array_equal(replay.next_block(), blocks[ind % 3])
+    replay.close()
+
+
+def test_invalid_block_and_file(tmp_path):
+    path = tmp_path.joinpath('raw.bin')
+    recorder = RawRecorder(path, ['ai0'], 1000., 4)
+    with pytest.raises(ValueError):
+        recorder.write(np.zeros((3,)))
+    recorder.close()
+    with pytest.raises(IOError):
+        RawReplay(path)  # no block
+
+    other = tmp_path.joinpath('other.bin')
+    other.write_bytes(b'not a recording')
+    with pytest.raises(IOError):
+        RawReplay(other)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_moke.hardware.settling import SettlingModel, settling_time
+
+
+def test_settling_time_exponential_step():
+    tau, latency, delta, epsilon = 0.005, 0.002, 1., 0.01
+    times = 10. + np.arange(0.001, 0.1, 0.001)
+    values = delta * (1 - np.exp(-np.clip(times - 10. - latency, 0, None) / tau))
+    expected = latency + tau * np.log(delta / epsilon)
+    assert settling_time(times, values, delta, epsilon, 10.) == pytest.approx(expected, abs=0.001)
+
+
+def test_settling_time_ignores_samples_before_start_and_overshoots():
+    times = np.arange(10) * 0.01
+    values = np.array([5., 5., 0., 1., 0.5, 1.2, 1., 1., 1., 1.])
+    # the samples before the start are not considered, the overshoot at 0.05 delays the settling
+    assert settling_time(times, values, 1., 0.1, 0.015) == pytest.approx(0.06 - 0.015)
+
+
+def test_settling_time_not_settled():
+    times = np.arange(5) * 0.01
+    assert settling_time(times, np.zeros((5,)), 1., 0.1, 0.) is None
+
+
+def test_model_fit():
+    model = SettlingModel(a=0., tau=0.001)
+    a, tau, epsilon = 0.003, 0.007, 0.005
+    for delta in (0.01, 0.05, 0.1, 0.5, 1.):
+        model.add_measurement(delta, epsilon, a + tau * np.log(delta / epsilon))
+    assert model.a == pytest.approx(a)
+    assert model.tau == pytest.approx(tau)
+    assert model.predict(0.2, epsilon) == pytest.approx(a + tau * np.log(0.2 / epsilon))
+    assert model.predict(0.001, epsilon) == pytest.approx(a)
+
+
+def test_model_bounds():
+    model = SettlingModel(a=0.002, tau=0.005, max_time=0.01)
+    assert model.predict(1e6, 0.001) == 0.01
+    model.add_measurement(0.001, 0.005, 1.)  # within epsilon: not informative
+    assert model.count == 0
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_moke.hardware.sweep import SweepBuilder
+
+
+@pytest.fixture
+def sparse_scanner():
+    """pymodaq's own Scan1DSparse, parsing the strings as the DAQ_Scan does"""
+    QtWidgets = pytest.importorskip('qtpy.QtWidgets')
+    scanners = pytest.importorskip('pymodaq.utils.scanner.scanners._1d_scanners')
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    return scanners.Scan1DSparse([SimpleNamespace(title='Current', units='A')])
+
+
+def test_major_loop():
+    builder = SweepBuilder()
+    builder.add_major_loop(1., 0.5, repeat=2)
+    cycle = [0.5, 0., -0.5, -1., -0.5, 0., 0.5, 1.]
+    np.testing.assert_allclose(builder.positions, [1.] + 2 * cycle)
+    assert builder.npoints == 17
+
+
+def test_loops_junction_and_cache():
+    builder = SweepBuilder()
+    builder.add_major_loop(1., 0.5)
+    positions = builder.positions
+    assert builder.positions is positions  # cached
+    builder.add_minor_loop(0.5, 0.5, 0.25)
+    assert len(builder) == 2
+    # the minor loop starts where the major one ends: the junction point is not duplicated
+    np.testing.assert_allclose(builder.positions[:positions.size], positions)
+    assert builder.npoints == positions.size + 8
+    assert 'Minor(0.5±0.5' in builder.describe()
+    builder.add_minor_loop(0., 0.25, 0.25)
+    assert builder.describe().endswith('Minor(0±0.25, step 0.25, x1)')  # labelled by kind, not by offset
+    builder.clear()
+    assert builder.npoints == 0 and builder.to_sparse_string() == ''
+
+
+def test_exponent_densifies_the_center():
+    branch = SweepBuilder.compile_loop(0., 1., 0.1, exponent=2.)[:21]
+    steps = np.abs(np.diff(branch))
+    assert branch[0] == 1. and branch[-1] == -1.
+    assert steps[9] < steps[0] / 5
+
+
+@pytest.mark.parametrize('exponent', [1., 3.])
+def test_sparse_string_round_trip(sparse_scanner, exponent):
+    builder = SweepBuilder()
+    builder.add_major_loop(2., 0.25, repeat=2, exponent=exponent)
+    builder.add_minor_loop(-1., 0.5, 0.1)
+    string = builder.to_sparse_string()
+    sparse_scanner.settings.child('parsed_string').setValue(string)
+    sparse_scanner.set_scan()
+    np.testing.assert_allclose(np.squeeze(sparse_scanner.positions), builder.positions, atol=1e-6)
+    if exponent == 1.:
+        assert string.startswith('2:-0.25:-2,')
+
+
+def test_invalid_loop():
+    with pytest.raises(ValueError):
+        SweepBuilder().add_major_loop(0., 0.1)
+    with pytest.raises(ValueError):
+        SweepBuilder().add_minor_loop(1., 1., -0.1)